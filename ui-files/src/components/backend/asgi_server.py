@@ -0,0 +1,548 @@
+# asgi_server.py
+#
+# Async serving mode. One asyncio event loop hosts everything the Flask
+# services run separately: the BCI data endpoints (bci_api.py), the
+# prediction service (realtime_predict_api.py), the model job endpoints
+# (run-model.py) and the recorder started by /start_eeg (server.py). The same
+# routes are served on the usual ports 5000, 5001 and 6000, so the UI does not
+# change.
+#
+# Nothing blocks the loop: model runs go to the warm model worker, model
+# loads, predictions and file reads to threads, recordings to the warm
+# recorder worker (recorder_supervisor.py), stopped with the server. The
+# headset callback still runs on the SDK's own thread and publishes snapshots
+# that handlers read without locking (see bci_api.py).
+#
+# Needs uvicorn (pip install uvicorn); the Flask entry points stay as they are.
+#
+#   python asgi_server.py
+#   python asgi_server.py --no-sensor --no-predictor --ports 5000
+#   uvicorn asgi_server:app --port 5000        (one port, default options)
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import socket
+import threading
+from urllib.parse import parse_qsl
+
+import bci_api
+import realtime_predict_api as predictor
+from recorder_supervisor import RecorderSupervisor
+from results_stream import ResultsQueryError, parse_results_query, stream_results
+import session_store
+from session_store import SessionStoreError, parse_session_query, sessions_result, stream_session
+
+# run-model.py is not importable by its file name
+run_model = importlib.import_module('run-model')
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PORTS = (5000, 5001, 6000)
+
+# How often the snapshot watcher looks for new readings to push to
+# /api/stream subscribers
+STREAM_POLL_SECONDS = 0.02
+STREAM_KEEPALIVE_SECONDS = 15
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-expose-headers', b'ETag, X-Reading-Seq'),
+]
+
+
+# === Requests and Responses ===
+class Request:
+    __slots__ = ('scope', 'receive', 'method', 'path', 'query', 'headers')
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = {}
+        for key, value in parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True):
+            # First value wins, as with Flask's request.args.get
+            self.query.setdefault(key, value)
+        self.headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope['headers']}
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self.receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def json(self):
+        """Parsed JSON body, or None (like get_json(silent=True))."""
+        try:
+            return json.loads(await self.body())
+        except ValueError:
+            return None
+
+
+class Response:
+    def __init__(self, body=b'', status=200, headers=None, media_type=None):
+        self.body = body
+        self.status = status
+        self.headers = [(k.lower().encode('latin-1'), str(v).encode('latin-1'))
+                        for k, v in (headers or {}).items()]
+        if media_type:
+            self.headers.append((b'content-type', media_type.encode('latin-1')))
+        self.headers += CORS_HEADERS
+
+    async def __call__(self, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': self.headers + [(b'content-length', str(len(self.body)).encode())]})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class StreamingResponse(Response):
+    """Body from an async iterator of bytes; stops when the client goes away."""
+
+    async def __call__(self, receive, send):
+        async def stream():
+            await send({'type': 'http.response.start', 'status': self.status, 'headers': self.headers})
+            async for chunk in self.body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(disconnected())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception():
+                raise task.exception()
+
+
+def json_response(payload, status=200, headers=None):
+    return Response(bci_api.dumps(payload), status, headers, 'application/json')
+
+
+async def file_response(path, media_type, download_name=None):
+    with open(path, 'rb') as f:
+        body = await asyncio.to_thread(f.read)
+    headers = {'Content-Disposition': f'attachment; filename={download_name}'} if download_name else None
+    return Response(body, 200, headers, media_type)
+
+
+async def iterate_in_thread(chunks, first=None):
+    # Blocking generators (file reads, compression) advance one chunk per
+    # thread hop, so the loop stays free in between
+    if first is not None:
+        yield first
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+# === Routing ===
+ROUTES = {}
+
+
+def route(path, methods=('GET',)):
+    def register(handler):
+        ROUTES[path] = (frozenset(methods), handler)
+        return handler
+    return register
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    request = Request(scope, receive)
+    entry = ROUTES.get(request.path)
+    if request.method == 'OPTIONS':
+        # CORS preflight (the UI posts JSON cross-origin)
+        response = Response(b'', 204, {
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+            'Access-Control-Allow-Headers': request.headers.get('access-control-request-headers', '*'),
+        })
+    elif entry is None:
+        response = json_response({'error': 'Not found'}, 404)
+    elif request.method not in entry[0]:
+        response = json_response({'error': 'Method not allowed'}, 405)
+    else:
+        try:
+            response = await entry[1](request)
+        except Exception as e:
+            print(f"Error handling {request.method} {request.path}: {e}")
+            response = json_response({'error': f'Unexpected error: {e}'}, 500)
+    await response(receive, send)
+
+
+# === BCI Data (bci_api.py) ===
+_snapshot_changed = asyncio.Event()
+
+
+async def snapshot_watch_loop():
+    # One task notices new readings and wakes every /api/stream subscriber,
+    # instead of each subscriber polling on its own
+    global _snapshot_changed
+    seq = bci_api.snapshot.seq
+    while True:
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+        if bci_api.snapshot.seq != seq:
+            seq = bci_api.snapshot.seq
+            changed, _snapshot_changed = _snapshot_changed, asyncio.Event()
+            changed.set()
+
+
+def _parse_seq(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@route('/api/data')
+async def api_data(request):
+    snap = bci_api.snapshot
+    etag = f'"{bci_api.data_etag(snap)}"'
+    headers = {'ETag': etag, 'X-Reading-Seq': snap.seq, 'Cache-Control': 'no-cache'}
+    if etag in (t.strip() for t in request.headers.get('if-none-match', '').split(',')):
+        return Response(b'', 304, headers)
+    body = bci_api.data_body(snap, _parse_seq(request.query.get('since')))
+    return Response(body, 200, headers, 'application/json')
+
+
+@route('/api/stream')
+async def api_stream(request):
+    """Server-sent events: each event is the JSON list of readings that are new
+    since the previous one, with the newest seq as event id."""
+    since = _parse_seq(request.query.get('since') or request.headers.get('last-event-id'))
+    if since is None:
+        since = bci_api.snapshot.seq
+    elif since > bci_api.snapshot.seq:
+        # Resuming from before a bci_api restart: start over with the whole history
+        since = 0
+
+    async def events():
+        nonlocal since
+        while True:
+            changed = _snapshot_changed
+            snap = bci_api.snapshot
+            if snap.seq > since:
+                yield b'id: %d\ndata: %s\n\n' % (snap.seq, bci_api.data_body(snap, since))
+                since = snap.seq
+                continue
+            try:
+                await asyncio.wait_for(changed.wait(), STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+
+    return StreamingResponse(events(), 200, {'Cache-Control': 'no-cache'}, 'text/event-stream')
+
+
+# === Predictions (realtime_predict_api.py) ===
+async def model_watch_loop():
+    while True:
+        await asyncio.sleep(predictor.RELOAD_POLL_SECONDS)
+        stamp = predictor.bundle_file_stamp()
+        if stamp is not None and stamp != predictor.bundle_stamp:
+            await asyncio.to_thread(predictor.load_model)
+
+
+async def prediction_loop(local_sensor):
+    """realtime_predict_loop as a task. With the sensor in this process the
+    readings come straight from its snapshot."""
+    if not await asyncio.to_thread(predictor.load_model):
+        print("Cannot start predictor: no usable model")
+        return
+    watcher = asyncio.ensure_future(model_watch_loop())
+    try:
+        while True:
+            # One bundle per epoch, even if a reload swaps it meanwhile
+            current = predictor.bundle
+            epoch_seconds = current['segment_length']
+            try:
+                if local_sensor:
+                    data = predictor.readings_array(bci_api.snapshot.readings[-predictor.API_HISTORY:])
+                else:
+                    data = await asyncio.to_thread(predictor.fetch_readings)
+                readings = predictor.epoch_readings(data, epoch_seconds)
+                if len(readings):
+                    if not await asyncio.to_thread(predictor.record_epoch, readings, current):
+                        # Swapped mid-epoch: recompute it with the new bundle right away
+                        continue
+                elif not local_sensor:
+                    predictor.drop_ring_reader()
+            except Exception as e:
+                print(f"Error in realtime prediction loop: {e}")
+            await asyncio.sleep(epoch_seconds)
+    finally:
+        watcher.cancel()
+
+
+@route('/latest_prediction')
+async def latest_prediction(request):
+    pred = await asyncio.to_thread(predictor.get_latest_prediction)
+    if pred:
+        return json_response(pred)
+    return json_response({'error': 'No prediction yet'}, 404)
+
+
+@route('/model')
+async def model_status(request):
+    if predictor.bundle is None:
+        return json_response({'error': 'No model loaded yet', **predictor.reload_status}, 404)
+    return json_response({'model': predictor.model_bundle.describe(predictor.bundle),
+                          'online': predictor.online_status(), **predictor.reload_status})
+
+
+@route('/admin/reload-model', methods=('POST',))
+async def reload_model(request):
+    if await asyncio.to_thread(predictor.load_model):
+        return json_response({'status': 'reloaded', 'model': predictor.model_bundle.describe(predictor.bundle),
+                              **predictor.reload_status})
+    return json_response({'status': 'failed', **predictor.reload_status}, 500)
+
+
+@route('/admin/online-model', methods=('POST',))
+async def set_online_model(request):
+    payload, status = await asyncio.to_thread(predictor.online_model_result, await request.json() or {})
+    return json_response(payload, status)
+
+
+@route('/next_question', methods=('POST',))
+async def next_question(request):
+    payload, status = predictor.next_question_result(await request.json() or {})
+    return json_response(payload, status)
+
+
+@route('/end_session', methods=('POST',))
+async def end_session(request):
+    body = await request.json() or {}
+    return json_response({'ended': predictor.get_selector().end_session(body.get('session_id'))})
+
+
+# === Model Jobs (run-model.py) ===
+@route('/run-model', methods=('GET', 'POST'))
+async def run_model_route(request):
+    # The job itself runs in the warm model worker process; the thread only
+    # waits for it
+    payload, status = await asyncio.to_thread(run_model.run_model_job)
+    return json_response(payload, status)
+
+
+@route('/get-model-status')
+async def get_model_status(request):
+    payload, status = run_model.model_file_status()
+    return json_response(payload, status)
+
+
+def _image_route(path, filename, missing):
+    async def handler(request):
+        image = os.path.join(BACKEND_DIR, filename)
+        if not os.path.exists(image):
+            return json_response({'error': missing}, 404)
+        return await file_response(image, 'image/png')
+    route(path)(handler)
+
+
+_image_route('/get-graph', 'graph.png', 'Graph not found')
+_image_route('/get-confusion-matrix', 'confusion_matrix.png', 'Confusion matrix not found')
+_image_route('/get-graph-svm', 'graph_svm.png', 'SVM graph not found')
+
+
+@route('/get-results')
+async def get_results(request):
+    # Same contract as run-model.py's /get-results
+    csv_path = os.path.join(BACKEND_DIR, 'model_output.csv')
+    if not os.path.exists(csv_path):
+        return json_response({'error': 'Results file not found'}, 404)
+    if not request.query:
+        return await file_response(csv_path, 'text/csv', 'model_output.csv')
+    try:
+        query = parse_results_query(request.query)
+        chunks = stream_results(csv_path, query)
+        first = await asyncio.to_thread(next, chunks)
+    except ResultsQueryError as e:
+        return json_response({'error': str(e)}, 400)
+    filename = 'model_output_segments.csv' if query['aggregate'] else 'model_output.csv'
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if query['compression']:
+        headers['Content-Encoding'] = query['compression']
+    return StreamingResponse(iterate_in_thread(chunks, first), 200, headers, 'text/csv')
+
+
+@route('/sessions')
+async def list_sessions(request):
+    payload, status = await asyncio.to_thread(sessions_result, request.query)
+    return json_response(payload, status)
+
+
+@route('/get-session')
+async def get_session(request):
+    # Same contract as run-model.py's /get-session
+    try:
+        query = parse_session_query(request.query)
+        chunks = await asyncio.to_thread(stream_session, query)
+        first = await asyncio.to_thread(next, chunks, b'')
+    except SessionStoreError as e:
+        return json_response({'error': str(e)}, 400)
+    filename = f"{query['stream']}.{query['session']}.csv"
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if query['compression']:
+        headers['Content-Encoding'] = query['compression']
+    return StreamingResponse(iterate_in_thread(chunks, first), 200, headers, 'text/csv')
+
+
+# === Recorder (server.py) ===
+# The supervisor's calls wait on worker processes and on its locks, and
+# creating it reaps orphaned recorders, so every call (status too) runs in a
+# thread, never on the event loop
+recorder = None
+recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    global recorder
+    with recorder_lock:
+        if recorder is None:
+            recorder = RecorderSupervisor()
+        return recorder
+
+
+def call_recorder(method, *args):
+    return getattr(get_recorder(), method)(*args)
+
+
+def recording_options(request):
+    device = request.query.get('device') or None
+    try:
+        duration = float(request.query['duration'])
+    except (KeyError, ValueError):
+        duration = None
+    return device, duration if duration and duration > 0 else None
+
+
+@route('/start_eeg')
+async def start_eeg(request):
+    started, status = await asyncio.to_thread(call_recorder, 'start', *recording_options(request))
+    if started:
+        return json_response({'status': 'EEG recording started', **status})
+    return json_response({'status': 'EEG recording already running', **status}, 409)
+
+
+@route('/stop_eeg', methods=('GET', 'POST'))
+async def stop_eeg(request):
+    device, _ = recording_options(request)
+    stopped, status = await asyncio.to_thread(call_recorder, 'stop', device)
+    return json_response({'status': 'EEG recording stopped' if stopped else 'No EEG recording running',
+                          **(status or {})})
+
+
+@route('/eeg_status')
+async def eeg_status(request):
+    device, _ = recording_options(request)
+    status = await asyncio.to_thread(call_recorder, 'status', device)
+    if device:
+        return json_response(status or {'device': device, 'running': False})
+    return json_response(status)
+
+
+# === Lifecycle ===
+_tasks = []
+_started = False
+
+
+async def startup(sensor=True, predict=True):
+    global _started
+    if _started:
+        return
+    _started = True
+    if sensor:
+        bci_api.open_model_log()
+        bci_api.ring = bci_api.RingWriter()
+        bci_api.start_bci()
+    _tasks.append(asyncio.ensure_future(snapshot_watch_loop()))
+    session_store.start_maintenance()
+    if predict:
+        _tasks.append(asyncio.ensure_future(prediction_loop(local_sensor=sensor)))
+    # Warm the model worker and the question bank before the first request,
+    # and the recorder worker (its SDK import) in the background
+    _tasks.append(asyncio.ensure_future(asyncio.to_thread(call_recorder, 'warm')))
+    await asyncio.to_thread(run_model.get_model_worker)
+    await asyncio.to_thread(predictor.get_selector)
+
+
+async def shutdown():
+    global _started
+    if not _started:
+        return
+    _started = False
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    if recorder is not None:
+        await asyncio.to_thread(recorder.shutdown)
+    run_model.shutdown_model_worker()
+    bci_api.cleanup()
+
+
+async def lifespan(receive, send):
+    # Only used when run as `uvicorn asgi_server:app`; serve() runs the
+    # lifecycle itself around its multi-port server
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def _listen(host, port):
+    family, type_, proto, _, address = socket.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)[0]
+    # proto must be IPPROTO_TCP (not 0, as socket.create_server leaves it), or
+    # asyncio does not set TCP_NODELAY on accepted connections and every
+    # keep-alive response waits ~40 ms for a delayed ACK
+    sock = socket.socket(family, type_, proto)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    return sock
+
+
+async def serve(ports, host='127.0.0.1', sensor=True, predict=True):
+    import uvicorn
+    # One server listening on every port, so Ctrl-C stops all of them at once
+    sockets = [_listen(host, port) for port in ports]
+    server = uvicorn.Server(uvicorn.Config(app, lifespan='off', log_level='warning'))
+    await startup(sensor, predict)
+    try:
+        await server.serve(sockets=sockets)
+    finally:
+        await shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the BCI, prediction and model APIs from one event loop')
+    parser.add_argument('--ports', type=int, nargs='+', default=list(PORTS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--no-sensor', action='store_true', help="don't connect to the headset")
+    parser.add_argument('--no-predictor', action='store_true', help="don't run the prediction loop")
+    args = parser.parse_args()
+    print(f"Serving on {', '.join(str(p) for p in args.ports)}")
+    asyncio.run(serve(args.ports, args.host, not args.no_sensor, not args.no_predictor))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,112 @@
 # bci_api.py
 
-from flask import Flask, jsonify
+from flask import Flask, Response, request
 from flask_cors import CORS
 from neurosdk.scanner import Scanner
-from em_st_artifacts.utils import lib_settings, support_classes
+from em_st_artifacts.utils import lib_settings
 from em_st_artifacts import emotional_math
 from neurosdk.cmn_types import SensorFamily, SensorCommand
-from time import sleep
-from datetime import datetime
-import threading, csv, numpy as np
+from time import sleep, time
+import threading, json
+import uuid
 
-app = Flask(__name__)
-CORS(app)  # allow React at localhost:3000 to fetch
+from features import compute_apen
+from signal_batch import RawChannelsBatch
+from reading import FIELDS, Reading
+from reading_ring import RingWriter
+import session_store
 
-# Global storage for latest data
-latest = {
-    "timestamp": None,
-    "alpha": 0.0,
-    "beta":  0.0,
-    "theta": 0.0
-}
+app = Flask(__name__)
+# allow React at localhost:3000 to fetch (and to see the snapshot sequence)
+CORS(app, expose_headers=['ETag', 'X-Reading-Seq'])
+
+# Readings are serialized with orjson when it is installed
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    _encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+# === Shared State ===
+# The SDK callback thread is the only writer; Flask request threads only read,
+# and never take a lock. Each reading is a new Reading that is not modified once
+# published, and the history is an immutable Snapshot that is replaced with a
+# single assignment, so a reader always gets one complete snapshot: never a
+# half-updated reading, never a history changing while it is serialized.
+HISTORY_LEN = 10
+
+class Snapshot:
+    """The last HISTORY_LEN readings and their JSON, as of reading number seq.
+
+    seq counts readings since startup (the same numbering as the reading
+    ring), so the readings here are seq - len(readings) + 1 ... seq.
+    """
+    __slots__ = ('seq', 'readings', 'fragments')
+
+    def __init__(self, seq, readings, fragments):
+        self.seq = seq
+        self.readings = readings
+        self.fragments = fragments
+
+# Newest Reading (None until the first one)
+latest = None
+
+# Readings are logged per session (session_store.py). bci_model.csv, the
+# single file they were appended to before, is left alone; session_store.py
+# --adopt-legacy moves it into the store
+MODEL_CSV_FIELDS = list(FIELDS)
+MODEL_STREAM = 'bci_model'
+model_log = None
+
+def open_model_log():
+    global model_log
+    model_log = session_store.SessionLog(MODEL_STREAM, MODEL_CSV_FIELDS)
+    session_store.start_maintenance()
+    return model_log
 
 # Store last 10 readings
-readings_history = []
-
-# Copy your compute_apen and buffers if needed...
+snapshot = Snapshot(0, (), ())
+
+def publish_reading(reading):
+    """Make a reading visible to request threads (sensor thread only).
+
+    The reading is serialized here, once; /api/data responses are built from
+    these fragments.
+    """
+    global latest, snapshot
+    old = snapshot
+    latest = reading
+    snapshot = Snapshot(old.seq + 1,
+                        old.readings[1 - HISTORY_LEN:] + (reading,),
+                        old.fragments[1 - HISTORY_LEN:] + (dumps(reading.to_dict()),))
+    if ring is not None:
+        ring.publish_reading(reading)
+
+# ApEn buffers, only touched by the sensor thread
 alpha_buffer, beta_buffer, theta_buffer = [], [], []
 math = None  # Will be initialized in bci_thread
 scanner = None
 current_sensor = None
+bci_worker = None
+raw_batch = RawChannelsBatch()
+# Shared-memory copy of every reading for local consumers (reading_ring.py);
+# created by the server entry point
+ring = None
+
+# The scan stops as soon as a headband shows up; SCAN_TIMEOUT is only the upper bound
+SCAN_TIMEOUT = 25
+sensor_seen = threading.Event()
 
 def sensor_found(scanner, sensors):
     for index in range(len(sensors)):
         print('Sensor found: %s' % sensors[index])
+    if sensors:
+        sensor_seen.set()
 
 def on_sensor_state_changed(sensor, state):
     print('Sensor {0} is {1}'.format(sensor.name, state))
@@ -40,85 +114,57 @@ def on_sensor_state_changed(sensor, state):
 def on_battery_changed(sensor, battery):
     print('Battery: {0}'.format(battery))
 
-def compute_apen(U, m=2, r=None):
-    U = np.array(U)
-    N = len(U)
-    if r is None:
-        r = 0.2 * np.std(U)
-
-    def _phi(m):
-        x = np.array([U[i:i + m] for i in range(N - m + 1)])
-        C = []
-        for xi in x:
-            dist = np.max(np.abs(x - xi), axis=1)
-            C.append(np.sum(dist <=r) )
-        return np.sum(np.log(C)) / (N - m + 1)
-
-    return abs(_phi(m) - _phi(m + 1))
-    
-
 def on_signal_received(sensor, data):
-    global latest, alpha_buffer, beta_buffer, theta_buffer, math, readings_history
+    # cleanup() may drop the math object while a last packet is in flight
+    emo_math = math
+    if emo_math is None:
+        return
 
     # Process the raw data first
-    raw_channels = []
-    for sample in data:
-        left_bipolar = sample.T3 - sample.O1
-        right_bipolar = sample.T4 - sample.O2
-        raw_channels.append(support_classes.RawChannels(left_bipolar, right_bipolar))
-
-    math.push_data(raw_channels)
-    math.process_data_arr()
-
-    if not math.calibration_finished():
-        print("Calibration percents: {0}".format(math.get_calibration_percents()))
+    emo_math.push_data(raw_batch.convert(data))
+    emo_math.process_data_arr()
+    # Artifact state of the current analysis window; spectral rows read while it
+    # is set are flagged and kept out of the ApEn buffers and predictions
+    artifacted = emo_math.is_both_sides_artifacted() or emo_math.is_artifacted_sequence()
+
+    if not emo_math.calibration_finished():
+        print("Calibration percents: {0}".format(emo_math.get_calibration_percents()))
     else:
-        mental_data = math.read_mental_data_arr()
-        spectral_data = math.read_spectral_data_percents_arr()
+        mental_data = emo_math.read_mental_data_arr()
+        spectral_data = emo_math.read_spectral_data_percents_arr()
 
         for mind, spec in zip(mental_data, spectral_data):
-            # Update buffers
-            alpha_buffer.append(spec.alpha)
-            beta_buffer.append(spec.beta)
-            theta_buffer.append(spec.theta)
-            
-            if len(alpha_buffer) > 20:
-                alpha_buffer.pop(0)
-                beta_buffer.pop(0)
-                theta_buffer.pop(0)
-
-            # Calculate APEN for each buffer
-            alpha_apen = compute_apen(alpha_buffer) if len(alpha_buffer) > 10 else 0
-            beta_apen = compute_apen(beta_buffer) if len(beta_buffer) > 10 else 0
-            theta_apen = compute_apen(theta_buffer) if len(theta_buffer) > 10 else 0
-
-            # Set latest values
-            latest["timestamp"] = datetime.now().isoformat()
-            latest["alpha"] = spec.alpha
-            latest["beta"] = spec.beta
-            latest["theta"] = spec.theta
-            latest["alpha_apen"] = alpha_apen
-            latest["beta_apen"] = beta_apen
-            latest["theta_apen"] = theta_apen
-
-            # Add to history
-            readings_history.append(latest.copy())
-            if len(readings_history) > 10:
-                readings_history.pop(0)
-
-            # Save to CSV
-            try:
-                with open('bci_model.csv', 'a', newline='') as csvfile:
-                    fieldnames = ['timestamp', 'alpha', 'beta', 'theta', 'alpha_apen', 'beta_apen', 'theta_apen']
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    
-                    # Write header if file is empty
-                    if csvfile.tell() == 0:
-                        writer.writeheader()
-                    
-                    writer.writerow(latest)
-            except Exception as e:
-                print(f"Error writing to CSV: {e}")
+            if artifacted:
+                # Garbage spectrum: no buffer update, no ApEn
+                alpha_apen = beta_apen = theta_apen = None
+            else:
+                # Update buffers
+                alpha_buffer.append(spec.alpha)
+                beta_buffer.append(spec.beta)
+                theta_buffer.append(spec.theta)
+
+                if len(alpha_buffer) > 20:
+                    alpha_buffer.pop(0)
+                    beta_buffer.pop(0)
+                    theta_buffer.pop(0)
+
+                # Calculate APEN for each buffer
+                alpha_apen = float(compute_apen(alpha_buffer)) if len(alpha_buffer) > 10 else 0
+                beta_apen = float(compute_apen(beta_buffer)) if len(beta_buffer) > 10 else 0
+                theta_apen = float(compute_apen(theta_buffer)) if len(theta_buffer) > 10 else 0
+
+            # Build the new reading, then publish it with the history
+            reading = Reading(time(), spec.alpha, spec.beta, spec.theta,
+                              alpha_apen, beta_apen, theta_apen, artifacted)
+            publish_reading(reading)
+
+            # Save to the session log
+            log = model_log
+            if log is not None:
+                try:
+                    log.append(reading.csv_row())
+                except Exception as e:
+                    print(f"Error writing to CSV: {e}")
 
 def on_resist_received(sensor, data):
     print("O1 resist is normal: {0}. Current O1 resist {1}".format(data.O1 < 2000000, data.O1))
@@ -127,7 +173,7 @@ def on_resist_received(sensor, data):
     print("T4 resist is normal: {0}. Current T4 resist {1}".format(data.T4 < 2000000, data.T4))
 
 def cleanup():
-    global scanner, current_sensor, math
+    global scanner, current_sensor, math, ring, model_log
     if current_sensor:
         try:
             current_sensor.exec_command(SensorCommand.StopSignal)
@@ -145,15 +191,24 @@ def cleanup():
         del scanner
         scanner = None
 
+    if ring:
+        ring.close()
+        ring = None
+
+    if model_log:
+        log, model_log = model_log, None
+        log.close()
+
 def bci_thread():
     global math, scanner, current_sensor
     try:
         # Initialize scanner
         scanner = Scanner([SensorFamily.LEHeadband])
         scanner.sensorsChanged = sensor_found
+        sensor_seen.clear()
         scanner.start()
-        print("Starting search for 25 sec...")
-        sleep(25)
+        print("Starting search for up to {0} sec...".format(SCAN_TIMEOUT))
+        sensor_seen.wait(SCAN_TIMEOUT)
         scanner.stop()
 
         sensorsInfo = scanner.sensors()
@@ -234,16 +289,70 @@ def bci_thread():
 import atexit
 atexit.register(cleanup)
 
-# Start that thread on import
-threading.Thread(target=bci_thread, daemon=True).start()
+def start_bci():
+    # Started by the server entry point rather than on import, so tools that
+    # only need the helpers here do not trigger a headset scan
+    global bci_worker
+    if bci_worker is None or not bci_worker.is_alive():
+        bci_worker = threading.Thread(target=bci_thread, daemon=True)
+        bci_worker.start()
+    return bci_worker
+
+# === /api/data Cache ===
+# The full response body is joined from the snapshot's fragments once per
+# snapshot and shared by every poller, so serialization cost follows the data
+# rate, not the number of clients times their poll rate. The ETag is the
+# snapshot seq: a poller that already has it gets a 304. seq counts from
+# startup, so the ETag also carries an id of this process; an ETag from before
+# a restart never matches a new snapshot that happens to have the same seq.
+BOOT_ID = uuid.uuid4().hex[:12]
+_body_cache = (0, b'[]')
+
+def data_etag(snap):
+    return f'{BOOT_ID}-{snap.seq}'
+
+def snapshot_body(snap):
+    global _body_cache
+    seq, body = _body_cache
+    if seq != snap.seq:
+        body = b'[' + b','.join(snap.fragments) + b']'
+        if snap.seq > _body_cache[0]:
+            _body_cache = (snap.seq, body)
+    return body
+
+def data_body(snap, since=None):
+    # Whole history, or only the readings after seq since. A since ahead of
+    # the newest seq comes from a client of a bci_api before a restart (seq
+    # counts from startup): it gets the whole history too, not nothing until
+    # the new seq catches up
+    if since is None or since > snap.seq:
+        return snapshot_body(snap)
+    new = max(0, min(snap.seq - since, len(snap.fragments)))
+    return b'[' + b','.join(snap.fragments[len(snap.fragments) - new:]) + b']'
 
 @app.route("/api/data")
 def get_data():
-    # Return the last 10 readings as JSON
-    return jsonify(readings_history)
+    """The last 10 readings as a JSON list.
+
+    ?since=<seq> returns only the readings after reading seq (all of the
+    last 10 if the client fell further behind, or if seq is ahead of this
+    server's, i.e. from before a restart). X-Reading-Seq / ETag carry
+    the seq of the newest reading.
+    """
+    snap = snapshot  # one read of the global is one consistent snapshot
+    body = data_body(snap, request.args.get('since', type=int))
+    resp = Response(body, mimetype='application/json')
+    resp.set_etag(data_etag(snap))
+    resp.headers['X-Reading-Seq'] = str(snap.seq)
+    # Browsers revalidate on every poll instead of reusing a stale copy
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
 
 if __name__ == "__main__":
     try:
+        open_model_log()
+        ring = RingWriter()
+        start_bci()
         app.run(debug=False, port=5000)
     except KeyboardInterrupt:
         cleanup()
\ No newline at end of file
@@ -0,0 +1,139 @@
+# bench_api_data.py
+#
+# /api/data cost per request with many pollers, next to the previous
+# jsonify-per-request handler. A publisher thread feeds readings into
+# bci_api.publish_reading at the headset rate while client threads poll as
+# fast as they can in one of these modes:
+#   jsonify  - old handler, serializes the history on every request
+#   full     - cached body of the current snapshot
+#   etag     - conditional requests; unchanged snapshots cost a 304
+#   since    - ?since=<last seq seen>, only new readings in the body
+#
+#   python bench_api_data.py --clients 1 10 50 --rate 25
+
+import argparse
+import threading
+import time
+
+from flask import jsonify
+from werkzeug.test import EnvironBuilder
+
+import bci_api
+from reading import Reading
+
+MODES = ('jsonify', 'full', 'etag', 'since')
+
+
+@bci_api.app.route('/bench/jsonify')
+def _jsonify_baseline():
+    return jsonify([r.to_dict() for r in bci_api.snapshot.readings])
+
+
+def fake_reading(k):
+    return Reading(time.time(), 0.3 + k % 7 / 100, 0.2, 0.4, 0.12, 0.08, 0.1, False)
+
+
+def publisher(rate, stop):
+    k = 0
+    while not stop.is_set():
+        k += 1
+        bci_api.publish_reading(fake_reading(k))
+        time.sleep(1 / rate)
+
+
+def call(path, query=None, headers=None):
+    # Straight into the WSGI app: the test client's own overhead would hide
+    # the difference between the handlers
+    environ = EnvironBuilder(path=path, query_string=query, headers=headers).get_environ()
+    status = []
+    body = b''.join(bci_api.app.wsgi_app(environ, lambda s, h, exc=None: status.append((s, dict(h)))))
+    return int(status[0][0][:3]), status[0][1], body
+
+
+def client(mode, stop, out):
+    done = not_modified = body_bytes = 0
+    etag = None
+    seq = bci_api.snapshot.seq
+    while not stop.is_set():
+        if mode == 'jsonify':
+            status, headers, body = call('/bench/jsonify')
+        elif mode == 'full':
+            status, headers, body = call('/api/data')
+        elif mode == 'etag':
+            status, headers, body = call('/api/data', headers={'If-None-Match': etag} if etag else None)
+            etag = headers.get('ETag', etag)
+        else:
+            status, headers, body = call('/api/data', query={'since': seq})
+            seq = int(headers['X-Reading-Seq'])
+        done += 1
+        not_modified += status == 304
+        body_bytes += len(body)
+    out.append((done, not_modified, body_bytes))
+
+
+def run(mode, clients, rate, seconds):
+    stop = threading.Event()
+    out = []
+    threads = [threading.Thread(target=publisher, args=(rate, stop))]
+    threads += [threading.Thread(target=client, args=(mode, stop, out)) for _ in range(clients)]
+    start = time.perf_counter()
+    cpu = time.process_time()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    cpu = time.process_time() - cpu
+    elapsed = time.perf_counter() - start
+    requests_done = sum(o[0] for o in out)
+    return {
+        'per_sec': requests_done / elapsed,
+        'cpu_us': cpu / max(requests_done, 1) * 1e6,
+        'not_modified': sum(o[1] for o in out) / max(requests_done, 1),
+        'bytes': sum(o[2] for o in out) / max(requests_done, 1),
+    }
+
+
+def serialization_cost(repeat=20000):
+    """Per-request serialization work alone: the old handler's encode of the
+    history against a lookup of the cached body."""
+    snap = bci_api.snapshot
+    encode = bci_api.app.json.dumps
+    with bci_api.app.app_context():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encode([r.to_dict() for r in snap.readings])
+        old = (time.perf_counter() - start) / repeat
+    bci_api.snapshot_body(snap)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        bci_api.snapshot_body(snap)
+    cached = (time.perf_counter() - start) / repeat
+    return old * 1e6, cached * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/data serving')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--rate', type=float, default=25, help='readings published per second')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--modes', nargs='+', default=list(MODES))
+    args = parser.parse_args()
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(sorted(unknown))}")
+
+    for k in range(bci_api.HISTORY_LEN):
+        bci_api.publish_reading(fake_reading(k))
+    old, cached = serialization_cost()
+    print(f"serialization per request: jsonify {old:.1f} us, cached body {cached:.2f} us")
+    for clients in args.clients:
+        for mode in args.modes:
+            r = run(mode, clients, args.rate, args.seconds)
+            print(f"{clients:>4} clients {mode:>8}: {r['per_sec']:>8.0f} req/s, {r['cpu_us']:>6.0f} us CPU/request, "
+                  f"{r['not_modified']:>4.0%} 304, {r['bytes']:>6.0f} B/response")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_epoch_features.py
+#
+# Cost of one prediction epoch's feature step (cut the epoch out of the
+# readings, average the clean ones, derive the features) for growing windows:
+# 10 readings is what bci_api serves today, 75 is a 3 s epoch of all spectral
+# rows at 25/s, 750 and 7500 are 3 s and 30 s at the raw 250 Hz. Compares the
+# per-reading loop the predictor used (list of Readings, one Python list and
+# mean per column) with the array path in realtime_predict_api
+# (epoch_readings + epoch_features: binary search, one masked reduction).
+# The model's predict() is left out; it does not depend on the window.
+#
+#   python bench_epoch_features.py
+#   python bench_epoch_features.py --windows 75 7500 --features CI_Alpha
+
+import argparse
+import time
+
+import numpy as np
+
+import features
+from reading import Reading, readings_array
+from realtime_predict_api import LIVE_READING_COLUMNS, epoch_features, epoch_readings
+
+EPOCH_SECONDS = 3
+
+
+def make_readings(n, rng):
+    # n readings spread evenly over the epoch, plus as many before it
+    now = time.time()
+    ts = now - 2 * EPOCH_SECONDS + np.arange(2 * n) * (EPOCH_SECONDS / n)
+    bands = rng.uniform(0.1, 0.6, size=(2 * n, 6))
+    artifacted = rng.random(2 * n) < 0.05
+    readings = [Reading(float(t), *map(float, b), bool(a)) for t, b, a in zip(ts, bands, artifacted)]
+    return readings, float(ts[-1])
+
+
+# The predictor's epoch step before the array path
+def loop_epoch(readings, current, now):
+    start = now - EPOCH_SECONDS
+    readings = [r for r in readings if r.timestamp >= start]
+    names = current['features']
+    clean = [r for r in readings if not r.artifacted]
+    artifact_ratio = 1 - len(clean) / len(readings)
+    if not clean or artifact_ratio > features.MAX_ARTIFACT_RATIO:
+        return None, artifact_ratio
+    means = {}
+    for col in features.required_columns(names):
+        means[col] = np.array([np.nanmean(np.asarray([getattr(r, col) for r in clean], dtype=np.float64))])
+    return features.compute_features(means, current['baseline'], names)[0], artifact_ratio
+
+
+def array_epoch(rows, current, now):
+    return epoch_features(epoch_readings(rows, EPOCH_SECONDS, now), current)
+
+
+def per_call(fn, args, repeat):
+    fn(*args)
+    best = float('inf')
+    for _ in range(5):
+        t = time.perf_counter()
+        for _ in range(repeat):
+            fn(*args)
+        best = min(best, (time.perf_counter() - t) / repeat)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-epoch feature step')
+    parser.add_argument('--windows', type=int, nargs='+', default=[10, 75, 750, 7500],
+                        help='readings per epoch')
+    parser.add_argument('--features', nargs='+', default=features.available_features(LIVE_READING_COLUMNS))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    current = {'features': args.features, 'baseline': {band: 0.3 for band in features.BANDS}}
+
+    print(f"features: {', '.join(args.features)}")
+    for n in args.windows:
+        readings, now = make_readings(n, rng)
+        rows = readings_array(readings)
+        old_values, _ = loop_epoch(readings, current, now)
+        new_values, _ = array_epoch(rows, current, now)
+        assert np.allclose(old_values, new_values, equal_nan=True)
+        old = per_call(loop_epoch, (readings, current, now), args.repeat)
+        new = per_call(array_epoch, (rows, current, now), args.repeat)
+        print(f"{n:>6} readings/epoch: loop {old * 1e6:9.1f} us, array {new * 1e6:7.1f} us ({old / new:6.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
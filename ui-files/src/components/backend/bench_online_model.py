@@ -0,0 +1,133 @@
+# bench_online_model.py
+#
+# Offline SVM against the online models of online_model.py on replayed
+# sessions. Every session is scored epoch by epoch as the live predictor
+# would (replay.score_session); the online models see the epochs in order,
+# predicting each before learning from it. Accuracy is measured against the
+# labels model.py would give the session in hindsight: the median split of
+# the session's own CI_Alpha.
+#
+# Recordings of a single session rarely drift much, so --drift adds a slow
+# gain on alpha across the session (0.5 = alpha 50% higher by the end), as
+# electrode contact or fatigue would. The reference labels stay those of the
+# undrifted session: the drift is not a change in load.
+#
+#   python bench_online_model.py bci_calm.csv --drift 0 0.25 0.5 1
+#   python bench_online_model.py sessions/*.csv --model model_bundle.pkl
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import model_bundle
+import online_model
+import replay
+
+
+def load_bundle(path):
+    if path:
+        return model_bundle.load_bundle(path)
+    # Same fallback as the predictor: model_bundle.pkl, else trained_model.pkl
+    import realtime_predict_api
+    return realtime_predict_api.read_bundle()
+
+
+def with_drift(df, seconds, drift):
+    if not drift:
+        return df
+    df = df.copy()
+    progress = (seconds - seconds[0]) / max(seconds[-1] - seconds[0], 1e-9)
+    df['alpha'] = df['alpha'].astype(float) * (1 + drift * progress)
+    return df
+
+
+def epoch_inputs(df, seconds, bundle):
+    """(X, svm predictions) of the scored epochs, X imputed like the predictor."""
+    _, values, predictions, _, scored = replay.score_session(df, seconds, bundle)
+    X = values[scored].astype(np.float64)
+    if bundle.get('impute_values') is not None:
+        fill = np.broadcast_to(np.asarray(bundle['impute_values']), X.shape)
+        missing = ~np.isfinite(X)
+        X[missing] = fill[missing]
+    return X, np.asarray(predictions)[scored], scored
+
+
+def run_online(bundle, mode, X, **params):
+    model = online_model.OnlineModel(bundle, mode, **params)
+    out = np.empty(len(X), dtype=int)
+    start = time.perf_counter()
+    for i, x in enumerate(X):
+        out[i] = model.update(x)
+    return out, (time.perf_counter() - start) / max(len(X), 1)
+
+
+def resumes_identically(bundle, mode, X, **params):
+    """Checkpoint halfway, restore into a fresh model and finish: the
+    predictions must match an uninterrupted run."""
+    expected, _ = run_online(bundle, mode, X, **params)
+    model = online_model.OnlineModel(bundle, mode, **params)
+    half = len(X) // 2
+    first = [model.update(x) for x in X[:half]]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'online_model.pkl')
+        online_model.save_checkpoint(model, path)
+        model = online_model.load_checkpoint(bundle, mode, path)
+    rest = [model.update(x) for x in X[half:]]
+    return np.array_equal(np.asarray(first + rest), expected)
+
+
+def svm_cost(bundle, X):
+    model = bundle['model']
+    start = time.perf_counter()
+    for x in X:
+        model.predict(x.reshape(1, -1))
+    return (time.perf_counter() - start) / max(len(X), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline SVM vs online adaptation on replayed sessions')
+    parser.add_argument('sessions', nargs='*', default=[os.path.join(replay.__file__.rsplit(os.sep, 1)[0],
+                                                                     'bci_calm.csv')])
+    parser.add_argument('--model', help='model bundle (default: the predictor\'s)')
+    parser.add_argument('--drift', type=float, nargs='+', default=[0, 0.25, 0.5, 1.0],
+                        help='alpha gain added by the end of the session')
+    parser.add_argument('--median-rate', type=float, default=online_model.MEDIAN_RATE)
+    parser.add_argument('--learning-rate', type=float, default=online_model.LEARNING_RATE)
+    args = parser.parse_args()
+    params = {'median_rate': args.median_rate, 'learning_rate': args.learning_rate}
+    bundle = load_bundle(args.model)
+    label_index = bundle['features'].index(online_model.LABEL_FEATURE)
+
+    print(f"bundle version {bundle['version']}, features {bundle['features']}")
+    print(f"{'session':>24} {'drift':>6} {'epochs':>7} {'svm':>6} {'relabel':>8} {'linear':>7}")
+    costs = {'svm': [], 'relabel': [], 'linear': []}
+    resumed = True
+    for path in args.sessions:
+        _, seconds, df = replay.load_session(path)
+        X_ref, _, scored_ref = epoch_inputs(df, seconds, bundle)
+        for drift in args.drift:
+            X, svm, scored = epoch_inputs(with_drift(df, seconds, drift), seconds, bundle)
+            # Hindsight labels of the undrifted session, on the epochs scored in both
+            ref = np.full(len(scored_ref), -1)
+            ci = X_ref[:, label_index]
+            ref[scored_ref] = ci > np.median(ci)
+            truth = ref[scored]
+            keep = truth >= 0
+            row = {'svm': svm}
+            for mode in online_model.MODES:
+                row[mode], cost = run_online(bundle, mode, X, **params)
+                costs[mode].append(cost)
+                resumed &= resumes_identically(bundle, mode, X, **params)
+            costs['svm'].append(svm_cost(bundle, X))
+            acc = {name: float(np.mean(pred[keep] == truth[keep])) for name, pred in row.items()}
+            print(f"{os.path.basename(path)[-24:]:>24} {drift:>6.2f} {int(keep.sum()):>7} "
+                  f"{acc['svm']:>6.1%} {acc['relabel']:>8.1%} {acc['linear']:>7.1%}")
+    print(f"checkpoint/restore mid-session: {'identical predictions' if resumed else 'PREDICTIONS DIFFER'}")
+    print("per-epoch cost: " + ", ".join(f"{name} {np.mean(c) * 1e6:.1f} us" for name, c in costs.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# bench_question_selector.py
+#
+# Throughput of QuestionSelector with many concurrent test-takers, next to a
+# naive selector that filters the whole bank on every request (what picking a
+# question client-side from a flat list amounts to).
+#
+#   python bench_question_selector.py --questions 100000 --sessions 2000 --threads 8
+
+import argparse
+import random
+import threading
+import time
+
+from question_selector import LOAD_CLASSES, QuestionBank, QuestionSelector
+
+
+def make_bank(n, topics, levels):
+    return [
+        {'id': i, 'topic': f'topic{i % topics}', 'difficulty': 1 + (i // topics) % levels,
+         'text': f'Question {i}', 'type': 'text-input', 'correctAnswer': str(i)}
+        for i in range(n)
+    ]
+
+
+class NaiveSelector:
+    """Filters the bank for unasked questions of the target level, then picks one
+    at random (like getRandomQuestions in sampleTestService.ts)."""
+
+    def __init__(self, questions):
+        self.questions = questions
+        self.levels = sorted({q['difficulty'] for q in questions})
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def next_question(self, session_id, load=None, topic=None):
+        with self.lock:
+            state = self.sessions.setdefault(session_id, {'level': 2, 'asked': set(), 'topic': topic})
+        target = state['level'] + (-1 if load == 'High' else 1 if load == 'Low' else 0)
+        target = min(max(target, self.levels[0]), self.levels[-1])
+        candidates = [q for q in self.questions
+                      if q['topic'] == state['topic'] and q['difficulty'] == target and q['id'] not in state['asked']]
+        if not candidates:
+            return None
+        q = random.choice(candidates)
+        state['asked'].add(q['id'])
+        state['level'] = target
+        return q
+
+
+def run(selector, sessions, topics, requests_per_thread, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local = []
+        for _ in range(requests_per_thread):
+            session = rng.randrange(sessions)
+            start = time.perf_counter()
+            selector.next_question(f's{session}', load=rng.choice(LOAD_CLASSES), topic=f'topic{session % topics}')
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'per_sec': len(latencies) / elapsed,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark adaptive question selection')
+    parser.add_argument('--questions', type=int, default=100_000)
+    parser.add_argument('--topics', type=int, default=4)
+    parser.add_argument('--levels', type=int, default=5)
+    parser.add_argument('--sessions', type=int, default=2000, help='concurrent test-takers')
+    parser.add_argument('--threads', type=int, default=8, help='request threads')
+    parser.add_argument('--requests', type=int, default=20_000, help='requests per thread')
+    parser.add_argument('--naive-requests', type=int, default=200, help='requests per thread for the scan baseline')
+    args = parser.parse_args()
+
+    questions = make_bank(args.questions, args.topics, args.levels)
+    start = time.perf_counter()
+    bank = QuestionBank(questions)
+    print(f"Indexed {args.questions} questions in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    results = {
+        'indexed': run(QuestionSelector(bank, seed=1), args.sessions, args.topics, args.requests, args.threads),
+        'scan': run(NaiveSelector(questions), args.sessions, args.topics, args.naive_requests, args.threads),
+    }
+    for name, r in results.items():
+        print(f"{name:>8}: {r['requests']:>7} requests, {r['per_sec']:>10.0f} req/s, "
+              f"p50 {r['p50_us']:>9.1f} us, p99 {r['p99_us']:>9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# bench_reading_ring.py
+#
+# Readers-per-writer scaling of the shared-memory reading ring. One writer
+# process publishes readings at --rate per second (0 = as fast as it can);
+# 1, 2, 4, ... reader processes follow the ring. Reports the writer's cost
+# per publish, and per reader how many readings arrived, how many were lost
+# and how long after publishing they were seen.
+#
+#   python bench_reading_ring.py --readers 1 2 4 8 16 --rate 2000 --seconds 3
+
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from reading_ring import FIELDS, RingReader, RingWriter
+
+RING_NAME = 'bci_readings_bench'
+
+
+def writer_proc(rate, seconds, ready, go, result):
+    ring = RingWriter(RING_NAME, capacity=4096)
+    ready.set()
+    go.wait()
+    values = [0.0] * len(FIELDS)
+    interval = 1.0 / rate if rate else 0.0
+    publish_time = 0.0
+    start = time.perf_counter()
+    next_at = start
+    while time.perf_counter() - start < seconds:
+        if interval:
+            next_at += interval
+            while time.perf_counter() < next_at:
+                pass
+        values[0] = time.time()
+        t = time.perf_counter()
+        ring.publish(values)
+        publish_time += time.perf_counter() - t
+    result.put(('writer', ring.seq, publish_time))
+    # Give readers time to drain before the segment goes away
+    time.sleep(0.5)
+    ring.close()
+
+
+def reader_proc(poll, go, done, result):
+    ring = RingReader(RING_NAME, start='oldest')
+    go.wait()
+    received = 0
+    lags = []
+    while True:
+        finished = done.is_set()
+        rows = ring.read()
+        if len(rows):
+            now = time.time()
+            received += len(rows)
+            # Sample the lag of the newest reading in each batch
+            lags.append(now - rows[-1, 0])
+        elif finished:
+            break
+        if poll:
+            time.sleep(poll)
+    result.put(('reader', received, ring.lost, lags))
+    ring.close()
+
+
+def run(readers, rate, seconds, poll):
+    ctx = mp.get_context('spawn')
+    ready, go, done = ctx.Event(), ctx.Event(), ctx.Event()
+    result = ctx.Queue()
+    writer = ctx.Process(target=writer_proc, args=(rate, seconds, ready, go, result))
+    writer.start()
+    ready.wait()
+    procs = [ctx.Process(target=reader_proc, args=(poll, go, done, result)) for _ in range(readers)]
+    for p in procs:
+        p.start()
+    time.sleep(0.5)  # let the readers attach
+    go.set()
+    kind, published, publish_time = result.get()
+    done.set()
+    reader_results = [result.get() for _ in procs]
+    for p in procs + [writer]:
+        p.join()
+
+    lags = np.concatenate([np.asarray(r[3]) for r in reader_results if r[3]] or [np.zeros(1)]) * 1000
+    return {
+        'published': published,
+        'publish_us': publish_time / max(published, 1) * 1e6,
+        'received': sum(r[1] for r in reader_results) / readers,
+        'lost': sum(r[2] for r in reader_results) / readers,
+        'lag_p50_ms': float(np.percentile(lags, 50)),
+        'lag_p99_ms': float(np.percentile(lags, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the shared-memory reading ring')
+    parser.add_argument('--readers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rate', type=float, default=2000, help='readings per second (0 = unthrottled)')
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--poll', type=float, default=0.001, help='reader sleep between polls in seconds')
+    args = parser.parse_args()
+
+    print(f"rate {args.rate or 'max'}/s, {args.seconds}s, poll {args.poll * 1000:.1f} ms")
+    for n in args.readers:
+        r = run(n, args.rate, args.seconds, args.poll)
+        print(f"{n:>3} reader(s): published {r['published']:>8}, {r['publish_us']:5.2f} us/publish | "
+              f"per reader received {r['received']:>10.0f}, lost {r['lost']:>8.0f}, "
+              f"lag p50 {r['lag_p50_ms']:7.2f} ms, p99 {r['lag_p99_ms']:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# bench_readings.py
+#
+# Memory and throughput of one hour of readings in the three forms a reading
+# can take: the dict with an ISO timestamp bci_api used to publish, a slotted
+# Reading (reading.py) and a float64 row as stored in the reading ring.
+# Reports bytes per reading and for the hour, the cost of building one, and
+# the predictor's per-epoch work (cut the epoch out of the last API_HISTORY
+# readings, gather the feature columns) with the old dict parsing and with
+# Readings.
+#
+#   python bench_readings.py
+#   python bench_readings.py --rate 25 --hours 1
+
+import argparse
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from reading import FIELDS, Reading
+
+EPOCH_SECONDS = 3
+API_HISTORY = 10
+COLUMNS = ('alpha', 'beta', 'theta', 'alpha_apen', 'beta_apen', 'theta_apen')
+
+
+def make_dict(ts, k):
+    return {
+        'timestamp': datetime.fromtimestamp(ts).isoformat(), 'alpha': 0.3 + k % 7 / 100, 'beta': 0.2 + k % 5 / 100,
+        'theta': 0.4 + k % 3 / 100, 'alpha_apen': 0.12 + k % 11 / 1000, 'beta_apen': 0.08 + k % 13 / 1000,
+        'theta_apen': 0.1 + k % 17 / 1000, 'artifacted': k % 50 == 0,
+    }
+
+
+def make_reading(ts, k):
+    return Reading(ts, 0.3 + k % 7 / 100, 0.2 + k % 5 / 100, 0.4 + k % 3 / 100,
+                   0.12 + k % 11 / 1000, 0.08 + k % 13 / 1000, 0.1 + k % 17 / 1000, k % 50 == 0)
+
+
+def build(kind, n, rate, start):
+    if kind == 'dict':
+        return [make_dict(start + k / rate, k) for k in range(n)]
+    if kind == 'Reading':
+        return [make_reading(start + k / rate, k) for k in range(n)]
+    rows = np.empty((n, len(FIELDS)))
+    for k in range(n):
+        rows[k] = make_reading(start + k / rate, k).values()
+    return rows
+
+
+def measure(kind, n, rate, start):
+    tracemalloc.start()
+    t = time.perf_counter()
+    data = build(kind, n, rate, start)
+    elapsed = time.perf_counter() - t
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, size, elapsed
+
+
+# The predictor's per-epoch work before reading.py: ISO parsing and
+# upper/lower case lookups on every entry
+def old_epoch(data, now):
+    readings = []
+    for entry in data:
+        ts = datetime.fromisoformat(entry.get('TIMESTAMP') or entry.get('timestamp'))
+        if (now - ts).total_seconds() <= EPOCH_SECONDS:
+            readings.append(entry)
+    clean = [r for r in readings if not r.get('artifacted')]
+    return {col: [float(r.get(col.upper(), r.get(col, 0))) for r in clean] for col in COLUMNS}
+
+
+def new_epoch(data, now):
+    start = now - EPOCH_SECONDS
+    clean = [r for r in data if r.timestamp >= start and not r.artifacted]
+    return {col: [getattr(r, col) for r in clean] for col in COLUMNS}
+
+
+def epoch_cost(epoch, data, now, repeat):
+    # Slide over the session: each call sees the API_HISTORY readings ending at i
+    ends = np.linspace(API_HISTORY, len(data), repeat, dtype=int)
+    t = time.perf_counter()
+    for i in ends:
+        epoch(data[i - API_HISTORY:i], now(i))
+    return (time.perf_counter() - t) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory/throughput of reading representations')
+    parser.add_argument('--rate', type=float, default=25, help='readings per second')
+    parser.add_argument('--hours', type=float, default=1)
+    parser.add_argument('--epochs', type=int, default=20000, help='epochs timed per representation')
+    args = parser.parse_args()
+    n = int(args.rate * args.hours * 3600)
+    start = time.time() - n / args.rate
+
+    print(f"{n} readings ({args.hours:g} h at {args.rate:g}/s)")
+    results = {}
+    for kind in ('dict', 'Reading', 'ring row'):
+        data, size, elapsed = measure(kind, n, args.rate, start)
+        results[kind] = data
+        print(f"{kind:>8}: {size / n:7.1f} B/reading, {size / 2**20:7.1f} MiB total, "
+              f"{elapsed / n * 1e6:6.2f} us to build")
+
+    dicts, readings = results['dict'], results['Reading']
+    old = epoch_cost(old_epoch, dicts, lambda i: datetime.fromtimestamp(start + (i - 1) / args.rate), args.epochs)
+    new = epoch_cost(new_epoch, readings, lambda i: start + (i - 1) / args.rate, args.epochs)
+    assert old_epoch(dicts[-API_HISTORY:], datetime.fromtimestamp(start + (n - 1) / args.rate)) == \
+        new_epoch(readings[-API_HISTORY:], start + (n - 1) / args.rate)
+    print(f"per-epoch cut + columns over {API_HISTORY} readings: dict {old * 1e6:.1f} us, "
+          f"Reading {new * 1e6:.1f} us ({old / new:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
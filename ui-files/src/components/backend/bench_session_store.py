@@ -0,0 +1,105 @@
+# bench_session_store.py
+#
+# The reading log before and after session_store.py. Appends --rows readings
+# the way bci_api.py used to (open bci_model.csv, check for a header, append
+# one row, close) and through a SessionLog, then times /latest_prediction's
+# read of a prediction log that has grown for --days days at one epoch per
+# 3 s (the whole file parsed for its last row, against the log's kept row).
+# Finally a maintenance pass compacts the closed session and reports the
+# archive size, and a session is read back from the archive.
+#
+#   python bench_session_store.py
+#   python bench_session_store.py --rows 100000 --days 7
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+import session_store
+from reading import FIELDS, Reading
+
+PREDICTION_HEADER = ['timestamp', 'CI_Alpha', 'artifact_ratio', 'prediction', 'label', 'model_version']
+
+
+def make_reading(k, start):
+    return Reading(start + k / 25, 0.3 + k % 7 / 100, 0.2 + k % 5 / 100, 0.4 + k % 3 / 100,
+                   0.12 + k % 11 / 1000, 0.08 + k % 13 / 1000, 0.1 + k % 17 / 1000, k % 50 == 0)
+
+
+def append_per_row(path, readings):
+    for reading in readings:
+        with open(path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(FIELDS)
+            writer.writerow(reading.csv_row())
+
+
+def append_session(log, readings):
+    for reading in readings:
+        log.append(reading.csv_row())
+
+
+def last_row_of_file(path):
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    return dict(zip(rows[0], rows[-1]))
+
+
+def timed(fn, *args, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-session logs')
+    parser.add_argument('--rows', type=int, default=50000, help='readings appended')
+    parser.add_argument('--days', type=float, default=7, help='age of the prediction log read back')
+    args = parser.parse_args()
+    start = time.time()
+    readings = [make_reading(k, start) for k in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'sessions')
+        old, _ = timed(append_per_row, os.path.join(tmp, 'bci_model.csv'), readings)
+        log = session_store.SessionLog('bci_model', FIELDS, root=root)
+        new, _ = timed(append_session, log, readings)
+        log.close()
+        print(f"append {args.rows} readings: per-row open {old / args.rows * 1e6:.1f} us/row, "
+              f"session log {new / args.rows * 1e6:.1f} us/row ({old / new:.1f}x)")
+
+        epochs = int(args.days * 86400 / 3)
+        path = os.path.join(tmp, 'realtime_predictions.csv')
+        predictions = session_store.SessionLog('realtime_predictions', PREDICTION_HEADER, root=root)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(PREDICTION_HEADER)
+            for k in range(epochs):
+                row = [readings[k % args.rows].iso_timestamp(), 0.3 + k % 7 / 100, 0.0, k % 2, k % 2, 3]
+                writer.writerow(row)
+        predictions.last_row = row
+        old, expected = timed(last_row_of_file, path)
+        new, latest = timed(predictions.last_record, repeat=1000)
+        assert latest == expected
+        predictions.close()
+        print(f"latest prediction after {args.days:g} days ({epochs} epochs, "
+              f"{os.path.getsize(path) / 2**20:.1f} MiB): file read {old * 1e3:.1f} ms, "
+              f"session log {new * 1e6:.2f} us")
+
+        elapsed, report = timed(session_store.maintain, root)
+        manifest = session_store.list_sessions('bci_model', root)[0]
+        print(f"maintenance pass {elapsed:.2f} s {report}: bci_model session "
+              f"{manifest['raw_bytes'] / 2**20:.1f} MiB -> {manifest['bytes'] / 2**20:.2f} MiB gzip "
+              f"({manifest['raw_bytes'] / manifest['bytes']:.1f}x)")
+        rows = session_store.session_rows('bci_model', manifest['session'], root)
+        elapsed, n = timed(lambda: sum(1 for _ in rows) - 1)
+        assert n == args.rows == manifest['rows']
+        print(f"read back {n} rows from the archive in {elapsed:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
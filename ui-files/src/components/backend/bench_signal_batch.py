@@ -0,0 +1,86 @@
+# bench_signal_batch.py
+#
+# Samples/sec of the packet -> RawChannels conversion done in
+# on_signal_received, for a few packet sizes:
+#   loop   - the original per-sample RawChannels(...) construction
+#   numpy  - electrodes pulled into an array, derivations vectorized
+#   batch  - RawChannelsBatch, reused objects filled in place
+#
+#   python bench_signal_batch.py --packets 5 25 250
+
+import argparse
+import random
+import timeit
+
+import numpy as np
+from em_st_artifacts.utils import support_classes
+
+from signal_batch import RawChannelsBatch
+
+
+class Sample:
+    # Same electrode attributes as the SDK's signal data objects
+    __slots__ = ('T3', 'O1', 'T4', 'O2')
+
+    def __init__(self, t3, o1, t4, o2):
+        self.T3, self.O1, self.T4, self.O2 = t3, o1, t4, o2
+
+
+def make_packet(n):
+    return [Sample(*(random.uniform(-1e-4, 1e-4) for _ in range(4))) for _ in range(n)]
+
+
+def convert_loop(data):
+    raw_channels = []
+    for sample in data:
+        left_bipolar = sample.T3 - sample.O1
+        right_bipolar = sample.T4 - sample.O2
+        raw_channels.append(support_classes.RawChannels(left_bipolar, right_bipolar))
+    return raw_channels
+
+
+def make_convert_numpy():
+    batch = RawChannelsBatch()
+
+    def convert_numpy(data):
+        n = len(data)
+        values = np.fromiter((v for s in data for v in (s.T3, s.O1, s.T4, s.O2)),
+                             dtype=np.float64, count=4 * n).reshape(n, 4)
+        left = (values[:, 0] - values[:, 1]).tolist()
+        right = (values[:, 2] - values[:, 3]).tolist()
+        if n > len(batch._channels):
+            batch._grow(n)
+        channels = batch._channels[:n]
+        for ch, l, r in zip(channels, left, right):
+            ch.left_bipolar = l
+            ch.right_bipolar = r
+        return channels
+
+    return convert_numpy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark signal packet conversion')
+    parser.add_argument('--packets', type=int, nargs='+', default=[5, 25, 250], help='samples per packet')
+    parser.add_argument('--samples', type=int, default=500_000, help='samples converted per measurement')
+    args = parser.parse_args()
+
+    variants = {
+        'loop': convert_loop,
+        'numpy': make_convert_numpy(),
+        'batch': RawChannelsBatch().convert,
+    }
+    print(f"{'packet':>7} {'variant':>8} {'Msamples/s':>11} {'vs loop':>8}")
+    for size in args.packets:
+        packet = make_packet(size)
+        repeats = max(1, args.samples // size)
+        rates = {}
+        for name, fn in variants.items():
+            seconds = min(timeit.repeat(lambda: fn(packet), number=repeats, repeat=3))
+            rates[name] = size * repeats / seconds
+        for name, rate in rates.items():
+            print(f"{size:>7} {name:>8} {rate / 1e6:>11.2f} {rate / rates['loop']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
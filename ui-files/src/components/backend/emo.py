@@ -1,43 +1,69 @@
 from neurosdk.scanner import Scanner
 from em_st_artifacts.utils import lib_settings
-from em_st_artifacts.utils import support_classes
 from em_st_artifacts import emotional_math
 from neurosdk.cmn_types import *
 
-from time import sleep
 import csv
+import os
+import threading
 from datetime import datetime
-import numpy as np
+
+from features import compute_apen
+from recorder_pipeline import (RateLimitedLog, RecorderPipeline, acquire_output_lock, output_lock_held,
+                               release_output_lock)
+from recorder_supervisor import output_for
+from signal_batch import RawChannelsBatch
+import session_store
+
+# Recording defaults: a 5 minute session into bci_calm.csv
+OUTPUT_CSV = "bci_calm.csv"
+RECORD_SECONDS = 300
+# The scan stops as soon as a headband shows up; SCAN_TIMEOUT is only the upper bound
+SCAN_TIMEOUT = 25
+RESIST_SECONDS = 20
 
 # Initialize global variables
 csv_writer = None
 output_file = None
 math = None
+progress = None
+pipeline = None
+raw_batch = RawChannelsBatch()
+sensor_seen = threading.Event()
+scan_device = None
 
-# ApEn function
-def compute_apen(U, m=2, r=None):
-    U = np.array(U)
-    N = len(U)
-    if r is None:
-        r = 0.2 * np.std(U)
+# Buffers to store recent spectral values
+alpha_buffer, beta_buffer, theta_buffer = [], [], []
 
-    def _phi(m):
-        x = np.array([U[i:i + m] for i in range(N - m + 1)])
-        C = []
-        for xi in x:
-            dist = np.max(np.abs(x - xi), axis=1)
-            C.append(np.sum(dist <=r) )
-        return np.sum(np.log(C)) / (N - m + 1)
+# Console output is limited to one line per kind per second; at the full
+# sampling rate per-row prints would slow the worker down
+log = RateLimitedLog(interval=1.0)
 
-    return abs(_phi(m) - _phi(m + 1))
 
-# Buffers to store recent spectral values
-alpha_buffer, beta_buffer, theta_buffer = [], [], []
+def sensor_ids(info):
+    return [getattr(info, key, None) for key in ('Name', 'SerialNumber', 'Address')]
+
+
+def recorded_by_named_session(info):
+    # A named session records into its own output (recorder_supervisor.output_for)
+    # and holds its lock while it runs
+    return any(ident and output_lock_held(output_for(ident)) for ident in sensor_ids(info))
+
+
+def wanted_sensor(info):
+    """The requested device, or with none requested any headband that a
+    named session is not already recording."""
+    if scan_device:
+        return scan_device in sensor_ids(info)
+    return not recorded_by_named_session(info)
 
 
 def sensor_found(scanner, sensors):
     for index in range(len(sensors)):
         print('Sensor found: %s' % sensors[index])
+    # The scan only ends early for a headband this session will record
+    if any(wanted_sensor(info) for info in sensors):
+        sensor_seen.set()
 
 
 def on_sensor_state_changed(sensor, state):
@@ -49,27 +75,26 @@ def on_battery_changed(sensor, battery):
 
 
 def on_signal_received(sensor, data):
-    global csv_writer, math, alpha_buffer, beta_buffer, theta_buffer
-    raw_channels = []
-    for sample in data:
-        left_bipolar = sample.T3 - sample.O1
-        right_bipolar = sample.T4 - sample.O2
-        raw_channels.append(support_classes.RawChannels(left_bipolar, right_bipolar))
+    # Runs on the SDK thread: hand the packet to the worker and return
+    pipeline.submit(data)
 
-    math.push_data(raw_channels)
+
+def process_packet(data, received_at):
+    global csv_writer, math, alpha_buffer, beta_buffer, theta_buffer
+    math.push_data(raw_batch.convert(data))
     math.process_data_arr()
-    print("Artifacted: both sides - {0}, sequence - {1}".format(
-        math.is_both_sides_artifacted(), math.is_artifacted_sequence()
-    ))
+    log("artifacts", "Artifacted: both sides - {0}, sequence - {1}",
+        math.is_both_sides_artifacted(), math.is_artifacted_sequence())
 
     if not math.calibration_finished():
-        print("Calibration percents: {0}".format(math.get_calibration_percents()))
+        log("calibration", "Calibration percents: {0}", math.get_calibration_percents())
     else:
         mental_data = math.read_mental_data_arr()
         spectral_data = math.read_spectral_data_percents_arr()
+        # Stamped with when the packet arrived, not when the worker got to it
+        now = datetime.fromtimestamp(received_at).strftime("%Y-%m-%d %H:%M:%S")
 
         for mind, spec in zip(mental_data, spectral_data):
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
             alpha_buffer.append(spec.alpha)
             beta_buffer.append(spec.beta)
@@ -92,12 +117,12 @@ def on_signal_received(sensor, data):
                 spec.delta, spec.theta, spec.alpha, spec.beta, spec.gamma,
                 apen_alpha, apen_beta, apen_theta
             ])
+            if progress is not None:
+                progress.add_rows()
 
-            print("Mental data: {0}".format(mind))
-            print("Spectral data: {0}".format(spec))
-            print(f"ApEn - Alpha: {apen_alpha}, Beta: {apen_beta}, Theta: {apen_theta}")
-
-            sleep(0.3)
+            log("mental", "Mental data: {0}", mind)
+            log("spectral", "Spectral data: {0}", spec)
+            log("apen", "ApEn - Alpha: {0}, Beta: {1}, Theta: {2}", apen_alpha, apen_beta, apen_theta)
 
 
 def on_resist_received(sensor, data):
@@ -106,104 +131,159 @@ def on_resist_received(sensor, data):
     print("T3 resist is normal: {0}. Current T3 resist {1}".format(data.T3 < 2000000, data.T3))
     print("T4 resist is normal: {0}. Current T4 resist {1}".format(data.T4 < 2000000, data.T4))
 
-try:
-    output_file = open("bci_calm.csv", mode="w", newline='')
-    csv_writer = csv.writer(output_file)
-    csv_writer.writerow([
-        "Timestamp",
-        "Rel_Attention", "Rel_Relaxation",
-        "Inst_Attention", "Inst_Relaxation",
-        "Delta", "Theta", "Alpha", "Beta", "Gamma",
-        "ApEn_Alpha", "ApEn_Beta", "ApEn_Theta"
-    ])
-
-    scanner = Scanner([SensorFamily.LEHeadband])
-
-    scanner.sensorsChanged = sensor_found
-    scanner.start()
-    print("Starting search for 25 sec...")
-    sleep(25)
-    scanner.stop()
-
-    sensorsInfo = scanner.sensors()
-    for i in range(len(sensorsInfo)):
-        current_sensor_info = sensorsInfo[i]
-        sensor = scanner.create_sensor(current_sensor_info)
-        print("Current connected device {0}".format(current_sensor_info))
-
-        sensor.sensorStateChanged = on_sensor_state_changed
-        sensor.batteryChanged = on_battery_changed
-        sensor.signalDataReceived = on_signal_received
-        sensor.resistDataReceived = on_resist_received
-
-        sensor.exec_command(SensorCommand.StartResist)
-        print("Start resistance")
-        sleep(20)
-        sensor.exec_command(SensorCommand.StopResist)
-        print("Stop resistance")
-
-        calibration_length = 6
-        nwins_skip_after_artifact = 10
-
-        mls = lib_settings.MathLibSetting(
-            sampling_rate=250,
-            process_win_freq=25,
-            n_first_sec_skipped=4,
-            fft_window=1000,
-            bipolar_mode=True,
-            squared_spectrum=True,
-            channels_number=4,
-            channel_for_analysis=0
-        )
-        ads = lib_settings.ArtifactDetectSetting(
-            art_bord=110,
-            allowed_percent_artpoints=70,
-            raw_betap_limit=800_000,
-            global_artwin_sec=4,
-            num_wins_for_quality_avg=125,
-            hamming_win_spectrum=True,
-            hanning_win_spectrum=False,
-            total_pow_border=400_000_000,
-            spect_art_by_totalp=True
-        )
-        sads = lib_settings.ShortArtifactDetectSetting(
-            ampl_art_detect_win_size=200,
-            ampl_art_zerod_area=200,
-            ampl_art_extremum_border=25
-        )
-        mss = lib_settings.MentalAndSpectralSetting(
-            n_sec_for_averaging=2,
-            n_sec_for_instant_estimation=4
-        )
-
-        math = emotional_math.EmotionalMath(mls, ads, sads, mss)
-        math.set_calibration_length(calibration_length)
-        math.set_mental_estimation_mode(False)
-        math.set_skip_wins_after_artifact(nwins_skip_after_artifact)
-        math.set_zero_spect_waves(True, 0, 1, 1, 1, 0)
-        math.set_spect_normalization_by_bands_width(True)
-
-        if sensor.is_supported_command(SensorCommand.StartSignal):
-            sensor.exec_command(SensorCommand.StartSignal)
-            print("Start signal")
-            math.start_calibration()
-            sleep(300)  # 5 min collection
-            sensor.exec_command(SensorCommand.StopSignal)
-            print("Stop signal")
-
-        sensor.disconnect()
-        print("Disconnect from sensor")
-
-        del sensor
-        del math
-
-    del scanner
-    print('Remove scanner')
-
-except Exception as err:
-    print("Error:", err)
-
-finally:
-    if output_file:
-        output_file.close()
-        print("CSV file saved as 'bci_data_log.csv'")
\ No newline at end of file
+# === Recording ===
+def record_session(output_path=OUTPUT_CSV, duration=RECORD_SECONDS, device=None, session_progress=None):
+    """Record one session from the headset into output_path.
+
+    device picks a headband by name, serial number or address (default: every
+    headband found, one after the other). session_progress is an optional
+    RecorderProgress to report the phase and rows written to, and to be
+    stopped through. Returns the pipeline stats of the last sensor, or None.
+    """
+    global csv_writer, output_file, math, progress, pipeline, scan_device, alpha_buffer, beta_buffer, theta_buffer
+    progress = session_progress
+    stop = progress.stop if progress is not None else threading.Event()
+    if progress is not None:
+        progress.begin(duration)
+    alpha_buffer, beta_buffer, theta_buffer = [], [], []
+    stats = None
+    acquire_output_lock(output_path)
+    try:
+        # The previous recording becomes a session of its own (bci_calm, or
+        # bci_calm_<device>) instead of being recorded over
+        stream = os.path.splitext(os.path.basename(output_path))[0]
+        session_store.archive_file(output_path, stream)
+        session_store.start_maintenance()
+        output_file = open(output_path, mode="w", newline='')
+        csv_writer = csv.writer(output_file)
+        csv_writer.writerow([
+            "Timestamp",
+            "Rel_Attention", "Rel_Relaxation",
+            "Inst_Attention", "Inst_Relaxation",
+            "Delta", "Theta", "Alpha", "Beta", "Gamma",
+            "ApEn_Alpha", "ApEn_Beta", "ApEn_Theta"
+        ])
+
+        scanner = Scanner([SensorFamily.LEHeadband])
+
+        scanner.sensorsChanged = sensor_found
+        scan_device = device
+        sensor_seen.clear()
+        scanner.start()
+        print("Starting search for up to {0} sec...".format(SCAN_TIMEOUT))
+        sensor_seen.wait(SCAN_TIMEOUT)
+        scanner.stop()
+
+        sensorsInfo = [info for info in scanner.sensors() if wanted_sensor(info)]
+        if not sensorsInfo:
+            wanted = f"matching '{device}'" if device else "that no named session is recording"
+            raise RuntimeError(f"No sensors found {wanted}")
+        for i in range(len(sensorsInfo)):
+            if stop.is_set():
+                break
+            current_sensor_info = sensorsInfo[i]
+            sensor = scanner.create_sensor(current_sensor_info)
+            print("Current connected device {0}".format(current_sensor_info))
+
+            sensor.sensorStateChanged = on_sensor_state_changed
+            sensor.batteryChanged = on_battery_changed
+            sensor.signalDataReceived = on_signal_received
+            sensor.resistDataReceived = on_resist_received
+
+            if progress is not None:
+                progress.set_phase('resistance')
+            sensor.exec_command(SensorCommand.StartResist)
+            print("Start resistance")
+            stop.wait(RESIST_SECONDS)
+            sensor.exec_command(SensorCommand.StopResist)
+            print("Stop resistance")
+
+            calibration_length = 6
+            nwins_skip_after_artifact = 10
+
+            mls = lib_settings.MathLibSetting(
+                sampling_rate=250,
+                process_win_freq=25,
+                n_first_sec_skipped=4,
+                fft_window=1000,
+                bipolar_mode=True,
+                squared_spectrum=True,
+                channels_number=4,
+                channel_for_analysis=0
+            )
+            ads = lib_settings.ArtifactDetectSetting(
+                art_bord=110,
+                allowed_percent_artpoints=70,
+                raw_betap_limit=800_000,
+                global_artwin_sec=4,
+                num_wins_for_quality_avg=125,
+                hamming_win_spectrum=True,
+                hanning_win_spectrum=False,
+                total_pow_border=400_000_000,
+                spect_art_by_totalp=True
+            )
+            sads = lib_settings.ShortArtifactDetectSetting(
+                ampl_art_detect_win_size=200,
+                ampl_art_zerod_area=200,
+                ampl_art_extremum_border=25
+            )
+            mss = lib_settings.MentalAndSpectralSetting(
+                n_sec_for_averaging=2,
+                n_sec_for_instant_estimation=4
+            )
+
+            math = emotional_math.EmotionalMath(mls, ads, sads, mss)
+            math.set_calibration_length(calibration_length)
+            math.set_mental_estimation_mode(False)
+            math.set_skip_wins_after_artifact(nwins_skip_after_artifact)
+            math.set_zero_spect_waves(True, 0, 1, 1, 1, 0)
+            math.set_spect_normalization_by_bands_width(True)
+
+            if not stop.is_set() and sensor.is_supported_command(SensorCommand.StartSignal):
+                pipeline = RecorderPipeline(process_packet, sampling_rate=250)
+                sensor.exec_command(SensorCommand.StartSignal)
+                print("Start signal")
+                math.start_calibration()
+                pipeline.start()
+                if progress is not None:
+                    progress.set_phase('recording')
+                stop.wait(duration)  # 5 min collection by default, or until stopped
+                if progress is not None:
+                    progress.set_phase('stopping')
+                sensor.exec_command(SensorCommand.StopSignal)
+                print("Stop signal")
+                # Process whatever is still queued before the math object goes away
+                pipeline.stop()
+                pipeline.print_report()
+                stats = pipeline.stats()
+
+            sensor.disconnect()
+            print("Disconnect from sensor")
+
+            del sensor
+            math = None
+
+        del scanner
+        print('Remove scanner')
+        if progress is not None:
+            progress.set_phase('done')
+        return stats
+
+    except Exception:
+        if progress is not None:
+            progress.set_phase('failed')
+        raise
+
+    finally:
+        if output_file:
+            output_file.close()
+            output_file = None
+            print("CSV file saved as '{0}'".format(output_path))
+        release_output_lock(output_path)
+
+
+if __name__ == '__main__':
+    try:
+        record_session()
+    except Exception as err:
+        print("Error:", err)
@@ -0,0 +1,256 @@
+# features.py
+#
+# Feature extraction shared by training (model.py) and serving
+# (realtime_predict_api.py). Features are declared once in FEATURES; both
+# sides ask for them by name, the input columns are averaged once per window
+# and every requested feature is derived from those means, so a feature is
+# never computed twice and the two sides cannot drift apart.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+BANDS = ('delta', 'theta', 'alpha', 'beta', 'gamma')
+
+# Seconds at the start of a recording used as the resting baseline
+BASELINE_SECONDS = 60
+
+# Length of one training segment / prediction epoch in seconds
+SEGMENT_SECONDS = 3
+
+# Features the SVM is trained on and fed at serving time
+MODEL_FEATURES = ['CI_Alpha']
+
+# Epochs with a larger share of artifacted readings get no prediction
+MAX_ARTIFACT_RATIO = 0.5
+
+# Recorder CSVs (emo3.py) use capitalised headers; everything here uses the
+# lowercase names written by bci_api.py
+COLUMN_ALIASES = {
+    'Timestamp': 'timestamp',
+    'Delta': 'delta', 'Theta': 'theta', 'Alpha': 'alpha', 'Beta': 'beta', 'Gamma': 'gamma',
+    'ApEn_Alpha': 'alpha_apen', 'ApEn_Beta': 'beta_apen', 'ApEn_Theta': 'theta_apen',
+    'Rel_Attention': 'rel_attention', 'Rel_Relaxation': 'rel_relaxation',
+    'Inst_Attention': 'inst_attention', 'Inst_Relaxation': 'inst_relaxation',
+}
+
+
+def canonical_column(name):
+    return COLUMN_ALIASES.get(name, name)
+
+
+def artifact_flags(values):
+    """Boolean array from an 'artifacted' column (bools or 'True'/'False' text)."""
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return np.array([str(v).strip().lower() in ('true', '1', '1.0') for v in values], dtype=bool)
+
+
+# === ApEn ===
+def compute_apen(U, m=2, r=None):
+    """Approximate entropy of a short series (the 20-sample band buffers).
+
+    Same result as the original loop version; the template distances are
+    computed for all pairs at once.
+    """
+    U = np.asarray(U, dtype=np.float64)
+    N = len(U)
+    if r is None:
+        r = 0.2 * np.std(U)
+
+    def _phi(m):
+        x = sliding_window_view(U, m)
+        dist = np.max(np.abs(x[:, None, :] - x[None, :, :]), axis=2)
+        C = np.sum(dist <= r, axis=1)
+        return np.sum(np.log(C)) / (N - m + 1)
+
+    return abs(_phi(m) - _phi(m + 1))
+
+
+# === Feature declarations ===
+class Feature:
+    """A named feature computed from per-window column means.
+
+    inputs are the columns whose window mean the feature needs, baseline the
+    bands whose resting baseline it needs; fn(means, baseline) gets dicts of
+    arrays (one value per window) and returns an array.
+    """
+
+    __slots__ = ('name', 'inputs', 'baseline', 'fn')
+
+    def __init__(self, name, inputs, fn, baseline=()):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.baseline = tuple(baseline)
+        self.fn = fn
+
+
+def _ci(band):
+    # Cognitive index: drop of band power relative to the resting baseline, in %
+    return lambda m, b: (b[band] - m[band]) / b[band] * 100
+
+
+def _ratio(num, den):
+    return lambda m, b: m[num] / m[den]
+
+
+def _mean(column):
+    return lambda m, b: m[column]
+
+
+FEATURES = {}
+
+
+def _declare(feature):
+    FEATURES[feature.name] = feature
+
+
+for _band in BANDS:
+    _declare(Feature('CI_' + _band.capitalize(), [_band], _ci(_band), baseline=[_band]))
+for _band in ('alpha', 'beta', 'theta'):
+    _declare(Feature(_band + '_apen', [_band + '_apen'], _mean(_band + '_apen')))
+_declare(Feature('theta_beta_ratio', ['theta', 'beta'], _ratio('theta', 'beta')))
+_declare(Feature('alpha_theta_ratio', ['alpha', 'theta'], _ratio('alpha', 'theta')))
+_declare(Feature('engagement_index', ['beta', 'alpha', 'theta'],
+                 lambda m, b: m['beta'] / (m['alpha'] + m['theta'])))
+_declare(Feature('rel_attention', ['rel_attention'], _mean('rel_attention')))
+_declare(Feature('rel_relaxation', ['rel_relaxation'], _mean('rel_relaxation')))
+
+
+def _lookup(names):
+    unknown = [name for name in names if name not in FEATURES]
+    if unknown:
+        raise KeyError(f"Unknown feature(s): {', '.join(unknown)}")
+    return [FEATURES[name] for name in names]
+
+
+def required_columns(names):
+    """Input columns needed for the given features, each listed once."""
+    columns = []
+    for feature in _lookup(names):
+        for column in feature.inputs:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def baseline_bands(names):
+    bands = []
+    for feature in _lookup(names):
+        for band in feature.baseline:
+            if band not in bands:
+                bands.append(band)
+    return bands
+
+
+def available_features(columns):
+    """Names of all declared features whose inputs are present in columns."""
+    columns = set(columns)
+    return [name for name, feature in FEATURES.items() if columns.issuperset(feature.inputs)]
+
+
+# === Computation ===
+def compute_baseline(seconds, columns, bands, baseline_seconds=BASELINE_SECONDS):
+    """Mean of each band over the first baseline_seconds of a recording.
+
+    seconds are offsets from the recording start; columns maps band -> array.
+    """
+    mask = np.asarray(seconds) <= baseline_seconds
+    return {band: float(np.nanmean(np.asarray(columns[band], dtype=np.float64)[mask])) for band in bands}
+
+
+def segment_means(segment_ids, columns):
+    """NaN-ignoring mean of every column per segment, in one bincount pass each.
+
+    Returns (segments, means) with segments sorted ascending and means mapping
+    column -> array aligned with segments.
+    """
+    segments, inverse = np.unique(np.asarray(segment_ids), return_inverse=True)
+    n = len(segments)
+    means = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.bincount(inverse, weights=np.where(valid, values, 0.0), minlength=n)
+        counts = np.bincount(inverse, weights=valid, minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[name] = sums / counts
+    return segments, means
+
+
+def block_means(block, index, keep=None):
+    """NaN-ignoring mean of several columns of one window.
+
+    block is a 2-D float array with one row per reading; index maps column
+    name -> column number in block and keep optionally selects the rows to
+    average. Output is shaped like segment_means output.
+    """
+    names = list(index)
+    cols = np.array([index[name] for name in names], dtype=np.intp)
+    weights = np.ones(len(block)) if keep is None else keep.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # One matrix-vector product sums every column over the kept rows
+        means = (weights @ block)[cols] / weights.sum()
+        missing = np.isnan(means)
+        if missing.any():
+            # NaNs in those columns (also 0 * NaN from dropped rows): average
+            # just the valid values there
+            values = block[:, cols[missing]]
+            valid = ~np.isnan(values)
+            if keep is not None:
+                valid &= keep[:, None]
+            means[missing] = np.where(valid, values, 0.0).sum(axis=0) / valid.sum(axis=0)
+    return {name: means[i:i + 1] for i, name in enumerate(names)}
+
+
+def compute_features(means, baseline, names):
+    """Derive the named features from window means.
+
+    Returns an array of shape (n_windows, len(names)), columns in the order of
+    names.
+    """
+    out = []
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for feature in _lookup(names):
+            out.append(np.asarray(feature.fn(means, baseline), dtype=np.float64))
+    if not out:
+        return np.empty((0, 0))
+    return np.column_stack(out)
+
+
+# === Epoch windows ===
+def epoch_windows(ts, ticks, epoch_seconds, max_readings=None):
+    """Index bounds of the readings the predictor averages at each tick.
+
+    ts are sorted reading times and ticks the times at which the predictor
+    runs, both in seconds. A window holds the readings with
+    tick - epoch_seconds <= ts <= tick, limited to the last max_readings of
+    them (bci_api only serves its last few readings). Returns (starts, ends)
+    for slicing, found by binary search.
+    """
+    ts = np.asarray(ts, dtype=np.float64)
+    ticks = np.asarray(ticks, dtype=np.float64)
+    ends = np.searchsorted(ts, ticks, side='right')
+    starts = np.searchsorted(ts, ticks - epoch_seconds, side='left')
+    if max_readings:
+        starts = np.maximum(starts, ends - max_readings)
+    return starts, ends
+
+
+def windowed_means(columns, starts, ends):
+    """NaN-ignoring mean of every column over each [start, end) window.
+
+    Uses prefix sums, so the cost does not depend on the window length.
+    Output is shaped like segment_means output.
+    """
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    means = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[name] = (sums[ends] - sums[starts]) / (counts[ends] - counts[starts])
+    return means
@@ -0,0 +1,166 @@
+# load_test.py
+#
+# Requests/sec and tail latency of /api/data under the Flask development
+# server (how bci_api.py runs today) and under the async server
+# (asgi_server.py), at 10, 100 and 1000 concurrent clients. Each server runs
+# in its own process with a simulated headset publishing readings at the
+# real rate; each client polls in a closed loop on a keep-alive connection
+# (reconnecting when the server closes it, as the Flask server does after
+# every response).
+#
+#   python load_test.py
+#   python load_test.py --clients 10 100 --seconds 5 --servers asgi
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+SERVERS = ('flask', 'asgi')
+READING_RATE = 25  # spectral rows per second from the headset
+
+
+# === Servers ===
+def _feed_readings():
+    import bci_api
+    from bench_api_data import fake_reading
+
+    def feed():
+        k = 0
+        while True:
+            k += 1
+            bci_api.publish_reading(fake_reading(k))
+            time.sleep(1 / READING_RATE)
+    threading.Thread(target=feed, daemon=True).start()
+
+
+def serve(kind, port):
+    _feed_readings()
+    if kind == 'flask':
+        import logging
+        import bci_api
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        bci_api.app.run(port=port, threaded=True)
+    else:
+        import asgi_server
+        asyncio.run(asgi_server.serve([port], sensor=False, predict=False))
+
+
+def start_server(kind, port):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', kind, '--port', str(port)],
+                            stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            asyncio.run(_probe(port))
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not come up on port {port}")
+
+
+async def _probe(port):
+    _, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.close()
+
+
+# === Client ===
+async def _request(conn, port, path):
+    """One GET; returns (connection to reuse or None, status)."""
+    if conn is None:
+        conn = await asyncio.open_connection('127.0.0.1', port)
+    reader, writer = conn
+    writer.write(b'GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % path.encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('closed before response')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        key, _, value = line.partition(b':')
+        headers[key.strip().lower()] = value.strip().lower()
+    if b'content-length' in headers:
+        await reader.readexactly(int(headers[b'content-length']))
+    else:
+        await reader.read()
+    keep = status_line.startswith(b'HTTP/1.1') and headers.get(b'connection') != b'close'
+    if not keep:
+        writer.close()
+        conn = None
+    return conn, int(status_line.split()[1])
+
+
+async def _client(port, path, deadline, latencies, counts):
+    conn = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn, status = await asyncio.wait_for(_request(conn, port, path), 10)
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            counts['errors'] += 1
+            if conn is not None:
+                conn[1].close()
+            conn = None
+            await asyncio.sleep(0.01)
+            continue
+        latencies.append(time.perf_counter() - start)
+        counts['ok' if status == 200 else 'errors'] += 1
+    if conn is not None:
+        conn[1].close()
+
+
+async def run_clients(port, path, clients, seconds):
+    latencies = []
+    counts = {'ok': 0, 'errors': 0}
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*(_client(port, path, deadline, latencies, counts) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    lat = np.asarray(latencies or [np.nan]) * 1000
+    return {
+        'per_sec': counts['ok'] / elapsed,
+        'p50_ms': float(np.percentile(lat, 50)),
+        'p99_ms': float(np.percentile(lat, 99)),
+        'errors': counts['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test Flask vs async serving of /api/data')
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS))
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--path', default='/api/data')
+    parser.add_argument('--port', type=int, default=5900)
+    parser.add_argument('--serve', choices=SERVERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+    unknown = set(args.servers) - set(SERVERS)
+    if unknown:
+        parser.error(f"unknown server(s): {', '.join(sorted(unknown))}")
+
+    for kind in args.servers:
+        proc = start_server(kind, args.port)
+        try:
+            for clients in args.clients:
+                r = asyncio.run(run_clients(args.port, args.path, clients, args.seconds))
+                print(f"{kind:>5} {clients:>5} clients: {r['per_sec']:>8.0f} req/s, "
+                      f"p50 {r['p50_ms']:>8.1f} ms, p99 {r['p99_ms']:>8.1f} ms, {r['errors']} errors")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
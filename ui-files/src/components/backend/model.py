@@ -10,6 +10,9 @@ from sklearn.metrics import classification_report, confusion_matrix
 import warnings
 import os
 import pickle
+
+import features
+import model_bundle
 warnings.filterwarnings('ignore')
 
 # === Setup Paths ===
@@ -23,39 +26,46 @@ if not os.path.exists(file_path):
 
 # === Load Data ===
 data = pd.read_csv(file_path)
+data.rename(columns=features.canonical_column, inplace=True)
 data['timestamp'] = pd.to_datetime(data['timestamp'])
 
-# === Baseline: First 1 Minute ===
-start_time = data['timestamp'].min()
-baseline_end = start_time + pd.Timedelta(seconds=60)
-baseline_df = data[data['timestamp'] <= baseline_end]
-
-baseline_alpha = baseline_df['alpha'].mean()
-baseline_beta = baseline_df['beta'].mean()
-baseline_theta = baseline_df['theta'].mean()
-
-print(f"Baseline - Alpha: {baseline_alpha:.2f}, Beta: {baseline_beta:.2f}, Theta: {baseline_theta:.2f}")
+# Rows bci_api flagged as artifacted carry no usable spectrum
+if 'artifacted' in data.columns:
+    clean = ~features.artifact_flags(data['artifacted'].to_numpy())
+    print(f"Dropping {int((~clean).sum())} artifacted rows of {len(data)}")
+    data = data[clean].reset_index(drop=True)
 
 # === Segment Data ===
 data['Seconds'] = (data['timestamp'] - data['timestamp'].iloc[0]).dt.total_seconds()
-segment_length = 3
+segment_length = features.SEGMENT_SECONDS
 data['Segment'] = (data['Seconds'] // segment_length).astype(int)
 
-# === Compute Band Power Averages and CLI ===
-def compute_ci(baseline, current):
-    return ((baseline - current) / baseline) * 100
+# === Features ===
+# Every declared feature whose inputs this recording has (the recorder CSV has
+# all five bands, bci_api's only alpha/beta/theta); each input column is
+# averaged once per segment and all features are derived from those means.
+feature_names = features.available_features(data.columns)
+if 'CI_Alpha' not in feature_names:
+    raise ValueError("The 'alpha' column is not available in the dataset.")
+input_cols = features.required_columns(feature_names)
+columns = {col: pd.to_numeric(data[col], errors='coerce').to_numpy() for col in input_cols}
 
-segmented = data.groupby('Segment')[['alpha', 'beta', 'theta']].mean().reset_index()
-segmented['CI_Alpha'] = compute_ci(baseline_alpha, segmented['alpha'])
-segmented['CI_Beta'] = compute_ci(baseline_beta, segmented['beta'])
-segmented['CI_Theta'] = compute_ci(baseline_theta, segmented['theta'])
-
-# Add ApEn features if available
-apen_features = []
-for apen_col in ['alpha_apen', 'beta_apen', 'theta_apen']:
-    if apen_col in data.columns:
-        segmented[apen_col] = data.groupby('Segment')[apen_col].mean().values
-        apen_features.append(apen_col)
+# === Baseline: First 1 Minute ===
+bands = features.baseline_bands(feature_names)
+baseline = features.compute_baseline(data['Seconds'].to_numpy(), columns, bands)
+baseline_alpha = baseline['alpha']
+print("Baseline - " + ", ".join(f"{band.capitalize()}: {value:.2f}" for band, value in baseline.items()))
+
+segment_ids, means = features.segment_means(data['Segment'].to_numpy(), columns)
+segmented = pd.DataFrame(
+    features.compute_features(means, baseline, feature_names),
+    columns=feature_names,
+)
+segmented.insert(0, 'Segment', segment_ids)
+for band in ('alpha', 'beta', 'theta'):
+    segmented[band] = means[band]
+
+apen_features = [name for name in ('alpha_apen', 'beta_apen', 'theta_apen') if name in feature_names]
 
 # === Labeling Based on Alpha CLI (Median Split) ===
 median_alpha_cli = segmented['CI_Alpha'].median()
@@ -66,13 +76,14 @@ segmented['label'] = segmented['CI_Alpha'].apply(lambda x: 1 if x > median_alpha
 if 'alpha_apen' not in segmented.columns:
     raise ValueError("The 'alpha_apen' column is not available in the dataset.")
 
-feature_cols = ['CI_Alpha']
+feature_cols = features.MODEL_FEATURES
 X = segmented[feature_cols].copy()
 y = segmented['label']
 
 # === Handle Missing/Infinite Values ===
 X.replace([np.inf, -np.inf], np.nan, inplace=True)
-X = SimpleImputer(strategy='mean').fit_transform(X)
+imputer = SimpleImputer(strategy='mean')
+X = imputer.fit_transform(X)
 
 # === No Normalization ===
 X_scaled = X  # Linear SVM does not require normalization for single-feature CLI interpretation
@@ -104,6 +115,13 @@ y_pred = svm.predict(X_test)
 with open(os.path.join(current_dir, 'trained_model.pkl'), 'wb') as f:
     pickle.dump(svm, f)
 
+# Versioned bundle with everything the predictor needs to rebuild the inputs
+bundle = model_bundle.save_bundle(
+    svm, feature_cols, baseline, segment_length, file_path,
+    impute_values=imputer.statistics_, label_threshold=median_alpha_cli,
+)
+print(f"Model bundle version {bundle['version']} (data sha256 {bundle['data_sha256'][:12]})")
+
 # === Evaluation ===
 print("\nClassification Report:")
 print(classification_report(y_test, y_pred, target_names=['Low Load', 'High Load']))
@@ -151,6 +169,6 @@ merged_data.to_csv(os.path.join(current_dir, "model_output.csv"), index=False)
 
 # === Confirmation ===
 print("\n=== Files Saved ===")
-for fname in ['graph.png', 'confusion_matrix.png', 'graph_svm.png', 'model_output.csv', 'trained_model.pkl']:
+for fname in ['graph.png', 'confusion_matrix.png', 'graph_svm.png', 'model_output.csv', 'trained_model.pkl', 'model_bundle.pkl']:
     path = os.path.join(current_dir, fname)
     print(f"{fname}: {'Exists' if os.path.exists(path) else 'Missing'} ({os.path.getsize(path)} bytes)")
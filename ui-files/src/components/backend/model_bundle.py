@@ -0,0 +1,141 @@
+# model_bundle.py
+#
+# Versioned model artifacts. model.py saves the SVM together with everything
+# needed to reproduce its inputs at serving time: feature list, baseline,
+# segment length, imputation values and a hash of the training data. The
+# predictor loads the bundle and checks up front that it can compute those
+# features from the live readings, instead of silently feeding the model
+# something it was not trained on.
+#
+# A bundle is a plain dict so unpickling it only needs sklearn, not this module.
+
+import hashlib
+import os
+import pickle
+import tempfile
+from datetime import datetime
+
+import features
+
+BUNDLE_FORMAT = 1
+BUNDLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_bundle.pkl')
+
+
+class ModelBundleError(ValueError):
+    pass
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# mkstemp creates files 0600; a saved bundle gets 0644 less the umask, like the
+# model_bundle.pkl it replaces, so a service running as another user can load it
+FILE_MODE = 0o644 & ~_umask()
+
+
+def _mkstemp(directory):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    if hasattr(os, 'fchmod'):
+        os.fchmod(fd, FILE_MODE)
+    return fd, tmp_path
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _previous_version(path):
+    try:
+        with open(path, 'rb') as f:
+            return int(pickle.load(f).get('version', 0))
+    except Exception:
+        return 0
+
+
+def save_bundle(model, feature_names, baseline, segment_length, data_path,
+                impute_values=None, label_threshold=None, path=BUNDLE_PATH):
+    """Write a new bundle version to path and return it.
+
+    label_threshold is the CI_Alpha median the training labels were split
+    at; online adaptation (online_model.py) starts from it. The file is
+    written to a temporary name and renamed into place, so a reader never
+    sees a half-written bundle.
+    """
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'version': _previous_version(path) + 1,
+        'created_at': datetime.now().isoformat(),
+        'model': model,
+        'features': list(feature_names),
+        'baseline': {band: float(value) for band, value in baseline.items()},
+        'baseline_seconds': features.BASELINE_SECONDS,
+        'segment_length': segment_length,
+        'impute_values': [float(v) for v in impute_values] if impute_values is not None else None,
+        'label_threshold': float(label_threshold) if label_threshold is not None else None,
+        'data_file': os.path.basename(data_path),
+        'data_sha256': file_sha256(data_path),
+    }
+    validate_bundle(bundle)
+    fd, tmp_path = _mkstemp(os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(bundle, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return bundle
+
+
+def validate_bundle(bundle, available_columns=None):
+    """Raise ModelBundleError if the bundle is inconsistent or cannot be served.
+
+    available_columns are the fields the serving side gets per reading; when
+    given, every input column the bundle's features need must be among them.
+    """
+    if bundle.get('format') != BUNDLE_FORMAT:
+        raise ModelBundleError(f"Unsupported bundle format {bundle.get('format')!r}")
+    names = bundle.get('features') or []
+    if not names:
+        raise ModelBundleError("Bundle has no feature list")
+    try:
+        bands = features.baseline_bands(names)
+        columns = features.required_columns(names)
+    except KeyError as e:
+        raise ModelBundleError(str(e))
+    missing_baseline = [band for band in bands if band not in bundle.get('baseline', {})]
+    if missing_baseline:
+        raise ModelBundleError(f"Bundle baseline lacks band(s): {', '.join(missing_baseline)}")
+    n_in = getattr(bundle.get('model'), 'n_features_in_', None)
+    if n_in is not None and n_in != len(names):
+        raise ModelBundleError(f"Model expects {n_in} inputs but the bundle lists {len(names)} features")
+    impute = bundle.get('impute_values')
+    if impute is not None and len(impute) != len(names):
+        raise ModelBundleError("impute_values does not match the feature list")
+    if available_columns is not None:
+        missing = [col for col in columns if col not in available_columns]
+        if missing:
+            raise ModelBundleError(
+                f"Features {names} need column(s) {', '.join(missing)} which the live readings do not provide")
+
+
+def load_bundle(path=BUNDLE_PATH, available_columns=None):
+    with open(path, 'rb') as f:
+        bundle = pickle.load(f)
+    if not isinstance(bundle, dict):
+        raise ModelBundleError(f"{path} is not a model bundle")
+    validate_bundle(bundle, available_columns)
+    return bundle
+
+
+def describe(bundle):
+    """Bundle metadata without the model object, e.g. for logging or JSON."""
+    return {key: value for key, value in bundle.items() if key != 'model'}
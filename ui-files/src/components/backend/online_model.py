@@ -0,0 +1,228 @@
+# online_model.py
+#
+# Online adaptation of the load classifier during a test. The offline SVM is
+# trained once on the calm recording, with labels from a median split of
+# CI_Alpha, and its threshold goes stale as a participant's signal drifts
+# over a long session. An OnlineModel follows the drift epoch by epoch:
+#
+#   relabel - the median split itself, with the median tracked as the
+#             session goes (a running median that forgets old epochs)
+#   linear  - a linear classifier seeded with the SVM's weights and updated
+#             by one hinge-loss SGD step per epoch, on the labels of the
+#             running median split
+#
+# Both update in constant time and memory per epoch. The state is a plain
+# dict of floats and lists (like a model bundle), so a checkpoint is a pickle
+# that needs nothing but this module's format number to restore.
+
+import os
+import pickle
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+ONLINE_FORMAT = 1
+MODES = ('relabel', 'linear')
+LABEL_FEATURE = 'CI_Alpha'
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'online_model.pkl')
+
+# Step of the running median, as a share of the running spread. Epochs are
+# 3 s, so 0.01 moves the median across the spread in about 100 epochs (~5 min);
+# faster rates also follow real load changes and mislabel them (see
+# bench_online_model.py).
+MEDIAN_RATE = 0.01
+# SGD step of the linear model and its L2 pull back towards the seed weights
+LEARNING_RATE = 0.05
+REGULARIZATION = 0.001
+
+
+class OnlineModelError(ValueError):
+    pass
+
+
+def linear_weights(model, n_features):
+    """(weights, intercept) of a linear model with a decision_function, or None."""
+    coef = getattr(model, 'coef_', None)
+    if coef is None:
+        return None
+    coef = np.asarray(coef, dtype=np.float64).reshape(-1)
+    if len(coef) != n_features:
+        return None
+    intercept = float(np.asarray(getattr(model, 'intercept_', [0.0])).reshape(-1)[0])
+    return coef, intercept
+
+
+class OnlineModel:
+    """Per-epoch predict-then-learn on top of a model bundle's features."""
+
+    def __init__(self, bundle, mode='relabel', median_rate=MEDIAN_RATE,
+                 learning_rate=LEARNING_RATE, regularization=REGULARIZATION):
+        if mode not in MODES:
+            raise OnlineModelError(f"Unknown online mode {mode!r} (expected one of {', '.join(MODES)})")
+        names = list(bundle['features'])
+        if LABEL_FEATURE not in names:
+            raise OnlineModelError(f"Online labels need {LABEL_FEATURE}, which the bundle does not compute")
+        n = len(names)
+        seed = linear_weights(bundle['model'], n)
+        if mode == 'linear' and seed is None:
+            raise OnlineModelError("linear mode needs a linear model (coef_) to start from")
+        self.mode = mode
+        self.features = names
+        self.bundle_version = bundle['version']
+        self.label_index = names.index(LABEL_FEATURE)
+        self.median_rate = median_rate
+        self.learning_rate = learning_rate
+        self.regularization = regularization
+        # Median split threshold: the training median when the bundle has it,
+        # else the SVM's own boundary on the label feature, else the first epoch
+        threshold = bundle.get('label_threshold')
+        if threshold is None and seed is not None and n == 1 and seed[0][0]:
+            threshold = -seed[1] / seed[0][0]
+        self.median = None if threshold is None else float(threshold)
+        self.spread = None
+        if seed is None:
+            seed = (np.zeros(n), 0.0)
+        self.seed_weights = seed[0].copy()
+        self.seed_intercept = seed[1]
+        self.weights = seed[0].copy()
+        self.intercept = seed[1]
+        # Per-feature running scale, so one step size suits every feature
+        self.scale = np.ones(n)
+        self.updates = 0
+        self.agreements = 0
+
+    def _label(self, x):
+        value = x[self.label_index]
+        if self.median is None:
+            self.median = value
+        deviation = abs(value - self.median)
+        if self.spread is None:
+            self.spread = deviation or 1.0
+        label = 1 if value > self.median else 0
+        # Sign-SGD step towards the median, sized by the running spread, so it
+        # keeps tracking a drifting signal instead of settling on the past
+        step = self.median_rate * self.spread
+        self.median += step if value > self.median else -step if value < self.median else 0.0
+        self.spread += self.median_rate * (deviation - self.spread)
+        return label
+
+    def decision(self, x):
+        return float(self.weights @ x + self.intercept)
+
+    def predict(self, x):
+        """0/1 prediction for one epoch's feature vector, without learning."""
+        x = np.asarray(x, dtype=np.float64)
+        if self.mode == 'relabel':
+            if self.median is None:
+                return int(self.decision(x) > 0)
+            return int(x[self.label_index] > self.median)
+        return int(self.decision(x) > 0)
+
+    def update(self, x):
+        """Predict one epoch, then learn from it. Returns the prediction.
+
+        The prediction is made before the epoch is learned from, so it is an
+        honest out-of-sample guess.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        prediction = self.predict(x)
+        label = self._label(x)
+        if self.mode == 'linear':
+            if not self.updates:
+                self.scale = np.abs(x)
+            self.scale += self.median_rate * (np.abs(x) - self.scale)
+            step = self.learning_rate / np.maximum(self.scale, 1e-12) ** 2
+            sign = 1.0 if label else -1.0
+            # L2 towards the seed keeps the SVM's shape while the boundary moves
+            self.weights -= self.regularization * (self.weights - self.seed_weights)
+            self.intercept -= self.regularization * (self.intercept - self.seed_intercept)
+            if sign * self.decision(x) < 1:
+                self.weights += step * sign * x
+                self.intercept += self.learning_rate * sign
+        self.updates += 1
+        self.agreements += prediction == label
+        return prediction
+
+    # === Checkpoints ===
+    def state(self):
+        return {
+            'format': ONLINE_FORMAT,
+            'saved_at': datetime.now().isoformat(),
+            'mode': self.mode,
+            'features': self.features,
+            'bundle_version': self.bundle_version,
+            'median_rate': self.median_rate,
+            'learning_rate': self.learning_rate,
+            'regularization': self.regularization,
+            'median': self.median,
+            'spread': self.spread,
+            'seed_weights': self.seed_weights.tolist(),
+            'seed_intercept': self.seed_intercept,
+            'weights': self.weights.tolist(),
+            'intercept': self.intercept,
+            'scale': self.scale.tolist(),
+            'updates': self.updates,
+            'agreements': self.agreements,
+        }
+
+    def restore(self, state):
+        """Continue from a checkpoint made for the same bundle and mode."""
+        if state.get('format') != ONLINE_FORMAT:
+            raise OnlineModelError(f"Unsupported online checkpoint format {state.get('format')!r}")
+        if state['features'] != self.features or state['bundle_version'] != self.bundle_version:
+            raise OnlineModelError(
+                f"Checkpoint is for bundle version {state['bundle_version']} with features {state['features']}")
+        if state['mode'] != self.mode:
+            raise OnlineModelError(f"Checkpoint is for mode {state['mode']!r}, not {self.mode!r}")
+        for key in ('median_rate', 'learning_rate', 'regularization', 'median', 'spread',
+                    'seed_intercept', 'intercept', 'updates', 'agreements'):
+            setattr(self, key, state[key])
+        for key in ('seed_weights', 'weights', 'scale'):
+            setattr(self, key, np.asarray(state[key], dtype=np.float64))
+        return self
+
+    def describe(self):
+        return {
+            'mode': self.mode,
+            'bundle_version': self.bundle_version,
+            'updates': self.updates,
+            'median': self.median,
+            'label_agreement': self.agreements / self.updates if self.updates else None,
+        }
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# mkstemp creates files 0600; a checkpoint gets 0644 less the umask, like the
+# model bundle it adapts, so a service running as another user can load it
+FILE_MODE = 0o644 & ~_umask()
+
+
+def save_checkpoint(model, path=CHECKPOINT_PATH):
+    """Write model.state() to path atomically (temporary file + rename)."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    if hasattr(os, 'fchmod'):
+        os.fchmod(fd, FILE_MODE)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(model.state(), f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_checkpoint(bundle, mode, path=CHECKPOINT_PATH):
+    """OnlineModel for bundle restored from path; raises OnlineModelError if
+    the checkpoint does not fit."""
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if not isinstance(state, dict):
+        raise OnlineModelError(f"{path} is not an online model checkpoint")
+    return OnlineModel(bundle, mode).restore(state)
@@ -0,0 +1,193 @@
+# question_selector.py
+#
+# Server-side adaptive question selection. The bank is indexed once by topic
+# and difficulty; each test session keeps a cursor per (topic, difficulty)
+# bucket, so picking the next question never scans the bank or the list of
+# questions already asked:
+#   - the target difficulty follows the cognitive load (High -> easier,
+#     Low -> harder, Medium -> same),
+#   - the nearest difficulty level that still has unasked questions is found
+#     by binary search over the topic's sorted levels,
+#   - the question is the bucket entry at the session's cursor, O(1).
+# Sessions end with /end_session; one left idle for SESSION_IDLE_SECONDS (an
+# abandoned browser tab) is dropped by a sweep when new sessions start.
+
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+QUESTION_BANK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'questions.json')
+
+DIFFICULTY_LEVELS = {'easy': 1, 'medium': 2, 'hard': 3}
+LEVEL_NAMES = {level: name for name, level in DIFFICULTY_LEVELS.items()}
+START_LEVEL = DIFFICULTY_LEVELS['medium']
+
+SESSION_IDLE_SECONDS = 2 * 3600
+# Idle sessions are looked for at most this often
+SWEEP_SECONDS = 60
+
+LOAD_CLASSES = ('Low', 'Medium', 'High')
+
+
+def load_class(avg_prediction):
+    """Cognitive load class from the mean of 0/1 predictions (README thresholds)."""
+    if avg_prediction < 0.4:
+        return 'Low'
+    if avg_prediction > 0.6:
+        return 'High'
+    return 'Medium'
+
+
+class QuestionBank:
+    """Questions indexed by topic, then difficulty level."""
+
+    def __init__(self, questions):
+        self.by_id = {}
+        self._buckets = {}
+        for q in questions:
+            level = DIFFICULTY_LEVELS[q['difficulty']] if isinstance(q['difficulty'], str) else int(q['difficulty'])
+            topic = q.get('topic', 'general')
+            self.by_id[q['id']] = q
+            self._buckets.setdefault(topic, {}).setdefault(level, []).append(q['id'])
+        self._levels = {}
+        for topic, levels in self._buckets.items():
+            for ids in levels.values():
+                ids.sort()
+            self._levels[topic] = sorted(levels)
+
+    @classmethod
+    def from_json(cls, path=QUESTION_BANK_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def topics(self):
+        return list(self._levels)
+
+    def levels(self, topic):
+        return self._levels[topic]
+
+    def bucket(self, topic, level):
+        return self._buckets[topic][level]
+
+
+class _Session:
+    __slots__ = ('topic', 'level', 'offsets', 'asked', 'lock', 'last_used')
+
+    def __init__(self, topic, level):
+        self.topic = topic
+        self.level = level
+        self.last_used = time.monotonic()
+        self.offsets = {}  # level -> random start offset in the bucket
+        self.asked = {}    # level -> number of questions asked from the bucket
+        self.lock = threading.Lock()
+
+
+class QuestionSelector:
+    """Per-session adaptive picks over a QuestionBank. Thread-safe."""
+
+    def __init__(self, bank, seed=None, idle_seconds=SESSION_IDLE_SECONDS):
+        self.bank = bank
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._random = random.Random(seed)
+
+    def _sweep(self, now):
+        # Caller holds _sessions_lock
+        self._last_sweep = now
+        idle = [sid for sid, s in self._sessions.items() if now - s.last_used > self.idle_seconds]
+        for sid in idle:
+            del self._sessions[sid]
+        return len(idle)
+
+    def _live(self, session_id, now):
+        # An expired session counts as ended, whether or not a sweep removed it yet
+        session = self._sessions.get(session_id)
+        if session is not None and now - session.last_used > self.idle_seconds:
+            return None
+        return session
+
+    def _session(self, session_id, topic):
+        now = time.monotonic()
+        session = self._live(session_id, now)
+        if session is None:
+            with self._sessions_lock:
+                if now - self._last_sweep >= min(SWEEP_SECONDS, self.idle_seconds):
+                    self._sweep(now)
+                session = self._live(session_id, now)
+                if session is None:
+                    if topic is None:
+                        topic = self.bank.topics()[0]
+                    elif topic not in self.bank.topics():
+                        raise KeyError(f"Unknown topic '{topic}'")
+                    levels = self.bank.levels(topic)
+                    start = min(max(START_LEVEL, levels[0]), levels[-1])
+                    session = _Session(topic, start)
+                    self._sessions[session_id] = session
+        session.last_used = now
+        return session
+
+    def _remaining(self, session, level):
+        return len(self.bank.bucket(session.topic, level)) - session.asked.get(level, 0)
+
+    def _nearest_open_level(self, session, target):
+        levels = self.bank.levels(session.topic)
+        i = bisect_left(levels, target)
+        # Walk outwards from the insertion point; levels are few, buckets large
+        lo, hi = i - 1, i
+        while lo >= 0 or hi < len(levels):
+            if hi < len(levels) and (lo < 0 or levels[hi] - target <= target - levels[lo]):
+                if self._remaining(session, levels[hi]) > 0:
+                    return levels[hi]
+                hi += 1
+            else:
+                if self._remaining(session, levels[lo]) > 0:
+                    return levels[lo]
+                lo -= 1
+        return None
+
+    def next_question(self, session_id, load=None, topic=None):
+        """Next question for a session given its current load class.
+
+        load is 'Low', 'Medium', 'High' or None (keep the difficulty). Returns
+        the question dict, or None when the topic is exhausted for the session.
+        """
+        if load is not None and load not in LOAD_CLASSES:
+            raise ValueError(f"load must be one of {', '.join(LOAD_CLASSES)}")
+        session = self._session(session_id, topic)
+        with session.lock:
+            target = session.level
+            if load == 'High':
+                target -= 1
+            elif load == 'Low':
+                target += 1
+            level = self._nearest_open_level(session, target)
+            if level is None:
+                return None
+            ids = self.bank.bucket(session.topic, level)
+            offset = session.offsets.get(level)
+            if offset is None:
+                # Each session walks the bucket from its own random start
+                offset = session.offsets[level] = self._random.randrange(len(ids))
+            count = session.asked.get(level, 0)
+            session.asked[level] = count + 1
+            session.level = level
+            return self.bank.by_id[ids[(offset + count) % len(ids)]]
+
+    def session_state(self, session_id):
+        session = self._live(session_id, time.monotonic())
+        if session is None:
+            return None
+        return {
+            'topic': session.topic,
+            'difficulty': LEVEL_NAMES.get(session.level, session.level),
+            'asked': sum(session.asked.values()),
+        }
+
+    def end_session(self, session_id):
+        with self._sessions_lock:
+            return self._sessions.pop(session_id, None) is not None
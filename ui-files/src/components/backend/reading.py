@@ -0,0 +1,115 @@
+# reading.py
+#
+# One spectral reading from the headset, as passed between bci_api.py, the
+# reading ring and the predictor. Readings used to be dicts with an ISO
+# timestamp string, copied per history entry and parsed again (with
+# upper/lower case key fallbacks) by every consumer. A Reading is a slotted
+# record with an epoch-float timestamp and the lowercase field names used
+# everywhere else; its values are laid out exactly like a reading ring slot.
+# The ISO text only appears at the edges: /api/data JSON and the CSVs.
+
+from datetime import datetime
+
+import numpy as np
+
+import features
+
+# Field order of a Reading, a ring slot and a bci_model.csv row
+FIELDS = ('timestamp', 'alpha', 'beta', 'theta', 'alpha_apen', 'beta_apen', 'theta_apen', 'artifacted')
+FIELD_INDEX = {field: i for i, field in enumerate(FIELDS)}
+
+_NAN = float('nan')
+
+
+class Reading:
+    """timestamp is seconds since the epoch. An ApEn is None while it is not
+    available (artifacted readings); artifacted is a bool.
+
+    Readings are not modified once published.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, timestamp, alpha, beta, theta,
+                 alpha_apen=None, beta_apen=None, theta_apen=None, artifacted=False):
+        self.timestamp = timestamp
+        self.alpha = alpha
+        self.beta = beta
+        self.theta = theta
+        self.alpha_apen = alpha_apen
+        self.beta_apen = beta_apen
+        self.theta_apen = theta_apen
+        self.artifacted = artifacted
+
+    @classmethod
+    def from_values(cls, values):
+        """Reading from ring slot values (FIELDS order, NaN for a missing ApEn)."""
+        ts, alpha, beta, theta, alpha_apen, beta_apen, theta_apen, artifacted = values
+        return cls(ts, alpha, beta, theta,
+                   None if alpha_apen != alpha_apen else alpha_apen,
+                   None if beta_apen != beta_apen else beta_apen,
+                   None if theta_apen != theta_apen else theta_apen,
+                   bool(artifacted))
+
+    @classmethod
+    def from_dict(cls, record):
+        """Reading from a JSON/CSV record: ISO or epoch timestamp, any known
+        column casing (see features.COLUMN_ALIASES)."""
+        record = {features.canonical_column(k): v for k, v in record.items()}
+        ts = record['timestamp']
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts).timestamp()
+
+        def number(key):
+            value = record.get(key)
+            return None if value is None or value == '' else float(value)
+
+        artifacted = record.get('artifacted', False)
+        if isinstance(artifacted, str):
+            artifacted = artifacted.strip().lower() in ('true', '1', '1.0')
+        return cls(float(ts), number('alpha'), number('beta'), number('theta'),
+                   number('alpha_apen'), number('beta_apen'), number('theta_apen'), bool(artifacted))
+
+    def values(self):
+        """Ring slot values, the inverse of from_values."""
+        return (self.timestamp, self.alpha, self.beta, self.theta,
+                _NAN if self.alpha_apen is None else self.alpha_apen,
+                _NAN if self.beta_apen is None else self.beta_apen,
+                _NAN if self.theta_apen is None else self.theta_apen,
+                1.0 if self.artifacted else 0.0)
+
+    def iso_timestamp(self):
+        return datetime.fromtimestamp(self.timestamp).isoformat()
+
+    def to_dict(self):
+        """JSON form served by /api/data (ISO timestamp)."""
+        return {
+            'timestamp': self.iso_timestamp(),
+            'alpha': self.alpha,
+            'beta': self.beta,
+            'theta': self.theta,
+            'alpha_apen': self.alpha_apen,
+            'beta_apen': self.beta_apen,
+            'theta_apen': self.theta_apen,
+            'artifacted': self.artifacted,
+        }
+
+    def csv_row(self):
+        """bci_model.csv row, in FIELDS order."""
+        return [self.iso_timestamp(), self.alpha, self.beta, self.theta,
+                self.alpha_apen, self.beta_apen, self.theta_apen, self.artifacted]
+
+    def __eq__(self, other):
+        if not isinstance(other, Reading):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Reading(' + ', '.join(f'{f}={getattr(self, f)!r}' for f in FIELDS) + ')'
+
+
+def readings_array(readings):
+    """Readings as one (n, len(FIELDS)) float64 array, the ring's row format."""
+    rows = np.array([r.values() for r in readings], dtype=np.float64)
+    return rows.reshape(len(rows), len(FIELDS))
@@ -0,0 +1,230 @@
+# reading_ring.py
+#
+# Shared-memory ring of live readings, so local processes can follow the
+# stream without going through Flask/JSON on port 5000. bci_api.py is the one
+# writer; any number of readers attach by name.
+#
+# Layout (all little-endian 8-byte words):
+#   header: magic, layout version, capacity, field count, last published seq,
+#           writer pid
+#   slots:  capacity rows of [seq, *FIELDS] as float64
+#
+# Every slot carries the sequence number of the reading in it. The writer
+# marks a slot as being written (seq -1), fills it and then stores its seq,
+# and only then advances the header. A reader copies the slots it wants and
+# keeps only the rows whose seq is the expected one both before and after the
+# copy, so a reader that falls more than a ring behind sees gaps (counted as
+# lost), never a half-written reading. Readers never block the writer.
+#
+# A ring whose writer pid is alive is in use: a second writer (another
+# bci_api or asgi_server started by mistake) refuses to start instead of
+# replacing it under the first one's readers.
+
+import os
+import struct
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from reading import FIELDS, Reading
+from recorder_pipeline import pid_alive
+
+RING_NAME = 'bci_readings'
+RING_CAPACITY = 4096
+
+# Slots hold reading.FIELDS in order (see Reading.values): timestamp is
+# seconds since the epoch, a missing ApEn is NaN and artifacted is 0.0/1.0.
+
+_MAGIC = 0x42434952  # 'BCIR'
+_LAYOUT = 2
+_HEADER = struct.Struct('<qqqqqq')
+_HEADER_WORDS = 8  # header padded to 64 bytes
+_WRITING = -1.0
+
+
+class RingError(RuntimeError):
+    pass
+
+
+if sys.version_info < (3, 13):
+    # Before 3.13 every attach registers the segment with the resource tracker,
+    # which unlinks it when the attaching process exits; only the writer owns
+    # it. Registration is skipped for attaches made by this module, flagged per
+    # thread, so shared memory created by other threads meanwhile is still
+    # tracked. (Unregistering after the attach instead would also drop the
+    # writer's registration in a reader forked from it, which shares its tracker.)
+    _attaching = threading.local()
+    _register = resource_tracker.register
+
+    def _register_unless_attaching(name, rtype):
+        if not getattr(_attaching, 'active', False):
+            _register(name, rtype)
+
+    resource_tracker.register = _register_unless_attaching
+
+
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    _attaching.active = True
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        _attaching.active = False
+
+
+def ring_owner(name=RING_NAME):
+    """pid of the live writer of ring name, or None if there is no ring or
+    its writer is gone."""
+    try:
+        shm = _attach(name)
+    except FileNotFoundError:
+        return None
+    try:
+        if shm.size < _HEADER.size:
+            return None
+        magic, layout, _, _, _, pid = _HEADER.unpack_from(shm.buf, 0)
+    finally:
+        shm.close()
+    if magic != _MAGIC or layout != _LAYOUT or not pid or not pid_alive(pid):
+        return None
+    return pid
+
+
+def _views(buf, capacity, n_fields):
+    words = np.ndarray((_HEADER_WORDS,), dtype=np.int64, buffer=buf)
+    slots = np.ndarray((capacity, n_fields + 1), dtype=np.float64, buffer=buf,
+                       offset=_HEADER_WORDS * 8)
+    return words, slots
+
+
+class RingWriter:
+    """Creates the shared ring and publishes readings into it."""
+
+    def __init__(self, name=RING_NAME, capacity=RING_CAPACITY):
+        self.name = name
+        self.capacity = capacity
+        self.fields = FIELDS
+        size = _HEADER_WORDS * 8 + capacity * (len(self.fields) + 1) * 8
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            owner = ring_owner(name)
+            if owner is not None:
+                raise RingError(f"Reading ring '{name}' is in use by process {owner} "
+                                f"(is another bci_api running?)") from None
+            # Left behind by a writer that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._words, self._slots = _views(self._shm.buf, capacity, len(self.fields))
+        self._slots.fill(_WRITING)
+        self._seq = 0
+        _HEADER.pack_into(self._shm.buf, 0, _MAGIC, _LAYOUT, capacity, len(self.fields), 0, os.getpid())
+
+    @property
+    def seq(self):
+        """Sequence number of the last published reading (0 = none yet)."""
+        return self._seq
+
+    def publish(self, values):
+        """Append one reading, given as a sequence of floats in field order."""
+        seq = self._seq + 1
+        slot = self._slots[seq % self.capacity]
+        slot[0] = _WRITING
+        slot[1:] = values
+        slot[0] = seq
+        self._words[4] = seq
+        self._seq = seq
+        return seq
+
+    def publish_reading(self, reading):
+        """Append a Reading."""
+        return self.publish(reading.values())
+
+    def close(self, unlink=True):
+        if self._shm is None:
+            return
+        del self._words, self._slots
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+        self._shm = None
+
+
+class RingReader:
+    """Follows a ring created by RingWriter.
+
+    read() returns the readings published since the previous call as one
+    (n, len(fields)) float64 array; there is no per-reading parsing.
+    """
+
+    def __init__(self, name=RING_NAME, start='now'):
+        try:
+            self._shm = _attach(name)
+        except FileNotFoundError:
+            raise RingError(f"No reading ring '{name}' (is bci_api.py running?)") from None
+        magic, layout, capacity, n_fields, _, _ = _HEADER.unpack_from(self._shm.buf, 0)
+        if magic != _MAGIC or layout != _LAYOUT or n_fields != len(FIELDS):
+            self._shm.close()
+            raise RingError(f"'{name}' is not a reading ring of layout {_LAYOUT}")
+        self.name = name
+        self.capacity = capacity
+        self.fields = FIELDS
+        self._words, self._slots = _views(self._shm.buf, capacity, n_fields)
+        self.last_seq = self.head() if start == 'now' else 0
+        self.lost = 0
+
+    def head(self):
+        """Sequence number of the newest published reading."""
+        return int(self._words[4])
+
+    def _copy(self, first, last):
+        seqs = np.arange(first, last + 1)
+        idx = seqs % self.capacity
+        rows = self._slots[idx]  # fancy indexing copies
+        after = self._slots[idx, 0]
+        ok = (rows[:, 0] == seqs) & (after == seqs)
+        return seqs[ok], rows[ok, 1:]
+
+    def read(self, max_rows=None):
+        """Readings published since the last read, oldest first.
+
+        Readings overwritten before they could be read are skipped and added
+        to self.lost.
+        """
+        head = self.head()
+        first = self.last_seq + 1
+        if head < first:
+            return np.empty((0, len(self.fields)))
+        # Older than one ring (minus one slot the writer may be filling) is gone
+        oldest = max(first, head - self.capacity + 2)
+        if max_rows:
+            oldest = max(oldest, head - max_rows + 1)
+        seqs, rows = self._copy(oldest, head)
+        self.lost += (oldest - first) + (head - oldest + 1 - len(seqs))
+        self.last_seq = head
+        return rows
+
+    def latest(self, n):
+        """The newest n readings, regardless of what was read before."""
+        head = self.head()
+        if head == 0:
+            return np.empty((0, len(self.fields)))
+        _, rows = self._copy(max(1, head - min(n, self.capacity - 1) + 1), head)
+        return rows
+
+    def records(self, rows):
+        """Rows as Readings, for code that expects those."""
+        return [Reading.from_values(row) for row in rows.tolist()]
+
+    def close(self):
+        if self._shm is None:
+            return
+        del self._words, self._slots
+        self._shm.close()
+        self._shm = None
+
@@ -1,109 +1,395 @@
-from flask import Flask, jsonify
-import joblib
-import numpy as np
-import pandas as pd
+from flask import Flask, jsonify, request
 import requests
+import atexit
 import threading
 import time
-import csv
 from datetime import datetime
 import os
+from collections import deque
+import numpy as np
+
+import features
+import model_bundle
+import online_model
+from question_selector import QuestionBank, QuestionSelector, load_class
+from reading import FIELD_INDEX, Reading, readings_array
+from reading_ring import RingError, RingReader
+import session_store
 
 app = Flask(__name__)
 
-# Load the trained SVM model
-model = joblib.load("trained_model.pkl")
+# The model bundle is loaded by the prediction thread on first use rather than
+# at import, so the API answers requests before sklearn has been imported.
+BUNDLE_PATH = model_bundle.BUNDLE_PATH
+LEGACY_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'trained_model.pkl')
+bundle = None
+
+# Fields every bci_api reading carries; a bundle whose features need anything
+# else is rejected at load time
+LIVE_READING_COLUMNS = ('alpha', 'beta', 'theta', 'alpha_apen', 'beta_apen', 'theta_apen')
 
 # === Load Baseline Values from bci_calm.csv (first minute) ===
+# Only needed for a bare trained_model.pkl from before model bundles existed
 BCI_CSV_PATH = os.path.join(os.path.dirname(__file__), 'bci_calm.csv')
-baseline_alpha = None
 
-def load_baseline():
-    global baseline_alpha
+def load_baseline(bands):
+    import pandas as pd
     df = pd.read_csv(BCI_CSV_PATH)
+    df.rename(columns=features.canonical_column, inplace=True)
     df['timestamp'] = pd.to_datetime(df['timestamp'])
-    start_time = df['timestamp'].min()
-    baseline_end = start_time + pd.Timedelta(seconds=60)
-    baseline_df = df[df['timestamp'] <= baseline_end]
-    baseline_alpha = baseline_df['alpha'].mean()
-    print(baseline_alpha)
+    seconds = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds().to_numpy()
+    return features.compute_baseline(seconds, {band: df[band].to_numpy() for band in bands}, bands)
+
+def load_legacy_bundle():
+    import joblib
+    names = list(features.MODEL_FEATURES)
+    legacy = {
+        'format': model_bundle.BUNDLE_FORMAT,
+        'version': 'legacy',
+        'model': joblib.load(LEGACY_MODEL_PATH),
+        'features': names,
+        'baseline': load_baseline(features.baseline_bands(names)),
+        'segment_length': features.SEGMENT_SECONDS,
+        'impute_values': None,
+    }
+    model_bundle.validate_bundle(legacy, LIVE_READING_COLUMNS)
+    return legacy
+
+def read_bundle():
+    if os.path.exists(BUNDLE_PATH):
+        return model_bundle.load_bundle(BUNDLE_PATH, LIVE_READING_COLUMNS)
+    print(f"{BUNDLE_PATH} not found, falling back to {LEGACY_MODEL_PATH}")
+    return load_legacy_bundle()
+
+def warm_bundle(candidate):
+    # One throwaway prediction so the first real epoch does not pay for lazy setup
+    n = len(candidate['features'])
+    warm = candidate.get('impute_values') or [0.0] * n
+    candidate['model'].predict(np.asarray(warm, dtype=np.float64).reshape(1, n))
+
+# === Hot Reload ===
+# A watcher thread polls the bundle file and loads/warms a new version off the
+# prediction thread; the global reference is then swapped in one assignment,
+# and the prediction loop picks it up at its next epoch.
+RELOAD_POLL_SECONDS = 2
+reload_lock = threading.Lock()
+bundle_stamp = None
+reload_status = {
+    'reloads': 0,
+    'last_reload_at': None,
+    'last_reload_seconds': None,
+    'last_error': None,
+}
 
-load_baseline()
+def bundle_file_stamp():
+    try:
+        st = os.stat(BUNDLE_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def load_model():
+    """Load, validate and warm the current bundle, then swap it in.
+
+    On failure the previous bundle stays active and the error is recorded.
+    Returns True if a new bundle was activated.
+    """
+    global bundle, bundle_stamp
+    with reload_lock:
+        stamp = bundle_file_stamp()
+        start = time.perf_counter()
+        try:
+            candidate = read_bundle()
+            warm_bundle(candidate)
+        except Exception as e:
+            bundle_stamp = stamp
+            reload_status['last_error'] = f"{type(e).__name__}: {e}"
+            print(f"Model reload failed, keeping version {bundle and bundle['version']}: {e}")
+            return False
+        with prediction_csv_lock:
+            ensure_prediction_csv(candidate['features'])
+            bundle = candidate
+        bundle_stamp = stamp
+        elapsed = time.perf_counter() - start
+        reload_status['reloads'] += 1
+        reload_status['last_reload_at'] = datetime.now().isoformat()
+        reload_status['last_reload_seconds'] = elapsed
+        reload_status['last_error'] = None
+        print(f"Loaded model version {bundle['version']} in {elapsed:.3f}s:", model_bundle.describe(bundle))
+        return True
+
+def model_watch_loop():
+    while True:
+        time.sleep(RELOAD_POLL_SECONDS)
+        stamp = bundle_file_stamp()
+        if stamp is not None and stamp != bundle_stamp:
+            load_model()
 
 # === CSV for Storing Predictions ===
-PREDICTION_CSV = os.path.join(os.path.dirname(__file__), 'realtime_predictions.csv')
-if not os.path.exists(PREDICTION_CSV):
-    with open(PREDICTION_CSV, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(['timestamp', 'CI_Alpha', 'alpha_apen', 'beta_apen', 'theta_apen', 'prediction', 'label'])
+# Predictions are logged per session (session_store.py), a new session for
+# each model with other features. realtime_predictions.csv, the single file
+# they were appended to before, is left alone; session_store.py --adopt-legacy
+# moves it into the store.
+PREDICTION_STREAM = 'realtime_predictions'
+prediction_csv_lock = threading.Lock()
+prediction_log = None
+
+# Last few 0/1 predictions, averaged into a load class for question selection
+RECENT_PREDICTIONS = 10
+recent_predictions = deque(maxlen=RECENT_PREDICTIONS)
+
+def ensure_prediction_csv(feature_names):
+    global prediction_log
+    header = ['timestamp'] + list(feature_names) + ['artifact_ratio', 'prediction', 'label', 'model_version']
+    if prediction_log is not None:
+        if prediction_log.header == header:
+            return
+        # Written for a model with other features: close that session
+        prediction_log.close()
+    else:
+        session_store.start_maintenance()
+    prediction_log = session_store.SessionLog(PREDICTION_STREAM, header)
+
+@atexit.register
+def close_prediction_log():
+    global prediction_log
+    with prediction_csv_lock:
+        if prediction_log is not None:
+            prediction_log.close()
+            prediction_log = None
+
+def epoch_features(rows, current):
+    """Feature values and artifact ratio for one epoch of reading rows.
+
+    Features are averaged over the clean readings only, all input columns in
+    one reduction. When more than MAX_ARTIFACT_RATIO of the epoch is
+    artifacted no features are computed: values are None.
+    """
+    names = current['features']
+    clean = rows[:, ARTIFACTED] == 0
+    n_clean = int(np.count_nonzero(clean))
+    artifact_ratio = 1 - n_clean / len(rows)
+    if not n_clean or artifact_ratio > features.MAX_ARTIFACT_RATIO:
+        return None, artifact_ratio
+    index = {col: FIELD_INDEX[col] for col in features.required_columns(names)}
+    means = features.block_means(rows, index, clean)
+    return features.compute_features(means, current['baseline'], names)[0], artifact_ratio
+
+# === Online Adaptation ===
+# Off by default. POST /admin/online-model switches a mode from online_model.py
+# on for a test: each epoch is then predicted by the online model, which
+# learns from it afterwards, instead of by the bundle's SVM. The online model
+# belongs to one bundle version; after a reload it is rebuilt for the new one.
+# Its state is checkpointed every ONLINE_CHECKPOINT_EVERY epochs and when the
+# mode is switched off, and picked up again when it is switched back on.
+ONLINE_CHECKPOINT_EVERY = 20  # epochs, 1 min at 3 s epochs
+ONLINE_CHECKPOINT = online_model.CHECKPOINT_PATH
+online_lock = threading.Lock()
+online_mode = None
+online = None
+
+def make_online(current, mode, restore=True):
+    if restore and os.path.exists(ONLINE_CHECKPOINT):
+        try:
+            restored = online_model.load_checkpoint(current, mode, ONLINE_CHECKPOINT)
+            print(f"Restored online model ({restored.updates} updates) from {ONLINE_CHECKPOINT}")
+            return restored
+        except Exception as e:
+            print(f"Not restoring online model checkpoint: {e}")
+    return online_model.OnlineModel(current, mode)
+
+def checkpoint_online():
+    # Caller holds online_lock
+    if online is not None and online.updates:
+        try:
+            online_model.save_checkpoint(online, ONLINE_CHECKPOINT)
+        except OSError as e:
+            print(f"Online model checkpoint failed: {e}")
+
+def online_predict(current, X):
+    """Prediction of the online model for this epoch, or None when it is off."""
+    global online
+    with online_lock:
+        if online_mode is None:
+            return None
+        if online is None or online.bundle_version != current['version']:
+            checkpoint_online()
+            online = make_online(current, online_mode)
+        pred = online.update(X)
+        if online.updates % ONLINE_CHECKPOINT_EVERY == 0:
+            checkpoint_online()
+        return pred
+
+@atexit.register
+def save_online_checkpoint():
+    with online_lock:
+        checkpoint_online()
+
+def model_version(current):
+    # Online predictions are marked in the CSV as <bundle version>+<mode>
+    adapted = online
+    if adapted is not None and online_mode is not None and adapted.bundle_version == current['version']:
+        return f"{current['version']}+{adapted.mode}"
+    return current['version']
+
+def online_model_result(body):
+    """Switch online adaptation; shared with asgi_server.py, returns (payload, status).
+
+    JSON body: mode ('relabel', 'linear' or 'off'), optionally reset to start
+    from the bundle instead of the last checkpoint.
+    """
+    global online_mode, online
+    mode = body.get('mode')
+    with online_lock:
+        if mode in (None, 'off'):
+            checkpoint_online()
+            online_mode = online = None
+            return {'online': None}, 200
+        if mode not in online_model.MODES:
+            return {'error': f"mode must be one of off, {', '.join(online_model.MODES)}"}, 400
+        current = bundle
+        if current is not None:
+            try:
+                if online is not None and online.mode == mode and online.bundle_version == current['version'] \
+                        and not body.get('reset'):
+                    candidate = online
+                else:
+                    checkpoint_online()
+                    candidate = make_online(current, mode, restore=not body.get('reset'))
+            except online_model.OnlineModelError as e:
+                return {'error': str(e)}, 400
+            online = candidate
+        online_mode = mode
+        return {'online': online.describe() if online else {'mode': mode, 'updates': 0}}, 200
+
+def online_status():
+    adapted = online
+    return adapted.describe() if adapted is not None and online_mode is not None else None
+
+def predict_epoch(rows, current):
+    """Feature values, prediction, label and artifact ratio for one epoch.
+
+    An epoch with too many artifacted readings gets no prediction: values and
+    prediction are None, label 'Artifact'. With online adaptation on, the
+    online model predicts (and then learns from the epoch).
+    """
+    values, artifact_ratio = epoch_features(rows, current)
+    if values is None:
+        return None, None, "Artifact", artifact_ratio
+    X = values.copy()
+    if current.get('impute_values') is not None:
+        # Same mean imputation as at training time
+        missing = ~np.isfinite(X)
+        X[missing] = np.asarray(current['impute_values'])[missing]
+    pred = online_predict(current, X)
+    if pred is None:
+        pred = current['model'].predict(X.reshape(1, -1))[0]
+    label = "High Load" if pred == 1 else "Low Load"
+    return values, int(pred), label, artifact_ratio
+
+# === Reading Source ===
+# bci_api publishes every reading into a shared-memory ring; when it runs on
+# this machine the predictor reads from there instead of polling /api/data.
+# Same window either way: the last API_HISTORY readings, as rows of a float64
+# array in the ring's layout (reading.FIELDS), oldest first.
+API_HISTORY = 10
+TIMESTAMP = FIELD_INDEX['timestamp']
+ARTIFACTED = FIELD_INDEX['artifacted']
+ring_reader = None
+
+def fetch_readings():
+    global ring_reader
+    if ring_reader is None:
+        try:
+            ring_reader = RingReader()
+        except RingError:
+            pass
+    if ring_reader is not None:
+        return ring_reader.latest(API_HISTORY)
+    resp = requests.get('http://localhost:5000/api/data', timeout=2)
+    if resp.status_code != 200:
+        return readings_array([])
+    return readings_array([Reading.from_dict(entry) for entry in resp.json()])
+
+def drop_ring_reader():
+    # Re-attach on the next fetch, in case bci_api restarted with a new ring
+    global ring_reader
+    if ring_reader is not None:
+        ring_reader.close()
+        ring_reader = None
 
 # === Background Thread for Real-Time Prediction ===
+def epoch_readings(rows, epoch_seconds, now=None):
+    """The rows that fall in the last epoch (now: epoch seconds).
+
+    Rows are in time order, so the cut is one binary search.
+    """
+    start = (now or time.time()) - epoch_seconds
+    return rows[np.searchsorted(rows[:, TIMESTAMP], start, side='left'):]
+
+def record_epoch(readings, current):
+    """Predict one epoch and append it to the prediction CSV.
+
+    Returns False if the bundle was swapped meanwhile and nothing was written.
+    """
+    # Features for the epoch, exactly the ones the model was trained on
+    values, pred, label, artifact_ratio = predict_epoch(readings, current)
+    # Use the latest timestamp in the 3s window
+    latest_ts = datetime.fromtimestamp(readings[-1, TIMESTAMP]).isoformat()
+    # Store in CSV
+    with prediction_csv_lock:
+        if current is not bundle:
+            # Swapped mid-epoch; the file may now have another model's header
+            return False
+        if values is None:
+            # Artifacted epoch: logged with its ratio, no features or prediction
+            values = [''] * len(current['features'])
+            pred = ''
+        else:
+            values = values.tolist()
+            recent_predictions.append(pred)
+        prediction_log.append([latest_ts] + values + [artifact_ratio, pred, label, model_version(current)])
+    return True
+
 def realtime_predict_loop():
+    if not load_model():
+        print("Cannot start predictor: no usable model")
+        return
+    threading.Thread(target=model_watch_loop, daemon=True).start()
     while True:
+        # One bundle per epoch, even if a reload swaps it meanwhile
+        current = bundle
+        epoch_seconds = current['segment_length']
         try:
             # Fetch last 10 readings from bci_api (should be ~1s apart, so covers ~10s)
-            resp = requests.get('http://localhost:5000/api/data', timeout=2)
-            if resp.status_code != 200:
-                time.sleep(3)
-                continue
-            data = resp.json()
-            if not data or len(data) == 0:
-                time.sleep(3)
+            data = fetch_readings()
+            if len(data) == 0:
+                drop_ring_reader()
+                time.sleep(epoch_seconds)
                 continue
-            # Only keep readings from the last 3 seconds
-            now = datetime.now()
-            readings = []
-            for entry in data:
-                try:
-                    ts = pd.to_datetime(entry.get('TIMESTAMP') or entry.get('timestamp'))
-                    if (now - ts).total_seconds() <= 3:
-                        readings.append(entry)
-                except Exception:
-                    continue
+            # Only keep readings from the last epoch (3 seconds by default)
+            readings = epoch_readings(data, epoch_seconds)
             if len(readings) == 0:
-                time.sleep(3)
+                drop_ring_reader()
+                time.sleep(epoch_seconds)
+                continue
+            if not record_epoch(readings, current):
+                # Swapped mid-epoch: recompute it with the new bundle right away
                 continue
-            # Compute averages for the 3s epoch
-            alpha_vals = [float(r.get('ALPHA', r.get('alpha', 0))) for r in readings]
-            alpha_apen_vals = [float(r.get('ALPHA_APEN', r.get('alpha_apen', 0))) for r in readings]
-            beta_apen_vals = [float(r.get('BETA_APEN', r.get('beta_apen', 0))) for r in readings]
-            theta_apen_vals = [float(r.get('THETA_APEN', r.get('theta_apen', 0))) for r in readings]
-            avg_alpha = np.mean(alpha_vals)
-            avg_alpha_apen = np.mean(alpha_apen_vals)
-            avg_beta_apen = np.mean(beta_apen_vals)
-            avg_theta_apen = np.mean(theta_apen_vals)
-            # Calculate CI_Alpha
-            ci_alpha = ((baseline_alpha - avg_alpha) / baseline_alpha) * 100 if baseline_alpha else 0
-            print("avg",avg_alpha)
-            # Prepare input for model
-            X = np.array([[ci_alpha]])
-            pred = model.predict(X)[0]
-            label = "High Load" if pred == 1 else "Low Load"
-            # Use the latest timestamp in the 3s window
-            latest_ts = max([r.get('TIMESTAMP', r.get('timestamp')) for r in readings])
-            # Store in CSV
-            with open(PREDICTION_CSV, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([latest_ts, ci_alpha, avg_alpha_apen, avg_beta_apen, avg_theta_apen, int(pred), label])
         except Exception as e:
             print(f"Error in realtime prediction loop: {e}")
-        time.sleep(3)
+        time.sleep(epoch_seconds)
 
-# Start background thread
-t = threading.Thread(target=realtime_predict_loop, daemon=True)
-t.start()
+def start_predictor():
+    t = threading.Thread(target=realtime_predict_loop, daemon=True)
+    t.start()
+    return t
 
 # Optionally, endpoint to get latest prediction
 def get_latest_prediction():
-    if not os.path.exists(PREDICTION_CSV):
-        return None
-    with open(PREDICTION_CSV, 'r') as f:
-        rows = list(csv.reader(f))
-        if len(rows) < 2:
-            return None
-        header = rows[0]
-        last = rows[-1]
-        return dict(zip(header, last))
+    # The log keeps its last row, so this does not read the file
+    log = prediction_log
+    return log.last_record() if log is not None else None
 
 @app.route('/latest_prediction', methods=['GET'])
 def latest_prediction():
@@ -113,5 +399,73 @@ def latest_prediction():
     else:
         return jsonify({'error': 'No prediction yet'}), 404
 
+@app.route('/model', methods=['GET'])
+def model_status():
+    if bundle is None:
+        return jsonify({'error': 'No model loaded yet', **reload_status}), 404
+    return jsonify({'model': model_bundle.describe(bundle), 'online': online_status(), **reload_status})
+
+@app.route('/admin/reload-model', methods=['POST'])
+def reload_model():
+    # Loads and warms on this request thread; the prediction loop keeps running
+    # on the old bundle until the swap
+    if load_model():
+        return jsonify({'status': 'reloaded', 'model': model_bundle.describe(bundle), **reload_status})
+    return jsonify({'status': 'failed', **reload_status}), 500
+
+@app.route('/admin/online-model', methods=['POST'])
+def set_online_model():
+    payload, status = online_model_result(request.get_json(silent=True) or {})
+    return jsonify(payload), status
+
+# === Adaptive Question Selection ===
+selector = None
+selector_lock = threading.Lock()
+
+def get_selector():
+    global selector
+    with selector_lock:
+        if selector is None:
+            selector = QuestionSelector(QuestionBank.from_json())
+        return selector
+
+def current_load_class():
+    preds = list(recent_predictions)
+    if not preds:
+        return None
+    return load_class(sum(preds) / len(preds))
+
+@app.route('/next_question', methods=['POST'])
+def next_question():
+    """Next question for a test session.
+
+    JSON body: session_id (required), topic (optional, fixed on the first call)
+    and load ('Low'/'Medium'/'High'); without load the class is derived from
+    the last few predictions.
+    """
+    payload, status = next_question_result(request.get_json(silent=True) or {})
+    return jsonify(payload), status
+
+def next_question_result(body):
+    # Shared with the async server (asgi_server.py); returns (payload, status)
+    session_id = body.get('session_id')
+    if not session_id:
+        return {'error': 'session_id is required'}, 400
+    load = body.get('load') or current_load_class()
+    try:
+        question = get_selector().next_question(session_id, load=load, topic=body.get('topic'))
+    except (KeyError, ValueError) as e:
+        return {'error': e.args[0]}, 400
+    if question is None:
+        return {'error': 'No questions left for this session'}, 404
+    return {'question': question, 'load': load, 'session': get_selector().session_state(session_id)}, 200
+
+@app.route('/end_session', methods=['POST'])
+def end_session():
+    body = request.get_json(silent=True) or {}
+    ended = get_selector().end_session(body.get('session_id'))
+    return jsonify({'ended': ended})
+
 if __name__ == '__main__':
-    app.run(port=6000,debug=True)
\ No newline at end of file
+    start_predictor()
+    app.run(port=6000, debug=True, use_reloader=False)
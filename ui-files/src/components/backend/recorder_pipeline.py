@@ -0,0 +1,355 @@
+# recorder_pipeline.py
+#
+# Producer/consumer pipeline for the recorder scripts (emo.py / emo3.py).
+# The SDK callback only timestamps and enqueues the raw packet; a worker
+# thread runs EmotionalMath, ApEn and the CSV output. Counters make it
+# possible to show that nothing was dropped at the full sampling rate.
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class RateLimitedLog:
+    """print() that emits each key at most once per interval.
+
+    The message is only formatted (fmt.format(*args)) when it is printed.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._last = {}
+        self._suppressed = {}
+
+    def __call__(self, key, fmt, *args):
+        now = time.monotonic()
+        if now - self._last.get(key, float('-inf')) < self.interval:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return
+        suppressed = self._suppressed.pop(key, 0)
+        self._last[key] = now
+        message = fmt.format(*args)
+        if suppressed:
+            message = f"{message} (+{suppressed} suppressed)"
+        print(message)
+
+
+class RecorderPipeline:
+    """Decouples the SDK signal callback from packet processing.
+
+    process_packet(data, received_at) runs on the worker thread for every
+    packet, in arrival order; received_at is the wall-clock time (time.time())
+    the packet reached submit(), so rows can be stamped with when they were
+    acquired rather than when the worker got to them. A packet counts as late
+    when it waited in the queue longer than late_after seconds, and as dropped
+    when the queue was full.
+    """
+
+    def __init__(self, process_packet, sampling_rate=250, max_queue=2000, late_after=0.5):
+        self.process_packet = process_packet
+        self.sampling_rate = sampling_rate
+        self.late_after = late_after
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._last_pack_num = None
+
+        self.packets_received = 0
+        self.samples_received = 0
+        self.packets_processed = 0
+        self.packets_dropped = 0
+        self.samples_dropped = 0
+        self.packets_late = 0
+        self.pack_gaps = 0
+        self.processing_errors = 0
+        self.max_queue_delay = 0.0
+
+    def start(self):
+        self._started_at = time.monotonic()
+        self._worker = threading.Thread(target=self._run, name='recorder-worker', daemon=True)
+        self._worker.start()
+
+    def submit(self, data):
+        # Called on the SDK callback thread: keep this to bookkeeping and a put
+        now = time.monotonic()
+        received_at = time.time()
+        with self._lock:
+            self.packets_received += 1
+            self.samples_received += len(data)
+            self._check_pack_numbers(data)
+        try:
+            self._queue.put_nowait((now, received_at, data))
+        except queue.Full:
+            with self._lock:
+                self.packets_dropped += 1
+                self.samples_dropped += len(data)
+
+    def _check_pack_numbers(self, data):
+        # PackNum increases along the stream; a jump means the SDK lost packets
+        for sample in data:
+            pack_num = getattr(sample, 'PackNum', None)
+            if pack_num is None:
+                return
+            last = self._last_pack_num
+            if last is not None and pack_num > last + 1:
+                self.pack_gaps += pack_num - last - 1
+            self._last_pack_num = pack_num
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            queued_at, received_at, data = item
+            delay = time.monotonic() - queued_at
+            if delay > self.max_queue_delay:
+                self.max_queue_delay = delay
+            if delay > self.late_after:
+                self.packets_late += 1
+            try:
+                self.process_packet(data, received_at)
+            except Exception as err:
+                self.processing_errors += 1
+                print("Error processing packet:", err)
+            self.packets_processed += 1
+
+    def stop(self, timeout=30):
+        """Let the worker drain everything already queued, then stop it."""
+        if self._worker is None:
+            return
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+        self._worker = None
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        with self._lock:
+            stats = {
+                'elapsed_sec': elapsed,
+                'packets_received': self.packets_received,
+                'samples_received': self.samples_received,
+                'packets_processed': self.packets_processed,
+                'packets_dropped': self.packets_dropped,
+                'samples_dropped': self.samples_dropped,
+                'packets_late': self.packets_late,
+                'pack_gaps': self.pack_gaps,
+                'processing_errors': self.processing_errors,
+                'max_queue_delay_sec': self.max_queue_delay,
+                'queue_size': self._queue.qsize(),
+            }
+        stats['samples_per_sec'] = stats['samples_received'] / elapsed if elapsed else 0.0
+        stats['expected_samples'] = int(elapsed * self.sampling_rate)
+        return stats
+
+    def print_report(self):
+        s = self.stats()
+        print("=== Recorder pipeline ===")
+        print(f"Samples: {s['samples_received']} received in {s['elapsed_sec']:.1f}s "
+              f"({s['samples_per_sec']:.1f}/s, ~{s['expected_samples']} expected at {self.sampling_rate} Hz)")
+        print(f"Packets: {s['packets_received']} received, {s['packets_processed']} processed, "
+              f"{s['packets_dropped']} dropped, {s['packets_late']} late (> {self.late_after}s queued)")
+        print(f"SDK pack gaps: {s['pack_gaps']}, processing errors: {s['processing_errors']}, "
+              f"max queue delay: {s['max_queue_delay_sec'] * 1000:.1f} ms")
+
+
+class RecorderProgress:
+    """Progress of a recording, shared with the process that started it.
+
+    The fields live in multiprocessing shared memory, so a recorder running in
+    a worker process can be followed (and stopped through stop) by its
+    supervisor. Pass it to the worker when the worker is created.
+    """
+
+    PHASES = ('idle', 'scanning', 'resistance', 'recording', 'stopping', 'done', 'failed')
+
+    def __init__(self, ctx=multiprocessing):
+        self._phase = ctx.Value('i', 0)
+        self._phase_since = ctx.Value('d', 0.0)
+        self._rows = ctx.Value('q', 0)
+        self._started_at = ctx.Value('d', 0.0)
+        self._duration = ctx.Value('d', 0.0)
+        self.stop = ctx.Event()
+
+    def begin(self, duration):
+        # stop is left alone: whoever starts the recording clears it, so a
+        # stop requested before the worker got here is not lost
+        with self._rows.get_lock():
+            self._rows.value = 0
+        self._started_at.value = time.time()
+        self._duration.value = duration
+        self.set_phase('scanning')
+
+    def set_phase(self, phase):
+        self._phase.value = self.PHASES.index(phase)
+        self._phase_since.value = time.time()
+
+    def add_rows(self, n=1):
+        with self._rows.get_lock():
+            self._rows.value += n
+
+    @property
+    def phase(self):
+        return self.PHASES[self._phase.value]
+
+    def snapshot(self):
+        phase = self.phase
+        started_at = self._started_at.value or None
+        duration = self._duration.value
+        snapshot = {
+            'phase': phase,
+            'rows_written': self._rows.value,
+            'started_at': started_at,
+            'duration_seconds': duration,
+            'recording_seconds': None,
+            'progress': None,
+        }
+        if phase == 'recording':
+            # Recording time runs from StartSignal, as the duration does
+            recorded = time.time() - self._phase_since.value
+            snapshot['recording_seconds'] = recorded
+            snapshot['progress'] = min(1.0, recorded / duration) if duration else None
+        elif phase == 'done':
+            snapshot['progress'] = 1.0
+        return snapshot
+
+
+# === Output Lock ===
+# One recorder per output file. The recorder holds an OS advisory lock
+# (flock, or msvcrt.locking on Windows) on a lock file next to the CSV, and
+# writes its pid into it. The OS drops the lock when the process dies, so a
+# held lock always means a live recorder, and its pid is the one to stop; a
+# lock file left behind by a crash is just a file, whatever process its pid
+# now belongs to.
+class RecorderBusy(RuntimeError):
+    pass
+
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _try_lock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _try_lock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+# Lock file path -> descriptor, for the locks this process holds
+_held_locks = {}
+
+
+def output_lock_path(output_path):
+    return output_path + '.lock'
+
+
+def pid_alive(pid):
+    if os.name == 'nt':
+        import ctypes
+        # os.kill(pid, 0) would terminate the process on Windows
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def output_lock_owner(output_path):
+    """pid written to output_path's lock file, or None if there is none.
+
+    Only meaningful while output_lock_held(output_path): a lock file that is
+    not held may name a process that has nothing to do with recording.
+    """
+    try:
+        with open(output_lock_path(output_path)) as f:
+            return int(f.read().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+
+def output_lock_held(output_path):
+    """True if some process, this one included, holds output_path's lock."""
+    path = output_lock_path(output_path)
+    if path in _held_locks:
+        return True
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return False
+    try:
+        if _try_lock(fd):
+            _unlock(fd)
+            return False
+        return True
+    finally:
+        os.close(fd)
+
+
+def acquire_output_lock(output_path):
+    path = output_lock_path(output_path)
+    if path in _held_locks:
+        raise RecorderBusy(f"{output_path} is already being recorded by this process")
+    while True:
+        fd = os.open(path, os.O_CREAT | os.O_RDWR)
+        if not _try_lock(fd):
+            os.close(fd)
+            pid = output_lock_owner(output_path)
+            raise RecorderBusy(f"{output_path} is being recorded by "
+                               + (f"process {pid}" if pid else "another process"))
+        # The previous holder removes the file before unlocking it; if that
+        # happened between our open and lock, we locked a file that is gone
+        try:
+            current = os.path.samestat(os.fstat(fd), os.stat(path))
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        os.close(fd)
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _held_locks[path] = fd
+
+
+def release_output_lock(output_path):
+    path = output_lock_path(output_path)
+    fd = _held_locks.pop(path, None)
+    if fd is None:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        # Windows does not remove open files; the next holder reuses it
+        pass
+    _unlock(fd)
+    os.close(fd)
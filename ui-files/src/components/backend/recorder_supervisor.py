@@ -0,0 +1,250 @@
+# recorder_supervisor.py
+#
+# Runs headset recordings (emo3.record_session) for server.py and the async
+# server. /start_eeg used to Popen a fresh `python emo3.py` on every call:
+# each call paid for the SDK imports, nothing stopped a second recorder from
+# opening the same headset and CSV, and the only way to end a recording was
+# to wait out its 5 minutes.
+#
+# Each device gets one warm worker process that has imported emo3 (and the
+# SDK) before the first request and is reused across recordings. At most one
+# recording runs per device; its phase and row count are shared with the
+# supervisor through a RecorderProgress, and the same object carries the stop
+# request. Recorders left running by a previous server (found through their
+# output lock files) are terminated when the supervisor starts.
+
+import glob
+import importlib
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from recorder_pipeline import RecorderBusy, RecorderProgress, output_lock_held, output_lock_owner, pid_alive
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = 'bci_calm.csv'
+STOP_TIMEOUT = 15  # seconds for a recorder to stop the signal, drain and disconnect
+KILL_TIMEOUT = 5  # seconds for a killed worker to exit before SIGKILL
+
+_SPAWN = multiprocessing.get_context('spawn')
+
+# Set in the worker process by _init_worker
+_progress = None
+
+
+def _init_worker(progress, backend_dir):
+    global _progress
+    _progress = progress
+    os.chdir(backend_dir)
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+    # The SDK import is what warming is for
+    importlib.import_module('emo3')
+
+
+def _record(output, duration, device):
+    import emo3
+    if duration is None:
+        duration = emo3.RECORD_SECONDS
+    return emo3.record_session(output, duration, device, _progress)
+
+
+def output_for(device):
+    """CSV a device records into: bci_calm.csv unless a device was named."""
+    if not device:
+        return os.path.join(BACKEND_DIR, DEFAULT_OUTPUT)
+    safe = ''.join(c if c.isalnum() else '_' for c in device)
+    return os.path.join(BACKEND_DIR, f'bci_calm_{safe}.csv')
+
+
+def reap_orphans(backend_dir=BACKEND_DIR):
+    """Terminate recorders that still hold an output lock; returns their pids.
+
+    Only a held lock names a process to stop: the holder is alive and is the
+    recorder. A lock file nobody holds was left by a recorder that died, and
+    the pid in it may belong to any process by now; the file is removed.
+    """
+    reaped = []
+    for lock in glob.glob(os.path.join(backend_dir, 'bci_calm*.csv.lock')):
+        output = lock[:-len('.lock')]
+        if not output_lock_held(output):
+            try:
+                os.remove(lock)
+            except OSError:
+                pass
+            continue
+        pid = output_lock_owner(output)
+        if pid and pid != os.getpid():
+            try:
+                os.kill(pid, signal.SIGTERM)
+                reaped.append(pid)
+            except OSError as e:
+                print(f"Could not stop orphaned recorder {pid}: {e}")
+    return reaped
+
+
+class _Session:
+    """One device's warm worker and its current (or last) recording."""
+
+    def __init__(self, device, output):
+        self.device = device
+        self.output = output
+        self.progress = RecorderProgress(_SPAWN)
+        self.worker = None
+        self.pid = None
+        self.future = None
+        self.started_at = None
+        # Held while this device's worker is started or killed and while a
+        # recording is started, which can take the SDK import; the
+        # supervisor's own lock only guards its table of sessions
+        self.lock = threading.Lock()
+
+    def ensure_worker(self):
+        if self.worker is None:
+            # spawn, not fork: the servers that start recordings are threaded
+            # (Flask, uvicorn, the SDK's callbacks), and a forked child can
+            # inherit locks held by threads that do not exist in it
+            self.worker = ProcessPoolExecutor(max_workers=1, mp_context=_SPAWN, initializer=_init_worker,
+                                              initargs=(self.progress, BACKEND_DIR))
+            self.pid = self.worker.submit(os.getpid).result()
+        return self.worker
+
+    def kill_worker(self, timeout=KILL_TIMEOUT):
+        if self.pid is not None and pid_alive(self.pid):
+            os.kill(self.pid, signal.SIGTERM)
+            # The worker's output lock goes with it. One that is still
+            # flushing, or stuck in the SDK, holds it until it exits, and a
+            # new recording of the output has to wait for that
+            if not self._wait_unlocked(timeout):
+                os.kill(self.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+                self._wait_unlocked(timeout)
+        if self.worker is not None:
+            self.worker.shutdown(wait=False, cancel_futures=True)
+        self.worker = None
+        self.pid = None
+
+    def _wait_unlocked(self, timeout):
+        # The OS drops the lock when the worker exits (pid_alive would still
+        # see an unreaped worker); a lock someone else holds is not waited on
+        deadline = time.monotonic() + timeout
+        while output_lock_held(self.output) and output_lock_owner(self.output) == self.pid:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def status(self):
+        status = self.progress.snapshot()
+        status.update({
+            'device': self.device,
+            'output': self.output,
+            'running': self.running,
+            'pid': self.pid,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            'elapsed_seconds': time.time() - self.started_at if self.running else None,
+            'error': None,
+            'pipeline': None,
+        })
+        if self.future is not None and self.future.done():
+            error = self.future.exception()
+            if error is not None:
+                status['phase'] = 'failed'
+                status['error'] = f"{type(error).__name__}: {error}"
+            else:
+                status['pipeline'] = self.future.result()
+        return status
+
+
+class RecorderSupervisor:
+    def __init__(self, reap=True):
+        self._sessions = {}
+        self._lock = threading.Lock()
+        if reap:
+            for pid in reap_orphans():
+                print(f"Stopped orphaned recorder process {pid}")
+
+    def _session(self, device):
+        key = device or ''
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = _Session(device, output_for(device))
+            return session
+
+    def _all_sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def warm(self, device=None):
+        """Start the device's worker now, so the first recording skips the imports."""
+        session = self._session(device)
+        with session.lock:
+            session.ensure_worker()
+
+    def start(self, device=None, duration=None):
+        """Start recording unless this device is already recording.
+
+        Returns (started, status).
+        """
+        session = self._session(device)
+        with session.lock:
+            if session.running:
+                return False, session.status()
+            owner = output_lock_owner(session.output) if output_lock_held(session.output) else None
+            if owner and owner != session.pid:
+                # Someone ran emo3.py by hand on the same output
+                return False, dict(session.status(), error=str(RecorderBusy(
+                    f"{session.output} is being recorded by process {owner}")))
+            session.progress.stop.clear()
+            try:
+                session.future = session.ensure_worker().submit(_record, session.output, duration, device)
+            except BrokenProcessPool:
+                # The worker died between recordings; start a fresh one
+                session.kill_worker()
+                session.future = session.ensure_worker().submit(_record, session.output, duration, device)
+            session.started_at = time.time()
+            return True, session.status()
+
+    def stop(self, device=None, timeout=STOP_TIMEOUT):
+        """Ask the recording to finish, killing the worker if it does not
+        within timeout. Returns (stopped, status)."""
+        with self._lock:
+            session = self._sessions.get(device or '')
+        if session is None or not session.running:
+            return False, session.status() if session else None
+        session.progress.stop.set()
+        try:
+            session.future.exception(timeout)
+        except FutureTimeout:
+            print(f"Recorder for {device or 'default device'} did not stop in {timeout}s; killing it")
+            # Returns once the worker is gone and its output lock with it.
+            # The lock file stays: removing it under a worker that is still
+            # flushing would let another recorder lock a new file for the
+            # same output
+            with session.lock:
+                session.kill_worker()
+        return True, session.status()
+
+    def status(self, device=None):
+        if device is not None:
+            with self._lock:
+                session = self._sessions.get(device or '')
+            return session.status() if session else None
+        return [session.status() for session in self._all_sessions()]
+
+    def shutdown(self, timeout=STOP_TIMEOUT):
+        for session in self._all_sessions():
+            if session.running:
+                self.stop(session.device, timeout)
+            with session.lock:
+                session.kill_worker()
@@ -0,0 +1,171 @@
+# replay.py
+#
+# Offline re-scoring of recorded sessions with a model bundle. Reproduces the
+# epoch logic of realtime_predict_loop in batch form: every epoch_seconds the
+# predictor averages the readings of the last epoch among the last
+# HISTORY_LEN readings bci_api serves, computes the bundle's features and
+# predicts. The output has the realtime_predictions.csv layout.
+#
+#   python replay.py bci_calm.csv old_sessions/*.csv --model model_bundle.pkl --out-dir replays
+#   python replay.py session.csv --workers 4 --session-baseline
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import features
+import model_bundle
+
+# bci_api keeps (and /api/data returns) only its last 10 readings
+HISTORY_LEN = 10
+
+_bundles = {}
+
+
+def _get_bundle(path):
+    # Each pool worker loads a bundle once and reuses it for all its sessions
+    if path not in _bundles:
+        _bundles[path] = model_bundle.load_bundle(path)
+    return _bundles[path]
+
+
+def load_session(path):
+    """Read a recorded session CSV (bci_api or recorder layout).
+
+    Returns (timestamps as strings, seconds since epoch, DataFrame with
+    canonical column names), sorted by time.
+    """
+    df = pd.read_csv(path)
+    df.rename(columns=features.canonical_column, inplace=True)
+    parsed = pd.to_datetime(df['timestamp'])
+    order = np.argsort(parsed.to_numpy(), kind='stable')
+    df = df.iloc[order].reset_index(drop=True)
+    parsed = parsed.iloc[order].reset_index(drop=True)
+    seconds = (parsed - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+    return df['timestamp'].astype(str).to_numpy(), seconds, df
+
+
+def score_session(df, seconds, bundle, baseline=None, history_len=HISTORY_LEN):
+    """Run every epoch of a session at once.
+
+    Returns (ends, values, predictions, artifact_ratio, scored): for each
+    non-empty epoch the index one past its last reading, the feature matrix,
+    the model output, the share of artifacted readings and whether the epoch
+    was clean enough to be scored. Like the live predictor, features only use
+    clean readings and epochs over MAX_ARTIFACT_RATIO are not scored.
+    """
+    names = bundle['features']
+    epoch = bundle['segment_length']
+    baseline = baseline or bundle['baseline']
+    if 'artifacted' in df.columns:
+        artifacted = features.artifact_flags(df['artifacted'].to_numpy())
+    else:
+        artifacted = np.zeros(len(df), dtype=bool)
+    columns = {}
+    for col in features.required_columns(names):
+        values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, copy=True)
+        values[artifacted] = np.nan
+        columns[col] = values
+
+    ticks = np.arange(seconds[0] + epoch, seconds[-1] + epoch, epoch)
+    starts, ends = features.epoch_windows(seconds, ticks, epoch, history_len)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+
+    artifact_ratio = features.windowed_means({'a': artifacted.astype(np.float64)}, starts, ends)['a']
+    scored = artifact_ratio <= features.MAX_ARTIFACT_RATIO
+
+    values = features.compute_features(features.windowed_means(columns, starts, ends), baseline, names)
+    values[~scored] = np.nan
+    X = values[scored]
+    if bundle.get('impute_values') is not None:
+        fill = np.broadcast_to(np.asarray(bundle['impute_values'], dtype=np.float64), X.shape)
+        missing = ~np.isfinite(X)
+        X[missing] = fill[missing]
+    predictions = np.full(len(ends), -1, dtype=int)
+    if len(X):
+        predictions[scored] = bundle['model'].predict(X)
+    return ends, values, predictions, artifact_ratio, scored
+
+
+def replay_session(path, bundle_path, out_dir, session_baseline=False, history_len=HISTORY_LEN):
+    bundle = _get_bundle(bundle_path)
+    # Timed from here: loading the bundle (and sklearn) is a one-off per worker
+    start = time.perf_counter()
+    timestamps, seconds, df = load_session(path)
+    if len(df) == 0:
+        raise ValueError(f"{path} has no readings")
+    model_bundle.validate_bundle(bundle, available_columns=df.columns)
+
+    baseline = None
+    if session_baseline:
+        names = bundle['features']
+        bands = features.baseline_bands(names)
+        baseline = features.compute_baseline(seconds - seconds[0], {b: df[b].to_numpy() for b in bands}, bands)
+
+    ends, values, predictions, artifact_ratio, scored = score_session(df, seconds, bundle, baseline, history_len)
+
+    out = pd.DataFrame(values, columns=bundle['features'])
+    out.insert(0, 'timestamp', timestamps[ends - 1])
+    out['artifact_ratio'] = artifact_ratio
+    # Unscored (artifacted) epochs keep an empty prediction, as in the live CSV
+    out['prediction'] = pd.Series(predictions, dtype='Int64').mask(~scored)
+    out['label'] = np.where(~scored, 'Artifact', np.where(predictions == 1, 'High Load', 'Low Load'))
+    out['model_version'] = bundle['version']
+
+    out_path = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + '_predictions.csv')
+    out.to_csv(out_path, index=False)
+    return {
+        'session': path,
+        'output': out_path,
+        'readings': len(df),
+        'epochs': len(out),
+        'artifacted_epochs': int((~scored).sum()),
+        'high_load_ratio': float(predictions[scored].mean()) if scored.any() else 0.0,
+        'session_seconds': float(seconds[-1] - seconds[0]) if len(seconds) else 0.0,
+        'elapsed_seconds': time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-score recorded sessions with a model bundle')
+    parser.add_argument('sessions', nargs='+', help='session CSVs (bci_model.csv / bci_calm.csv layout)')
+    parser.add_argument('--model', default=model_bundle.BUNDLE_PATH, help='model bundle to score with')
+    parser.add_argument('--out-dir', default='replays', help='directory for *_predictions.csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes to fan sessions out to')
+    parser.add_argument('--history', type=int, default=HISTORY_LEN,
+                        help='readings visible to the predictor per epoch (0 = all in the epoch)')
+    parser.add_argument('--session-baseline', action='store_true',
+                        help="use each session's first minute as baseline instead of the bundle's")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    start = time.perf_counter()
+    workers = max(1, min(args.workers or 1, len(args.sessions)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(replay_session, path, args.model, args.out_dir,
+                               args.session_baseline, args.history)
+                   for path in args.sessions]
+        total_session = 0.0
+        for future in futures:
+            try:
+                r = future.result()
+            except Exception as e:
+                print(f"Error: {e}")
+                continue
+            total_session += r['session_seconds']
+            speedup = r['session_seconds'] / r['elapsed_seconds'] if r['elapsed_seconds'] else float('inf')
+            print(f"{r['session']}: {r['readings']} readings -> {r['epochs']} epochs "
+                  f"({r['artifacted_epochs']} artifacted), "
+                  f"{r['high_load_ratio']:.0%} high load, {r['elapsed_seconds']:.2f}s "
+                  f"({speedup:.0f}x real time) -> {r['output']}")
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {total_session / 3600:.2f} h of recordings in {elapsed:.2f}s with {workers} worker(s)")
+
+
+if __name__ == '__main__':
+    main()
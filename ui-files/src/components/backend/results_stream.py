@@ -0,0 +1,228 @@
+# results_stream.py
+#
+# Chunked, filtered reading of model_output.csv for the /get-results endpoint.
+# The file holds every raw row with its segment features repeated, so the
+# endpoint lets callers cut it down (time range, segment range, label) or ask
+# for one row per segment, and optionally compresses the stream.
+
+import csv
+import io
+import zlib
+from datetime import datetime
+
+DEFAULT_CHUNK_ROWS = 1000
+MAX_CHUNK_ROWS = 50000
+
+# Columns that are not averaged when aggregating per segment
+AGGREGATE_SKIP_COLUMNS = {'timestamp', 'Segment', 'Seconds', 'label', 'artifacted'}
+
+LABEL_ALIASES = {'0': '0', '1': '1', 'low': '0', 'high': '1'}
+
+
+class ResultsQueryError(ValueError):
+    pass
+
+
+def local_time(ts):
+    """ts as a naive local time, the way the CSVs store timestamps; an aware
+    time (a Z or +hh:mm suffix) is converted first."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def parse_time(value, name):
+    """ISO timestamp query argument as a naive local time; raises
+    ResultsQueryError naming the argument if it is not one."""
+    try:
+        return local_time(datetime.fromisoformat(value))
+    except ValueError:
+        raise ResultsQueryError(f"'{name}' must be an ISO timestamp, got '{value}'")
+
+
+def _parse_int(value, name, minimum=None):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ResultsQueryError(f"'{name}' must be an integer, got '{value}'")
+    if minimum is not None and number < minimum:
+        raise ResultsQueryError(f"'{name}' must be at least {minimum}")
+    return number
+
+
+def parse_results_query(args):
+    """Turn request args into a filter dict, raising ResultsQueryError on bad input."""
+    query = {
+        'start': None,
+        'end': None,
+        'segment_from': None,
+        'segment_to': None,
+        'label': None,
+        'aggregate': False,
+        'compression': None,
+        'chunk_rows': DEFAULT_CHUNK_ROWS,
+    }
+    if args.get('start'):
+        query['start'] = parse_time(args['start'], 'start')
+    if args.get('end'):
+        query['end'] = parse_time(args['end'], 'end')
+    if args.get('segment_from'):
+        query['segment_from'] = _parse_int(args['segment_from'], 'segment_from')
+    if args.get('segment_to'):
+        query['segment_to'] = _parse_int(args['segment_to'], 'segment_to')
+    if args.get('label'):
+        label = LABEL_ALIASES.get(args['label'].strip().lower())
+        if label is None:
+            raise ResultsQueryError("'label' must be one of 0, 1, low, high")
+        query['label'] = label
+    aggregate = args.get('aggregate', '')
+    if aggregate not in ('', 'segment'):
+        raise ResultsQueryError("'aggregate' only supports 'segment'")
+    query['aggregate'] = aggregate == 'segment'
+    compression = args.get('compression', '')
+    if compression not in ('', 'gzip', 'zstd'):
+        raise ResultsQueryError("'compression' must be 'gzip' or 'zstd'")
+    query['compression'] = compression or None
+    if args.get('chunk_rows'):
+        query['chunk_rows'] = min(_parse_int(args['chunk_rows'], 'chunk_rows', minimum=1), MAX_CHUNK_ROWS)
+    return query
+
+
+def make_compressor(compression):
+    """Return an object with compress()/flush(), or None for an uncompressed stream."""
+    if compression == 'gzip':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ResultsQueryError("zstd compression needs the 'zstandard' package; use gzip instead")
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def _filtered_rows(reader, header, query):
+    ts_idx = header.index('timestamp')
+    seg_idx = header.index('Segment')
+    label_idx = header.index('label') if 'label' in header else None
+    start, end = query['start'], query['end']
+    seg_from, seg_to = query['segment_from'], query['segment_to']
+    label = query['label']
+
+    for row in reader:
+        if not row:
+            continue
+        segment = int(row[seg_idx])
+        if seg_from is not None and segment < seg_from:
+            continue
+        if seg_to is not None and segment > seg_to:
+            # Rows are written in segment order, nothing further can match
+            break
+        if start is not None or end is not None:
+            ts = local_time(datetime.fromisoformat(row[ts_idx]))
+            if start is not None and ts < start:
+                continue
+            if end is not None and ts > end:
+                break
+        if label is not None and row[label_idx].split('.')[0] != label:
+            continue
+        yield row
+
+
+def _aggregate_segments(rows, header):
+    ts_idx = header.index('timestamp')
+    seg_idx = header.index('Segment')
+    label_idx = header.index('label') if 'label' in header else None
+    value_idx = [i for i, name in enumerate(header) if name not in AGGREGATE_SKIP_COLUMNS]
+
+    current = None
+    for row in rows:
+        segment = row[seg_idx]
+        if current is None or segment != current['segment']:
+            if current is not None:
+                yield _segment_row(current)
+            current = {
+                'segment': segment,
+                'start': row[ts_idx],
+                'end': row[ts_idx],
+                'rows': 0,
+                'sums': [0.0] * len(value_idx),
+                'counts': [0] * len(value_idx),
+                'label': row[label_idx] if label_idx is not None else '',
+            }
+        current['end'] = row[ts_idx]
+        current['rows'] += 1
+        sums, counts = current['sums'], current['counts']
+        for k, i in enumerate(value_idx):
+            # A blank cell (ApEn before its window fills) or a non-numeric one
+            # is left out of the mean rather than counted as 0
+            try:
+                sums[k] += float(row[i])
+            except ValueError:
+                continue
+            counts[k] += 1
+    if current is not None:
+        yield _segment_row(current)
+
+
+def _segment_row(state):
+    means = [s / n if n else '' for s, n in zip(state['sums'], state['counts'])]
+    return [state['segment'], state['start'], state['end'], state['rows']] + means + [state['label']]
+
+
+def aggregate_header(header):
+    values = [name for name in header if name not in AGGREGATE_SKIP_COLUMNS]
+    return ['Segment', 'start', 'end', 'rows'] + values + ['label']
+
+
+def stream_results(csv_path, query):
+    """Yield the (optionally compressed) CSV bytes in chunks of query['chunk_rows'] rows."""
+    compressor = make_compressor(query['compression'])
+    chunk_rows = query['chunk_rows']
+
+    def encode(text, final=False):
+        data = text.encode('utf-8')
+        if compressor is None:
+            return data
+        data = compressor.compress(data)
+        if final:
+            data += compressor.flush()
+        return data
+
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            yield encode('', final=True)
+            return
+
+        # Checked before the first chunk, which the endpoints read before
+        # they start the response
+        missing = [name for name in ('timestamp', 'Segment') if name not in header]
+        if missing:
+            raise ResultsQueryError(f"Results file has no {', '.join(missing)} column")
+        if query['label'] is not None and 'label' not in header:
+            raise ResultsQueryError("Results file has no label column to filter on")
+
+        rows = _filtered_rows(reader, header, query)
+        if query['aggregate']:
+            out_header = aggregate_header(header)
+            rows = _aggregate_segments(rows, header)
+        else:
+            out_header = header
+
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(out_header)
+        pending = 0
+        for row in rows:
+            writer.writerow(row)
+            pending += 1
+            if pending >= chunk_rows:
+                data = encode(buf.getvalue())
+                buf.seek(0)
+                buf.truncate()
+                pending = 0
+                if data:
+                    yield data
+        yield encode(buf.getvalue(), final=True)
@@ -1,8 +1,22 @@
-from flask import Flask, send_file, jsonify
+from flask import Flask, send_file, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
-import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import atexit
+import contextlib
+import importlib
+import io
+import multiprocessing
 import os
+import runpy
+import signal
 import sys
+import threading
+import traceback
+
+from results_stream import ResultsQueryError, parse_results_query, stream_results
+import session_store
+from session_store import SessionStoreError, parse_session_query, sessions_result, stream_session
 
 
 app = Flask(__name__)
@@ -11,8 +25,81 @@ CORS(app)
 def get_backend_dir():
     return os.path.dirname(os.path.abspath(__file__))
 
+# === Long-lived Model Worker ===
+# model.py used to run in a fresh interpreter per request, paying for the
+# pandas/sklearn/matplotlib/seaborn imports every time. A single worker process
+# imports them once and then re-runs the script in place.
+model_worker = None
+model_worker_pid = None  # future of the worker's pid
+model_worker_lock = threading.Lock()
+
+# spawn, as for the recorder workers: a forked worker shares the server's pipes
+# and stdio, so it outlived a server stopped with SIGTERM and kept its stderr open
+_SPAWN = multiprocessing.get_context('spawn')
+
+# What model.py imports; the worker loads them once, so every run finds them loaded
+WARM_MODULES = ('matplotlib.pyplot', 'pandas', 'seaborn', 'sklearn.svm', 'sklearn.model_selection',
+                'sklearn.metrics', 'sklearn.impute')
+
+def _warm_model_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+def _run_model_script(script_path):
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            runpy.run_path(script_path, run_name='__main__')
+    except BaseException:
+        return {'ok': False, 'output': output.getvalue(), 'error': traceback.format_exc()}
+    return {'ok': True, 'output': output.getvalue()}
+
+def get_model_worker():
+    global model_worker, model_worker_pid
+    with model_worker_lock:
+        if model_worker is None:
+            model_worker = ProcessPoolExecutor(max_workers=1, mp_context=_SPAWN, initializer=_warm_model_worker)
+            # Also starts the worker, so the first run finds it warm
+            model_worker_pid = model_worker.submit(os.getpid)
+        return model_worker
+
+def shutdown_model_worker():
+    # Stops the worker even in the middle of a run; waiting for model.py to
+    # finish would hold up the server's exit
+    global model_worker, model_worker_pid
+    with model_worker_lock:
+        worker, pid = model_worker, model_worker_pid
+        model_worker = model_worker_pid = None
+    if worker is None:
+        return
+    if pid.done() and pid.exception() is None:
+        with contextlib.suppress(ProcessLookupError):
+            os.kill(pid.result(), signal.SIGTERM)
+    worker.shutdown(wait=False, cancel_futures=True)
+
+def _exit_on_sigterm(signum, frame):
+    shutdown_model_worker()
+    sys.exit(0)
+
+def run_model_in_worker(script_path):
+    global model_worker
+    try:
+        return get_model_worker().submit(_run_model_script, script_path).result()
+    except BrokenProcessPool:
+        # The worker died (e.g. killed or out of memory); start a fresh one and retry once
+        with model_worker_lock:
+            model_worker = None
+        return get_model_worker().submit(_run_model_script, script_path).result()
+
 @app.route('/run-model', methods=['GET', 'POST'])
 def run_model():
+    payload, status = run_model_job()
+    return jsonify(payload), status
+
+def run_model_job():
+    # Shared with the async server (asgi_server.py); returns (payload, status)
     try:
         # Get the backend directory
         backend_dir = get_backend_dir()
@@ -25,27 +112,28 @@ def run_model():
         print(f"\n=== Checking CSV File ===")
         print(f"Looking for CSV at: {csv_path}")
         if not os.path.exists(csv_path):
-            return jsonify({
+            return {
                 'status': 'Error',
                 'message': f'CSV file not found at {csv_path}'
-            }), 404
+            }, 404
         print(f"CSV file found: {os.path.getsize(csv_path)} bytes")
 
-        # Change to backend directory
-        print(f"\n=== Changing Directory ===")
-        print(f"Changing to: {backend_dir}")
-        os.chdir(backend_dir)
-        print(f"Current working directory: {os.getcwd()}")
-        
-        # Run the model.py script
+        # Run the model.py script in the warm worker
         print(f"\n=== Running Model ===")
-        result = subprocess.run([sys.executable, 'model.py'], 
-                              capture_output=True, 
-                              text=True, 
-                              check=True)
-        
+        result = run_model_in_worker(os.path.join(backend_dir, 'model.py'))
+
+        if not result['ok']:
+            print(f"\n=== Error Output ===")
+            print(result['error'])
+            return {
+                'status': 'Error',
+                'message': 'Error running model',
+                'output': result['output'],
+                'error_output': result['error']
+            }, 500
+
         print(f"\n=== Model Output ===")
-        print(result.stdout)
+        print(result['output'])
         
         # Check if output files were created
         output_files = {
@@ -53,7 +141,8 @@ def run_model():
             'confusion_matrix': os.path.join(backend_dir, 'confusion_matrix.png'),
             'graph_svm': os.path.join(backend_dir, 'graph_svm.png'),
             'model_output': os.path.join(backend_dir, 'model_output.csv'),
-            'trained_model': os.path.join(backend_dir, 'trained_model.pkl')
+            'trained_model': os.path.join(backend_dir, 'trained_model.pkl'),
+            'model_bundle': os.path.join(backend_dir, 'model_bundle.pkl')
         }
         
         # Verify each file exists and has content
@@ -74,58 +163,54 @@ def run_model():
                         if not status['exists'] or status['size'] == 0]
         
         if missing_files:
-            return jsonify({
+            return {
                 'status': 'Warning',
                 'message': f'Model ran but some output files are missing or empty: {", ".join(missing_files)}',
                 'file_status': file_status,
-                'output': result.stdout
-            }), 200
+                'output': result['output']
+            }, 200
         
-        return jsonify({
+        return {
             'status': 'Success',
             'message': 'Model run complete',
             'file_status': file_status,
-            'output': result.stdout
-        }), 200
+            'output': result['output']
+        }, 200
         
-    except subprocess.CalledProcessError as e:
-        print(f"\n=== Error Output ===")
-        print(e.stderr)
-        return jsonify({
-            'status': 'Error',
-            'message': f'Error running model: {str(e)}',
-            'error_output': e.stderr
-        }), 500
     except Exception as e:
         print(f"\n=== Unexpected Error ===")
         print(str(e))
-        return jsonify({
+        return {
             'status': 'Error',
             'message': f'Unexpected error: {str(e)}'
-        }), 500
+        }, 500
 
 @app.route('/get-model-status')
 def get_model_status():
+    payload, status = model_file_status()
+    return jsonify(payload), status
+
+def model_file_status():
     try:
-        model_path = os.path.join(get_backend_dir(), 'svm_model.pkl')
+        model_path = os.path.join(get_backend_dir(), 'model_bundle.pkl')
         if os.path.exists(model_path):
             size = os.path.getsize(model_path)
-            return jsonify({
+            return {
                 'status': 'success',
                 'message': 'Model file exists',
                 'size': size,
                 'path': model_path
-            })
-        return jsonify({
+            }, 200
+        return {
             'status': 'error',
             'message': 'Model file not found',
             'path': model_path
-        }), 404
+        }, 404
     except Exception as e:
-        return jsonify({
+        return {
             'status': 'error',
             'message': f'Error checking model status: {str(e)}'
-        }), 500
+        }, 500
 
 @app.route('/get-graph')
 def get_graph():
@@ -150,10 +235,77 @@ def get_graph_svm():
 
 @app.route('/get-results')
 def get_results():
+    """Download model_output.csv.
+
+    Without query parameters the whole file is sent as before. Any of these
+    switch to a streamed, filtered response:
+      start, end            ISO timestamps bounding the rows
+      segment_from, segment_to
+      label                 0/1 or low/high
+      aggregate=segment     one averaged row per segment
+      compression           gzip or zstd (sent as Content-Encoding)
+      chunk_rows            rows per streamed chunk
+    """
     csv_path = os.path.join(get_backend_dir(), 'model_output.csv')
-    if os.path.exists(csv_path):
+    if not os.path.exists(csv_path):
+        return jsonify({'error': 'Results file not found'}), 404
+    if not request.args:
         return send_file(csv_path, mimetype='text/csv', as_attachment=True)
-    return jsonify({'error': 'Results file not found'}), 404
+
+    try:
+        query = parse_results_query(request.args)
+        # Fail on a missing zstd module now rather than halfway through the stream
+        chunks = stream_results(csv_path, query)
+        first = next(chunks)
+    except ResultsQueryError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        yield first
+        yield from chunks
+
+    filename = 'model_output_segments.csv' if query['aggregate'] else 'model_output.csv'
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if query['compression']:
+        headers['Content-Encoding'] = query['compression']
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
+
+@app.route('/sessions')
+def list_sessions():
+    """Streams in the session store, or ?stream=<name> for its sessions
+    (optionally only those overlapping ISO start/end)."""
+    payload, status = sessions_result(request.args)
+    return jsonify(payload), status
+
+@app.route('/get-session')
+def get_session():
+    """Download one session of a stream, open or archived.
+
+    ?stream=&session= pick it (see /sessions); start/end cut it to a time
+    range; compression is gzip or zstd (sent as Content-Encoding).
+    """
+    try:
+        query = parse_session_query(request.args)
+        chunks = stream_session(query)
+        first = next(chunks, b'')
+    except SessionStoreError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        yield first
+        yield from chunks
+
+    filename = f"{query['stream']}.{query['session']}.csv"
+    headers = {'Content-Disposition': f'attachment; filename={filename}'}
+    if query['compression']:
+        headers['Content-Encoding'] = query['compression']
+    return Response(stream_with_context(generate()), mimetype='text/csv', headers=headers)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001) 
\ No newline at end of file
+    session_store.start_maintenance()
+    atexit.register(shutdown_model_worker)
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    # Spin the worker up in the background so the first /run-model is warm too
+    get_model_worker()
+    app.run(debug=True, port=5001, use_reloader=False)
+ 
\ No newline at end of file
@@ -1,12 +1,51 @@
-from flask import Flask, jsonify
-import subprocess
+from flask import Flask, jsonify, request
+import atexit
+import threading
+
+from recorder_supervisor import RecorderSupervisor
 
 app = Flask(__name__)
 
+# One warm recorder worker per device; see recorder_supervisor.py
+supervisor = None
+supervisor_lock = threading.Lock()
+
+def get_supervisor():
+    global supervisor
+    with supervisor_lock:
+        if supervisor is None:
+            supervisor = RecorderSupervisor()
+            atexit.register(supervisor.shutdown)
+        return supervisor
+
+def recording_options(args):
+    # ?device=<name, serial or address>&duration=<seconds>
+    duration = args.get('duration', type=float)
+    return args.get('device') or None, duration if duration and duration > 0 else None
+
 @app.route("/start_eeg")
 def start_eeg():
-    subprocess.Popen(["python", "emo3.py"])
-    return jsonify({"status": "EEG recording started"})
+    device, duration = recording_options(request.args)
+    started, status = get_supervisor().start(device, duration)
+    if started:
+        return jsonify({"status": "EEG recording started", **status})
+    return jsonify({"status": "EEG recording already running", **status}), 409
+
+@app.route("/stop_eeg", methods=["GET", "POST"])
+def stop_eeg():
+    device, _ = recording_options(request.args)
+    stopped, status = get_supervisor().stop(device)
+    return jsonify({"status": "EEG recording stopped" if stopped else "No EEG recording running", **(status or {})})
+
+@app.route("/eeg_status")
+def eeg_status():
+    device, _ = recording_options(request.args)
+    if device:
+        return jsonify(get_supervisor().status(device) or {"device": device, "running": False})
+    return jsonify(get_supervisor().status())
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Import the SDK before the first /start_eeg instead of on it. The
+    # reloader would start a second supervisor in its child process.
+    get_supervisor().warm()
+    app.run(debug=True, use_reloader=False)
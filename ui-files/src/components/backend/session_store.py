@@ -0,0 +1,670 @@
+# session_store.py
+#
+# Per-session CSV logs for the streams the services write as they run:
+# bci_model (bci_api.py's readings), realtime_predictions (the predictor's
+# epochs) and bci_calm (emo.py's recordings). These used to be single files,
+# appended forever or truncated by the next recording. Here every run of a
+# writer is a session of its own:
+#
+#   sessions/<stream>/<session>/part-0001.csv ...   open, or closed and not yet compacted
+#   sessions/<stream>/<session>.csv.gz               compacted archive (one header)
+#   sessions/<stream>/<session>.json                 its manifest: time range, rows, bytes
+#
+# A session is open while the process that writes it is alive: it holds the
+# session directory's lock (recorder_pipeline's output lock). Within a
+# session the writer starts a new part when the current one reaches
+# MAX_PART_BYTES or MAX_PART_SECONDS, so an append never has to seek through
+# a large file and a part is never written to again once rotated.
+#
+# A maintenance thread (start_maintenance) compacts what is closed in the
+# background: a closed session's parts become one gzip archive and a manifest,
+# and the rotated parts of a session still being written are gzipped where
+# they are. It then applies the retention policy, deleting the oldest archives
+# of a stream beyond RETENTION_DAYS or RETENTION_BYTES. Every service starts
+# one; the session locks keep two of them from compacting the same session.
+#
+# Archives stay queryable: list_sessions() reads the manifests, session_rows()
+# reads any session (open, closed or archived) as CSV rows, and
+# stream_session() serves one cut to a time range for the /get-session routes.
+# pandas (replay.py) reads the .csv.gz archives as they are.
+#
+# The single-file logs from before the store are not touched by the services;
+# moving them in is a one-off migration:
+#
+#   python session_store.py --adopt-legacy bci_model.csv realtime_predictions.csv
+
+import argparse
+import csv
+import glob
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from recorder_pipeline import RecorderBusy, acquire_output_lock, output_lock_held, release_output_lock
+from results_stream import ResultsQueryError, local_time, make_compressor, parse_time
+
+SESSIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions')
+
+# Part rotation: about an hour of bci_model readings at 25/s is 7 MiB
+MAX_PART_BYTES = 16 * 2**20
+MAX_PART_SECONDS = 3600
+# Retention, per stream: archives compacted longer ago than this, or beyond
+# this much disk (oldest first), are deleted. Open sessions are never deleted.
+RETENTION_DAYS = 180
+RETENTION_BYTES = 2 * 2**30
+MAINTENANCE_SECONDS = 600
+
+SESSION_FORMAT = '%Y%m%d-%H%M%S'
+PART_PATTERN = re.compile(r'part-(\d+)\.csv(\.gz)?$')
+DEFAULT_CHUNK_ROWS = 1000
+
+
+class SessionStoreError(ValueError):
+    pass
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# mkstemp creates files 0600; archives and manifests get 0644 less the umask,
+# like the parts they replace, so a service running as another user can read them
+FILE_MODE = 0o644 & ~_umask()
+
+
+def _mkstemp(directory):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    if hasattr(os, 'fchmod'):
+        os.fchmod(fd, FILE_MODE)
+    return fd, tmp_path
+
+
+def stream_dir(stream, root=SESSIONS_DIR):
+    if not stream or os.sep in stream or stream.startswith('.') or (os.altsep and os.altsep in stream):
+        raise SessionStoreError(f"Invalid stream name {stream!r}")
+    return os.path.join(root, stream)
+
+
+def new_session(stream, started=None, root=SESSIONS_DIR):
+    """Create an empty session directory, locked by this process; returns
+    (session id, its path).
+
+    The id is the start time, with a -2, -3 ... suffix when two sessions of a
+    stream start in the same second. The lock is taken before the directory
+    exists, so maintenance never sees the new session as a closed one.
+    """
+    directory = stream_dir(stream, root)
+    os.makedirs(directory, exist_ok=True)
+    base = (started or datetime.now()).strftime(SESSION_FORMAT)
+    session, n = base, 1
+    while True:
+        path = os.path.join(directory, session)
+        if not os.path.exists(path + '.csv.gz'):
+            try:
+                acquire_output_lock(path)
+            except RecorderBusy:
+                pass
+            else:
+                try:
+                    os.mkdir(path)
+                    return session, path
+                except FileExistsError:
+                    release_output_lock(path)
+        n += 1
+        session = f'{base}-{n}'
+
+
+def part_path(session_path, part):
+    return os.path.join(session_path, f'part-{part:04d}.csv')
+
+
+def session_parts(session_path):
+    """Part files of a session directory in order, plain or gzipped.
+
+    A part seen both ways is being compacted; the gzip is complete (it is
+    renamed into place), the plain file is about to go.
+    """
+    parts = {}
+    for name in os.listdir(session_path):
+        match = PART_PATTERN.match(name)
+        if match:
+            number = int(match.group(1))
+            if number not in parts or name.endswith('.gz'):
+                parts[number] = name
+    return [os.path.join(session_path, parts[number]) for number in sorted(parts)]
+
+
+def session_is_open(session_path):
+    return output_lock_held(session_path)
+
+
+class SessionLog:
+    """Append-only CSV log of one session of a stream.
+
+    Rows are written to the current part and flushed, so readers see every
+    complete row; the part is rotated by size and age. One writer thread per
+    log (the callers hold their own locks where they need them).
+    """
+
+    def __init__(self, stream, header, root=SESSIONS_DIR,
+                 max_part_bytes=MAX_PART_BYTES, max_part_seconds=MAX_PART_SECONDS):
+        self.stream = stream
+        self.header = list(header)
+        self.max_part_bytes = max_part_bytes
+        self.max_part_seconds = max_part_seconds
+        self.session, self.path = new_session(stream, root=root)
+        self.part = 0
+        self.rows = 0
+        self.last_row = None
+        self._file = None
+        self._open_part()
+
+    def _open_part(self):
+        self.part += 1
+        self._file = open(part_path(self.path, self.part), 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._part_bytes = self._writer.writerow(self.header)
+        self._part_started = time.monotonic()
+        self._file.flush()
+
+    def rotate(self):
+        """Close the current part and start the next one."""
+        self._file.close()
+        self._open_part()
+
+    def append(self, row):
+        if (self._part_bytes >= self.max_part_bytes
+                or time.monotonic() - self._part_started >= self.max_part_seconds):
+            self.rotate()
+        self._part_bytes += self._writer.writerow(row)
+        self._file.flush()
+        self.rows += 1
+        self.last_row = row
+
+    def last_record(self):
+        """The last row appended, as a dict of CSV text like a reader would get."""
+        if self.last_row is None:
+            return None
+        return dict(zip(self.header, ('' if v is None else str(v) for v in self.last_row)))
+
+    def close(self):
+        """Close the session; the next maintenance pass compacts it."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            release_output_lock(self.path)
+
+    @property
+    def closed(self):
+        return self._file is None
+
+
+def archive_file(path, stream, root=SESSIONS_DIR):
+    """Move a finished CSV (a previous recording, a pre-session log) into the
+    store as a closed session of stream. Returns the session id, or None if
+    there was nothing to keep.
+
+    The session is named after the file's first timestamp (column 0) when it
+    has one, else its modification time. The move is a rename, so this is
+    cheap enough to do right before the file is recorded over.
+    """
+    if not os.path.exists(path):
+        return None
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+        return None
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        first = next(reader, None)
+    if first is None:
+        # Header only
+        os.remove(path)
+        return None
+    try:
+        started = datetime.fromisoformat(first[0])
+    except (ValueError, IndexError):
+        started = datetime.fromtimestamp(os.path.getmtime(path))
+    session, session_path = new_session(stream, started, root)
+    try:
+        os.replace(path, part_path(session_path, 1))
+    finally:
+        release_output_lock(session_path)
+    return session
+
+
+def adopt_legacy(path, stream, root=SESSIONS_DIR):
+    """Archive a single-file log from before the session store, and the
+    copies of it that were moved aside with a timestamp (name.<stamp>.csv).
+
+    The files are moved, not copied; the services never call this, only the
+    --adopt-legacy migration below."""
+    base, ext = os.path.splitext(path)
+    adopted = []
+    for legacy in sorted(glob.glob(f'{glob.escape(base)}.*{ext}')) + [path]:
+        session = archive_file(legacy, stream, root)
+        if session:
+            adopted.append(session)
+    return adopted
+
+
+# === Reading ===
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    try:
+        return open(path, newline='')
+    except FileNotFoundError:
+        # Gzipped by a maintenance pass since the parts were listed
+        return gzip.open(path + '.gz', 'rt', newline='')
+
+
+def _iter_parts(paths):
+    # Header of the first part, then the rows of every part
+    header = None
+    for path in paths:
+        with _open_text(path) as f:
+            reader = csv.reader(f)
+            part_header = next(reader, None)
+            if header is None and part_header is not None:
+                header = part_header
+                yield header
+            for row in reader:
+                if row:
+                    yield row
+
+
+def session_files(stream, session, root=SESSIONS_DIR):
+    """Files holding a session: its archive, or its parts."""
+    directory = stream_dir(stream, root)
+    if os.sep in session or session.startswith('.'):
+        raise SessionStoreError(f"Invalid session {session!r}")
+    archive = os.path.join(directory, session + '.csv.gz')
+    if os.path.exists(archive):
+        return [archive]
+    path = os.path.join(directory, session)
+    if os.path.isdir(path):
+        return session_parts(path)
+    raise SessionStoreError(f"No session {session!r} in stream {stream!r}")
+
+
+def session_rows(stream, session, root=SESSIONS_DIR):
+    """The header, then every row, of a session wherever it is stored."""
+    return _iter_parts(session_files(stream, session, root))
+
+
+def _read_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, payload):
+    fd, tmp_path = _mkstemp(os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(payload, f, indent=1)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _session_start(session):
+    try:
+        return datetime.strptime(session[:15], SESSION_FORMAT).isoformat()
+    except ValueError:
+        return None
+
+
+def list_streams(root=SESSIONS_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if not name.startswith('.') and os.path.isdir(os.path.join(root, name)))
+
+
+def list_sessions(stream, root=SESSIONS_DIR, start=None, end=None):
+    """Sessions of a stream, oldest first, optionally only those overlapping
+    [start, end] (datetimes). Archived sessions are described by their
+    manifest; sessions not compacted yet get their size, and their start from
+    the session id (rows and end are None)."""
+    directory = stream_dir(stream, root)
+    if not os.path.isdir(directory):
+        return []
+    sessions = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith('.json'):
+            manifest = _read_manifest(path)
+            if manifest is None or not os.path.exists(path[:-len('.json')] + '.csv.gz'):
+                continue
+            sessions.append(dict(manifest, open=False, compacted=True))
+        elif os.path.isdir(path):
+            parts = session_parts(path)
+            sessions.append({
+                'stream': stream,
+                'session': name,
+                'started': _session_start(name),
+                'ended': None,
+                'rows': None,
+                'parts': len(parts),
+                'bytes': sum(os.path.getsize(p) for p in parts),
+                'open': session_is_open(path),
+                'compacted': False,
+            })
+    if start is not None or end is not None:
+        start = start and local_time(start)
+        end = end and local_time(end)
+
+        def overlaps(s):
+            started = s['started'] and local_time(datetime.fromisoformat(s['started']))
+            ended = s['ended'] and local_time(datetime.fromisoformat(s['ended']))
+            if end is not None and started and started > end:
+                return False
+            if start is not None and ended and ended < start:
+                return False
+            return True
+        sessions = [s for s in sessions if overlaps(s)]
+    return sessions
+
+
+# === Compaction and retention ===
+def compact_session(stream, session, root=SESSIONS_DIR):
+    """Compact a closed session into <session>.csv.gz plus its manifest and
+    remove the parts. Returns the manifest, or None if the session is open
+    (or being compacted by another process)."""
+    directory = stream_dir(stream, root)
+    path = os.path.join(directory, session)
+    try:
+        acquire_output_lock(path)
+    except RecorderBusy:
+        return None
+    try:
+        if not os.path.isdir(path):
+            return None
+        parts = session_parts(path)
+        archive = path + '.csv.gz'
+        fd, tmp_path = _mkstemp(directory)
+        rows, first, last = 0, None, None
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz, \
+                    io.TextIOWrapper(gz, newline='') as f:
+                writer = csv.writer(f)
+                chunks = _iter_parts(parts)
+                header = next(chunks, None)
+                if header is not None:
+                    writer.writerow(header)
+                for row in chunks:
+                    writer.writerow(row)
+                    rows += 1
+                    if first is None:
+                        first = row[0]
+                    last = row[0]
+            if rows:
+                os.replace(tmp_path, archive)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        manifest = None
+        if rows:
+            manifest = {
+                'stream': stream,
+                'session': session,
+                'started': first,
+                'ended': last,
+                'rows': rows,
+                'parts': len(parts),
+                'bytes': os.path.getsize(archive),
+                'raw_bytes': sum(os.path.getsize(p) for p in parts),
+                'header': header,
+                'compacted_at': datetime.now().isoformat(),
+            }
+            _write_json(path + '.json', manifest)
+        # An empty session leaves nothing behind
+        shutil.rmtree(path)
+        return manifest
+    finally:
+        release_output_lock(path)
+
+
+def compact_parts(session_path):
+    """Gzip the parts of an open session that were rotated out; the last part
+    is the one being written and is left alone. Returns how many were done.
+
+    The session's lock is its writer's, so passes from different services are
+    kept apart by a compaction lock of their own (<session>.compact.lock).
+    """
+    try:
+        acquire_output_lock(session_path + '.compact')
+    except RecorderBusy:
+        return 0
+    try:
+        return _compact_parts(session_path)
+    finally:
+        release_output_lock(session_path + '.compact')
+
+
+def _compact_parts(session_path):
+    plain = [p for p in session_parts(session_path) if p.endswith('.csv')]
+    done = 0
+    for path in plain[:-1]:
+        fd, tmp_path = _mkstemp(session_path)
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as raw, \
+                    gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+                shutil.copyfileobj(src, gz, 2**20)
+            os.replace(tmp_path, path + '.gz')
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        os.remove(path)
+        done += 1
+    return done
+
+
+def apply_retention(stream, root=SESSIONS_DIR, max_days=RETENTION_DAYS, max_bytes=RETENTION_BYTES, now=None):
+    """Delete the archives of a stream compacted more than max_days ago, then
+    the oldest ones until the stream's archives fit in max_bytes. Returns the
+    deleted ids.
+
+    Only archives count against max_bytes: sessions not compacted yet cannot
+    be deleted, and counting a large open session would delete every archive
+    of the stream to make room it does not need.
+    """
+    directory = stream_dir(stream, root)
+    sessions = [s for s in list_sessions(stream, root) if s['compacted']]
+    cutoff = (now or datetime.now()) - timedelta(days=max_days)
+    total = sum(s['bytes'] for s in sessions)
+    deleted = []
+    for s in sessions:
+        # Aged from compaction, which follows the end of a session within a
+        # maintenance interval, so a log adopted from before the store is kept
+        # for the full period too
+        expired = datetime.fromisoformat(s['compacted_at']) < cutoff
+        if not expired and total <= max_bytes:
+            continue
+        base = os.path.join(directory, s['session'])
+        for path in (base + '.json', base + '.csv.gz'):
+            if os.path.exists(path):
+                os.remove(path)
+        total -= s['bytes']
+        deleted.append(s['session'])
+    return deleted
+
+
+def maintain(root=SESSIONS_DIR):
+    """One maintenance pass over every stream: compact closed sessions and
+    rotated parts, then apply the retention policy."""
+    report = {'compacted': 0, 'parts': 0, 'deleted': 0}
+    for stream in list_streams(root):
+        directory = stream_dir(stream, root)
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                if session_is_open(path):
+                    report['parts'] += compact_parts(path)
+                elif compact_session(stream, name, root) is not None:
+                    report['compacted'] += 1
+            except Exception as e:
+                print(f"Session maintenance failed for {stream}/{name}: {e}")
+        report['deleted'] += len(apply_retention(stream, root))
+    return report
+
+
+_maintenance_lock = threading.Lock()
+_maintenance_threads = {}
+
+
+def _maintenance_loop(root, interval):
+    while True:
+        try:
+            maintain(root)
+        except Exception as e:
+            print(f"Session maintenance failed: {e}")
+        time.sleep(interval)
+
+
+def start_maintenance(root=SESSIONS_DIR, interval=MAINTENANCE_SECONDS):
+    """Run maintain(root) now and every interval seconds on a daemon thread
+    (once per process and root)."""
+    with _maintenance_lock:
+        thread = _maintenance_threads.get(root)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_maintenance_loop, args=(root, interval), daemon=True)
+            thread.start()
+            _maintenance_threads[root] = thread
+        return thread
+
+
+# === /sessions and /get-session ===
+def sessions_result(args, root=SESSIONS_DIR):
+    """Payload of /sessions: the streams, or one stream's sessions
+    (?stream=, optional ISO start/end)."""
+    stream = args.get('stream')
+    try:
+        start = parse_time(args['start'], 'start') if args.get('start') else None
+        end = parse_time(args['end'], 'end') if args.get('end') else None
+    except ResultsQueryError as e:
+        return {'error': str(e)}, 400
+    if not stream:
+        return {'streams': {name: len(list_sessions(name, root)) for name in list_streams(root)}}, 200
+    try:
+        return {'stream': stream, 'sessions': list_sessions(stream, root, start, end)}, 200
+    except SessionStoreError as e:
+        return {'error': str(e)}, 400
+
+
+def parse_session_query(args):
+    """stream, session, start, end, compression and chunk_rows of a
+    /get-session request; raises SessionStoreError on bad input."""
+    if not args.get('stream') or not args.get('session'):
+        raise SessionStoreError("'stream' and 'session' are required")
+    query = {'stream': args['stream'], 'session': args['session'], 'start': None, 'end': None,
+             'compression': args.get('compression') or None, 'chunk_rows': DEFAULT_CHUNK_ROWS}
+    for key in ('start', 'end'):
+        if args.get(key):
+            try:
+                query[key] = parse_time(args[key], key)
+            except ResultsQueryError as e:
+                raise SessionStoreError(str(e))
+    if query['compression'] not in (None, 'gzip', 'zstd'):
+        raise SessionStoreError("'compression' must be gzip or zstd")
+    return query
+
+
+def stream_session(query, root=SESSIONS_DIR):
+    """CSV of one session as byte chunks, cut to query's time range and
+    compressed as asked.
+
+    A whole archived session asked for with gzip is sent as the archive's own
+    bytes, without decompressing it.
+    """
+    files = session_files(query['stream'], query['session'], root)
+    if (query['compression'] == 'gzip' and query['start'] is None and query['end'] is None
+            and len(files) == 1 and files[0].endswith('.gz')):
+        return _file_chunks(files[0])
+    try:
+        compressor = make_compressor(query['compression'])
+    except ResultsQueryError as e:
+        raise SessionStoreError(str(e))
+    return _csv_chunks(_iter_parts(files), query, compressor)
+
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(2**16)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _csv_chunks(rows, query, compressor):
+    start, end = query['start'], query['end']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def emit(final=False):
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        if compressor is not None:
+            data = compressor.compress(data) + (compressor.flush() if final else b'')
+        return data
+
+    header = next(rows, None)
+    if header is not None:
+        writer.writerow(header)
+    pending = 0
+    for row in rows:
+        if start is not None or end is not None:
+            try:
+                ts = local_time(datetime.fromisoformat(row[0]))
+            except ValueError:
+                continue
+            if start is not None and ts < start:
+                continue
+            if end is not None and ts > end:
+                # Rows are appended in time order
+                break
+        writer.writerow(row)
+        pending += 1
+        if pending >= query['chunk_rows']:
+            pending = 0
+            chunk = emit()
+            if chunk:
+                yield chunk
+    yield emit(final=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Session store maintenance')
+    parser.add_argument('--adopt-legacy', nargs='+', metavar='CSV', default=[],
+                        help='move single-file logs into the store, as sessions of the stream named after the file')
+    parser.add_argument('--root', default=SESSIONS_DIR, help='session store directory')
+    args = parser.parse_args()
+    if not args.adopt_legacy:
+        parser.error('nothing to do; see --help')
+    for path in args.adopt_legacy:
+        stream = os.path.splitext(os.path.basename(path))[0]
+        sessions = adopt_legacy(path, stream, args.root)
+        print(f"{path}: {len(sessions)} session(s) of {stream}" + (f" ({', '.join(sessions)})" if sessions else ''))
+
+
+if __name__ == '__main__':
+    main()
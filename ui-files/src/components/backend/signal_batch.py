@@ -0,0 +1,40 @@
+# signal_batch.py
+#
+# Converts SDK signal packets into the RawChannels list that
+# EmotionalMath.push_data() expects. The bipolar derivations (T3-O1, T4-O2)
+# are written into RawChannels objects that are kept and reused across
+# packets instead of allocating one object per sample.
+#
+# Pulling the packet into NumPy first was measured as well (see
+# bench_signal_batch.py): the cost is dominated by reading the electrode
+# attributes off the SDK sample objects and push_data() needs Python objects
+# back, so the array round trip is slower than filling the objects directly.
+
+from em_st_artifacts.utils import support_classes
+
+
+class RawChannelsBatch:
+    """Reusable RawChannels buffer for one EmotionalMath instance.
+
+    push_data() copies the samples into native memory before returning, so the
+    same objects can be refilled for the next packet. Not thread-safe: use one
+    batch per thread that calls push_data().
+    """
+
+    def __init__(self, capacity=32):
+        self._channels = []
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        while len(self._channels) < capacity:
+            self._channels.append(support_classes.RawChannels(0.0, 0.0))
+
+    def convert(self, data):
+        n = len(data)
+        if n > len(self._channels):
+            self._grow(n)
+        channels = self._channels[:n]
+        for ch, sample in zip(channels, data):
+            ch.left_bipolar = sample.T3 - sample.O1
+            ch.right_bipolar = sample.T4 - sample.O2
+        return channels
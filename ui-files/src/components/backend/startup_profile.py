@@ -0,0 +1,143 @@
+# startup_profile.py
+#
+# Starts each backend service with `python -X importtime`, waits for the first
+# HTTP response and reports how long that took together with the most
+# expensive imports seen on the way.
+#
+#   python startup_profile.py                 # all services
+#   python startup_profile.py bci_api --top 15
+
+import argparse
+import contextlib
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Service name -> (script, URL that is polled until it answers)
+SERVICES = {
+    'bci_api': ('bci_api.py', 'http://127.0.0.1:5000/api/data'),
+    'run-model': ('run-model.py', 'http://127.0.0.1:5001/get-model-status'),
+    'realtime_predict_api': ('realtime_predict_api.py', 'http://127.0.0.1:6000/latest_prediction'),
+}
+
+# Time-to-first-response targets in seconds. Any HTTP status counts as a
+# response; the point is how long the process takes before it can answer.
+TARGETS = {
+    'bci_api': 1.5,
+    'run-model': 1.5,
+    'realtime_predict_api': 1.5,
+}
+
+def wait_for_first_response(url, proc, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if proc.poll() is not None:
+            return None
+        try:
+            urllib.request.urlopen(url, timeout=0.5).close()
+            return time.perf_counter() - start
+        except urllib.error.HTTPError:
+            # 404 etc. is still an answer from a running server
+            return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.02)
+    return None
+
+def parse_importtime(stderr_text):
+    # Lines look like: "import time:      1234 |      56789 |   package.module"
+    costs = {}
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue
+        name = parts[2].rstrip()
+        # Only count top-level imports; nested ones are included in their parent
+        if name.startswith('  '):
+            continue
+        name = name.strip()
+        costs[name] = max(costs.get(name, 0), cumulative)
+    return sorted(costs.items(), key=lambda item: item[1], reverse=True)
+
+def stop_service(proc, timeout=10):
+    # Signals the service's whole process group: a worker it started that is
+    # still alive keeps the stderr pipe open, and communicate() would wait on it
+    for force in (False, True):
+        if hasattr(os, 'killpg'):
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGKILL if force else signal.SIGTERM)
+        elif force:
+            proc.kill()
+        else:
+            proc.terminate()
+        try:
+            return proc.communicate(timeout=timeout)[1]
+        except subprocess.TimeoutExpired:
+            pass
+    print(f"Process {proc.pid} did not exit; its import times are not available")
+    return ''
+
+def profile_service(name, top=10, timeout=60):
+    script, url = SERVICES[name]
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', script],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,  # its own process group, workers included
+    )
+    try:
+        elapsed = wait_for_first_response(url, proc, timeout)
+    finally:
+        stderr_text = stop_service(proc)
+
+    target = TARGETS.get(name)
+    print(f"\n=== {name} ===")
+    if elapsed is None:
+        print(f"No response within {timeout}s (exit code {proc.returncode})")
+    else:
+        status = 'OK' if target is None or elapsed <= target else 'OVER TARGET'
+        print(f"Time to first response: {elapsed:.3f}s (target {target}s) {status}")
+
+    imports = parse_importtime(stderr_text)
+    total_us = sum(cost for _, cost in imports)
+    print(f"Top-level import time: {total_us / 1e6:.3f}s")
+    for module, cost in imports[:top]:
+        print(f"  {cost / 1e3:9.1f} ms  {module}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile backend service startup')
+    parser.add_argument('services', nargs='*', help='services to profile (default: all)')
+    parser.add_argument('--top', type=int, default=10, help='number of imports to list')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a response')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.services if name not in SERVICES]
+    if unknown:
+        parser.error(f"unknown service(s): {', '.join(unknown)}; choose from {', '.join(SERVICES)}")
+
+    results = {}
+    for name in args.services or list(SERVICES):
+        results[name] = profile_service(name, top=args.top, timeout=args.timeout)
+
+    over = [name for name, elapsed in results.items()
+            if elapsed is None or elapsed > TARGETS.get(name, float('inf'))]
+    if over:
+        print(f"\nOver target: {', '.join(over)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# stress_bci_api.py
+#
+# Hammers /api/data from many threads while a simulated headband streams
+# through bci_api.on_signal_received as fast as it can, and checks every
+# response for torn state. The fake EmotionalMath emits readings whose
+# fields are derived from one counter (beta = alpha + 0.25,
+# theta = alpha + 0.5), so a reading assembled from two updates is caught,
+# as is a history that is out of order or longer than HISTORY_LEN.
+#
+#   python stress_bci_api.py --clients 32 --seconds 10
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+
+import bci_api
+import session_store
+
+
+class _Spec:
+    __slots__ = ('alpha', 'beta', 'theta')
+
+    def __init__(self, k):
+        self.alpha = float(k)
+        self.beta = k + 0.25
+        self.theta = k + 0.5
+
+
+class FakeMath:
+    """Stands in for EmotionalMath: every packet yields rows_per_packet readings."""
+
+    def __init__(self, rows_per_packet=5, artifact_every=50):
+        self.rows_per_packet = rows_per_packet
+        self.artifact_every = artifact_every
+        self.counter = 0
+        self.packets = 0
+
+    def push_data(self, data):
+        pass
+
+    def process_data_arr(self):
+        self.packets += 1
+
+    def is_both_sides_artifacted(self):
+        return self.packets % self.artifact_every == 0
+
+    def is_artifacted_sequence(self):
+        return False
+
+    def calibration_finished(self):
+        return True
+
+    def read_mental_data_arr(self):
+        return [None] * self.rows_per_packet
+
+    def read_spectral_data_percents_arr(self):
+        start = self.counter
+        self.counter += self.rows_per_packet
+        return [_Spec(k) for k in range(start, self.counter)]
+
+
+class _PassThrough:
+    def convert(self, data):
+        return data
+
+
+def check_snapshot(readings):
+    """Problems found in one /api/data response (empty list if none)."""
+    problems = []
+    if len(readings) > bci_api.HISTORY_LEN:
+        problems.append(f"history of {len(readings)} readings")
+    previous = None
+    for r in readings:
+        missing = set(bci_api.MODEL_CSV_FIELDS) - set(r)
+        if missing:
+            problems.append(f"reading without {sorted(missing)}")
+            continue
+        if r['beta'] != r['alpha'] + 0.25 or r['theta'] != r['alpha'] + 0.5:
+            problems.append(f"torn reading {r}")
+        if previous is not None and r['alpha'] <= previous:
+            problems.append(f"history out of order at {r['alpha']}")
+        previous = r['alpha']
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stress /api/data against a simulated sensor')
+    parser.add_argument('--clients', type=int, default=32, help='polling threads')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rows-per-packet', type=int, default=5)
+    parser.add_argument('--switch-interval', type=float, default=5e-4,
+                        help='GIL switch interval; shorter means more thread interleavings to catch races')
+    args = parser.parse_args()
+    sys.setswitchinterval(args.switch_interval)
+
+    tmp = tempfile.mkdtemp(prefix='bci_stress_')
+    bci_api.model_log = session_store.SessionLog(bci_api.MODEL_STREAM, bci_api.MODEL_CSV_FIELDS, root=tmp)
+    bci_api.raw_batch = _PassThrough()
+    fake = bci_api.math = FakeMath(args.rows_per_packet)
+
+    stop = threading.Event()
+    stats = {'requests': 0, 'readings_seen': 0, 'problems': [], 'errors': []}
+    lock = threading.Lock()
+
+    def sensor():
+        while not stop.is_set():
+            bci_api.on_signal_received(None, None)
+
+    def client():
+        requests_done = seen = 0
+        problems, errors = [], []
+        http = bci_api.app.test_client()
+        while not stop.is_set():
+            try:
+                resp = http.get('/api/data')
+                if resp.status_code != 200:
+                    errors.append(f"HTTP {resp.status_code}")
+                    continue
+                readings = resp.get_json()
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                continue
+            requests_done += 1
+            seen += len(readings)
+            problems.extend(check_snapshot(readings))
+        with lock:
+            stats['requests'] += requests_done
+            stats['readings_seen'] += seen
+            stats['problems'].extend(problems)
+            stats['errors'].extend(errors)
+
+    threads = [threading.Thread(target=sensor)] + [threading.Thread(target=client) for _ in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.clients} clients, {elapsed:.1f}s: sensor produced {fake.counter} readings "
+          f"({fake.counter / elapsed:.0f}/s); {stats['requests']} requests ({stats['requests'] / elapsed:.0f}/s), "
+          f"{stats['readings_seen']} readings checked")
+    print(f"torn/inconsistent snapshots: {len(stats['problems'])}, request errors: {len(stats['errors'])}")
+    for line in (stats['problems'] + stats['errors'])[:10]:
+        print('  ', line)
+    return 1 if stats['problems'] or stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
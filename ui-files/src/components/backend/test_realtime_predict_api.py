@@ -0,0 +1,64 @@
+# test_realtime_predict_api.py
+#
+#   python -m pytest test_realtime_predict_api.py
+
+import time
+
+import numpy as np
+import pytest
+
+import realtime_predict_api as predictor
+from reading import Reading, readings_array
+
+
+class StopLoop(BaseException):
+    pass
+
+
+class Log:
+    def __init__(self):
+        self.rows = []
+
+    def append(self, row):
+        self.rows.append(row)
+
+
+def make_bundle(version):
+    return {'version': version, 'segment_length': 3, 'features': ['CI_Alpha']}
+
+
+def test_epoch_swapped_mid_prediction_is_recomputed(monkeypatch):
+    old, new = make_bundle(1), make_bundle(2)
+    now = time.time()
+    rows = readings_array([Reading(now - 1, 0.3, 0.2, 0.4), Reading(now, 0.3, 0.2, 0.4)])
+    predicted_with = []
+    slept = []
+
+    def predict_epoch(readings, current):
+        predicted_with.append(current['version'])
+        if len(predicted_with) == 1:
+            # A reload lands between predict_epoch and record_epoch's write
+            predictor.bundle = new
+        return np.array([0.5]), 1, 'High Load', 0.0
+
+    def sleep(seconds):
+        slept.append(seconds)
+        raise StopLoop
+
+    log = Log()
+    monkeypatch.setattr(predictor, 'bundle', old)
+    monkeypatch.setattr(predictor, 'prediction_log', log)
+    monkeypatch.setattr(predictor, 'online_mode', None)
+    monkeypatch.setattr(predictor, 'load_model', lambda: True)
+    monkeypatch.setattr(predictor, 'model_watch_loop', lambda: None)
+    monkeypatch.setattr(predictor, 'fetch_readings', lambda: rows)
+    monkeypatch.setattr(predictor, 'predict_epoch', predict_epoch)
+    monkeypatch.setattr(predictor.time, 'sleep', sleep)
+
+    with pytest.raises(StopLoop):
+        predictor.realtime_predict_loop()
+
+    # Recomputed with the new bundle before the loop slept, and only that row written
+    assert predicted_with == [1, 2]
+    assert len(slept) == 1
+    assert [row[-1] for row in log.rows] == [2]
@@ -0,0 +1,40 @@
+# test_results_stream.py
+#
+#   python -m pytest test_results_stream.py
+
+import csv
+import io
+
+import pytest
+
+from results_stream import parse_results_query, stream_results
+
+HEADER = ['timestamp', 'alpha', 'alpha_apen_x', 'Seconds', 'Segment', 'artifacted', 'label']
+
+
+def aggregated(tmp_path, rows):
+    path = tmp_path / 'model_output.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+    query = parse_results_query({'aggregate': 'segment'})
+    text = b''.join(stream_results(str(path), query)).decode()
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def test_blank_cells_are_left_out_of_segment_means(tmp_path):
+    rows = [
+        ['2025-06-07 13:32:50', '0.2', '', '0.0', '0', 'False', '1'],
+        ['2025-06-07 13:32:51', '0.4', '', '1.0', '0', 'True', '1'],
+        ['2025-06-07 13:32:52', '0.3', '0.3', '2.0', '0', 'False', '1'],
+        ['2025-06-07 13:32:53', '0.5', '', '0.0', '1', 'False', '0'],
+    ]
+    first, second = aggregated(tmp_path, rows)
+
+    assert first['rows'] == '3'
+    assert float(first['alpha']) == pytest.approx(0.3)
+    # One non-blank ApEn in segment 0, none in segment 1
+    assert float(first['alpha_apen_x']) == 0.3
+    assert second['alpha_apen_x'] == ''
+    assert 'artifacted' not in first
@@ -48,6 +48,13 @@ const ResultsPage = () => {
                 />
               </div>
             )}
+            {/* One averaged row per segment, gzipped in transit: a small fraction of the raw export */}
+            <a
+              href="http://localhost:5001/get-results?aggregate=segment&compression=gzip"
+              className="inline-block underline text-primary"
+            >
+              Download per-segment results (CSV)
+            </a>
           </div>
         )}
       </div>